@@ -0,0 +1,166 @@
+"""
+Everything here runs in the anticheat's process pool, so it only needs
+numpy and osrparse and doesn't touch the rest of the server.
+"""
+from anticheat.utils.beatmap import Beatmap
+from constants.mods import Mods
+from typing import Any, Union
+from osrparse import parse_replay
+import numpy as np
+
+# what osu! records at, in real time
+FRAME_TIME = 1000 / 60
+
+# M1 and M2, K1/K2 set them too
+BUTTONS = (1 << 0, 1 << 1)
+
+# what's used when the config doesn't say otherwise
+LIMITS = {
+    "min_hits": 50,  # below this there isn't enough to judge
+    "ur": 50.0,
+    "hold_std": 3.0,
+    "frametime": 0.15,  # how far off 60 fps the frames may be
+    "snaps": 0.15,
+}
+
+
+def frames(raw: Union[bytes, memoryview]) -> np.ndarray:
+    """The replay data as rows of (time, x, y, keys), times added up."""
+    play = parse_replay(bytes(raw), pure_lzma=True).play_data
+
+    data = np.array(
+        [(e.time_delta, e.x, e.y, int(e.keys)) for e in play], dtype=np.float64
+    ).reshape(-1, 4)
+
+    # the first two frames are always (0, 256, -500) and (-1, 256, -500)
+    data = data[2:]
+    data[:, 0] = np.cumsum(data[:, 0])
+
+    return data
+
+
+def _std(a: np.ndarray) -> float:
+    return float(a.std()) if len(a) > 1 else 0.0
+
+
+def _mean(a: np.ndarray) -> float:
+    return float(a.mean()) if len(a) else 0.0
+
+
+def analyse(
+    raw: Union[bytes, memoryview],
+    path: str,
+    mods: int,
+    limits: dict[str, Any] = LIMITS,
+) -> dict[str, Any]:
+    """
+    Metrics of an osu!standard replay on its map, and which of them are
+    off enough for someone to have a look. Times are in milliseconds of
+    real time, so they're comparable across speed mods.
+    """
+    limits = LIMITS | limits
+
+    data = frames(raw)
+    m = Beatmap.from_file(path, hr=bool(mods & Mods.HARDROCK))
+
+    rate = 1.0
+    if mods & (Mods.DOUBLETIME | Mods.NIGHTCORE):
+        rate = 1.5
+    elif mods & Mods.HALFTIME:
+        rate = 0.75
+
+    cs, od = m.cs, m.od
+    if mods & Mods.HARDROCK:
+        cs, od = min(cs * 1.3, 10), min(od * 1.4, 10)
+    elif mods & Mods.EASY:
+        cs, od = cs * 0.5, od * 0.5
+
+    radius = 54.4 - 4.48 * cs
+    window = 199.5 - 10 * od  # for a 50, in map time
+
+    t, x, y = data[:, 0], data[:, 1], data[:, 2]
+    keys = data[:, 3].astype(np.int64)
+    prev = np.zeros_like(keys)
+    prev[1:] = keys[:-1]
+
+    down = keys & ~prev
+    up = prev & ~keys
+
+    # a frame where any button went down is a press
+    press = np.flatnonzero(down & (BUTTONS[0] | BUTTONS[1]))
+    press_t = t[press]
+
+    # hit errors: the first press in the 50 window of every object,
+    # each press only counts for one object.
+    first = np.searchsorted(press_t, m.time - window)
+    hit = first < len(press_t)
+    hit[hit] &= press_t[first[hit]] <= m.time[hit] + window
+
+    objects = np.flatnonzero(hit)
+    used, unique = np.unique(first[objects], return_index=True)
+    objects = objects[unique]
+
+    errors = (press_t[used] - m.time[objects]) / rate
+
+    # aim: how far from the center the cursor was when it hit, and how
+    # far it had moved in the frame right before.
+    f = press[used]
+    offset = np.hypot(x[f] - m.x[objects], y[f] - m.y[objects]) / radius
+
+    g = np.maximum(f - 1, 0)
+    jump = np.hypot(x[f] - x[g], y[f] - y[g])
+    snaps = (jump > radius * 2) & (offset < 0.25)
+
+    # how long every button was held, pairing each press with the next release
+    holds = []
+    for button in BUTTONS:
+        pressed = t[np.flatnonzero(down & button)]
+        released = t[np.flatnonzero(up & button)]
+
+        after = np.searchsorted(released, pressed, side="right")
+        ok = after < len(released)
+        holds.append(released[after[ok]] - pressed[ok])
+
+    hold = np.concatenate(holds) / rate
+
+    # frame times, with the frames sent between two 60 fps ones on key changes
+    deltas = np.diff(t)
+    deltas = deltas[deltas > 0] / rate
+
+    ret = {
+        "objects": len(m),
+        "hits": len(objects),
+        "ur": _std(errors) * 10,
+        "mean_error": _mean(errors),
+        "offset": _mean(offset),
+        "snap_distance": _mean(jump),
+        "snaps": _mean(snaps),
+        "frametime": float(np.median(deltas)) if len(deltas) else 0.0,
+        "frametime_p5": float(np.percentile(deltas, 5)) if len(deltas) else 0.0,
+        "frametime_p95": float(np.percentile(deltas, 95)) if len(deltas) else 0.0,
+        "hold": _mean(hold),
+        "hold_std": _std(hold),
+        "flags": [],
+    }
+
+    enough = ret["hits"] >= limits["min_hits"]
+    flags = ret["flags"]
+
+    # relax presses for you, autopilot aims for you
+    if enough and not mods & Mods.RELAX:
+        if ret["ur"] < limits["ur"]:
+            flags.append("ur")
+
+        if len(hold) >= limits["min_hits"] and ret["hold_std"] < limits["hold_std"]:
+            flags.append("hold")
+
+    if enough and not mods & Mods.RELAX2 and ret["snaps"] > limits["snaps"]:
+        flags.append("snaps")
+
+    if (
+        len(deltas) >= limits["min_hits"]
+        and abs(ret["frametime"] / FRAME_TIME - 1) > limits["frametime"]
+    ):
+        flags.append("frametime")
+
+    return ret
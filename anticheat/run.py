@@ -1,29 +1,78 @@
-# from anticheat.utils.beatmap import Beatmap
-# from osrparse import Replay
-# from constants.mods import Mods
-# from utils.replay import write_replay
-# from constants.playmode import Mode
+from concurrent.futures import ProcessPoolExecutor
+from anticheat.analysis import analyse
+from typing import Any
+from objects import services
+from utils import log
+import multiprocessing
+import asyncio
+import json
+import time
 
+# flagged scores waiting for staff to look at them, score id -> report
+REVIEWS = "ragnarok:anticheat"
 
-# forget this
-# async def run_anticheat(score, score_file_name: int, beatmap_file_name: str):
-#     if score.mode != Mode.OSU:
-#         return
+conf = services.config["server"].get("anticheat", {})
 
-#     r = Replay.from_string(await write_replay(s=score, file_name=score_file_name))
+# spawned instead of forked, the server has threads
+# and connections the workers shouldn't get a copy of.
+executor = ProcessPoolExecutor(
+    max_workers=conf.get("workers", 2),
+    mp_context=multiprocessing.get_context("spawn"),
+)
 
-#     hitobjects = await Beatmap().parse_hitobjects(
-#         beatmap_file_name, hr=r.mods & Mods.HARDROCK
-#     )
+checked = 0
+flagged = 0
+check_time = 0.0
 
-#     c_aim = 0
-#     for aim in r.replay_data:
-#         aim.xy = aim.x + aim.y
 
-#         for obj in hitobjects:
-#             if aim.x == obj.x and aim.y == obj.y:
-#                 c_aim += 1
+@services.jobs.register("anticheat")
+async def run_anticheat(
+    score_id: int, user_id: int, map_md5: str, map_id: int, mods: int
+) -> None:
+    global checked, flagged, check_time
 
-#     # I'm not 100% sure, if this works or not lol
+    if not (raw := await services.replays.get(score_id)):
+        return
 
-#     # print(f"{c_aim} / {len(hitobjects)} * 100 = {c_aim / len(hitobjects) * 100}")
+    if not (path := await services.beatmap_files.get(map_md5, map_id)):
+        return
+
+    start = time.perf_counter()
+
+    loop = asyncio.get_running_loop()
+    ret = await loop.run_in_executor(
+        executor, analyse, raw, path, mods, conf.get("limits", {})
+    )
+
+    checked += 1
+    check_time += time.perf_counter() - start
+
+    if not ret["flags"]:
+        return
+
+    flagged += 1
+    ret |= {
+        "score_id": score_id,
+        "user_id": user_id,
+        "map_md5": map_md5,
+        "mods": mods,
+        "time": int(time.time()),
+    }
+
+    await services.redis.hset(REVIEWS, score_id, json.dumps(ret))
+    log.warn(
+        f"Score {score_id} by user {user_id} was flagged for review "
+        f"({', '.join(ret['flags'])})"
+    )
+
+
+async def reviews() -> list[dict[str, Any]]:
+    """Every flagged score that wasn't dismissed yet, oldest first."""
+    return sorted(
+        (json.loads(r) for r in (await services.redis.hgetall(REVIEWS)).values()),
+        key=lambda r: r["time"],
+    )
+
+
+async def dismiss(score_id: int) -> bool:
+    return bool(await services.redis.hdel(REVIEWS, score_id))
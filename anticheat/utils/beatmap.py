@@ -1,41 +1,65 @@
-import aiofiles
+import numpy as np
 
+SPINNER = 1 << 3
 
-class HitObject:
-    def __init__(self):
-        self.time: int = 0
 
-        self.x: int = 0
-        self.y: int = 0
-        self.xy: int = 0
+class Beatmap:
+    """
+    The parts of an .osu the anticheat needs: circle size, overall
+    difficulty, and every hit object as columns (time, x, y). Spinners
+    are left out, they don't have a position to aim at.
+    """
 
-    @classmethod
-    def from_str(cls, line, hr: bool = False):
-        args = line.split(",")
+    def __init__(self) -> None:
+        self.cs: float = 5.0
+        self.od: float = 5.0
+
+        self.time: np.ndarray = np.empty(0)
+        self.x: np.ndarray = np.empty(0)
+        self.y: np.ndarray = np.empty(0)
 
-        s = cls()
+    def __len__(self) -> int:
+        return len(self.time)
 
-        s.time = int(args[2])
-        s.x = int(args[0])
-        s.y = 384 - int(args[1]) if hr else int(args[1])
+    @classmethod
+    def from_file(cls, path: str, hr: bool = False) -> "Beatmap":
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            return cls.from_str(f.read(), hr)
+
+    @classmethod
+    def from_str(cls, content: str, hr: bool = False) -> "Beatmap":
+        self = cls()
+        section = ""
+        objects = []
 
-        s.xy = s.x + s.y
+        for line in content.splitlines():
+            if not (line := line.strip()) or line.startswith("//"):
+                continue
 
-        return s
+            if line[0] == "[":
+                section = line
+                continue
 
+            if section == "[Difficulty]":
+                key, _, value = line.partition(":")
 
-class Beatmap(list):
-    async def parse_hitobjects(self, file_name: str, hr: bool = False):
-        lines = None
+                if key == "CircleSize":
+                    self.cs = float(value)
+                elif key == "OverallDifficulty":
+                    self.od = float(value)
+            elif section == "[HitObjects]":
+                objects.append(line.split(",", 4)[:4])
 
-        async with aiofiles.open(file_name, "r") as file:
-            lines = await file.readlines()
+        if not objects:
+            return self
 
-        for idx, line in enumerate(lines):
-            if line == "[HitObjects]\n":
-                lines = lines[idx + 1 :]
+        # x, y, time, type
+        data = np.array(objects, dtype=np.float64)
+        kind = data[:, 3].astype(np.int64)
+        data = data[(kind & SPINNER) == 0]
 
-        for line in lines:
-            super().append(HitObject.from_str(line))
+        self.x = data[:, 0]
+        self.y = 384 - data[:, 1] if hr else data[:, 1]
+        self.time = data[:, 2]
 
         return self
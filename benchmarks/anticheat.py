@@ -0,0 +1,178 @@
+"""
+The anticheat on a made up 10 minute map, with a replay hitting every
+object (an object every 150ms, a frame every 16ms).
+
+"before" is the draft that used to be in `anticheat/run.py`, comparing
+every frame to every object; since that grows with the square of the
+length, it only runs on the first minute and the rest is extrapolated.
+"after" is `anticheat.analysis.analyse` on the whole map, in this process
+and in the process pool, where it's also checked how long the event loop
+had to wait at most while replays were being analysed.
+
+    python -m benchmarks.anticheat [replays]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from anticheat.analysis import analyse, frames
+from osrparse import parse_replay
+import multiprocessing
+import tempfile
+import asyncio
+import random
+import lzma
+import math
+import time
+import sys
+import os
+
+LENGTH = 10 * 60 * 1000
+OBJECT_GAP = 150
+FRAME_TIME = 16
+
+
+def make_map(length: int) -> tuple[str, list[tuple[int, int, int]]]:
+    objects = [
+        (random.randint(0, 512), random.randint(0, 384), t)
+        for t in range(1000, length, OBJECT_GAP)
+    ]
+
+    lines = [
+        "osu file format v14",
+        "",
+        "[Difficulty]",
+        "CircleSize:4",
+        "OverallDifficulty:8",
+        "",
+        "[HitObjects]",
+        *(f"{x},{y},{t},1,0,0:0:0:0:" for x, y, t in objects),
+    ]
+
+    return "\n".join(lines), objects
+
+
+def make_replay(objects: list[tuple[int, int, int]], length: int) -> bytes:
+    events = ["0|256|-500|0", "-1|256|-500|0"]
+
+    presses = {
+        (t + int(random.gauss(0, 12))) // FRAME_TIME * FRAME_TIME: idx
+        for idx, (_, _, t) in enumerate(objects)
+    }
+    holding = 0
+    key = 1
+    target = 0
+    last = 0
+
+    for t in range(0, length, FRAME_TIME):
+        while target < len(objects) - 1 and objects[target][2] < t:
+            target += 1
+
+        # move towards the next object, with a bit of shake
+        x, y, _ = objects[target]
+        x += random.gauss(0, 8)
+        y += random.gauss(0, 8)
+
+        keys = 0
+        if t in presses:
+            key = 3 - key  # alternate between M1 and M2
+            holding = t + random.randint(60, 100)
+
+        if t < holding:
+            keys = key
+
+        events.append(f"{t - last}|{x:.2f}|{y:.2f}|{keys}")
+        last = t
+
+    events.append("-12345|0|0|0")
+
+    return lzma.compress(",".join(events).encode() + b",", format=lzma.FORMAT_ALONE)
+
+
+def old_check(raw: bytes, objects: list[tuple[int, int, int]]) -> int:
+    c_aim = 0
+
+    for aim in parse_replay(raw, pure_lzma=True).play_data:
+        for ox, oy, _ in objects:
+            if aim.x == ox and aim.y == oy:
+                c_aim += 1
+
+    return c_aim
+
+
+async def loop_lag(pool: ProcessPoolExecutor, raw: bytes, path: str, amount: int) -> float:
+    loop = asyncio.get_running_loop()
+    lag = 0.0
+    running = True
+
+    async def ticker() -> None:
+        nonlocal lag
+
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.gather(
+        *(loop.run_in_executor(pool, analyse, raw, path, 0) for _ in range(amount))
+    )
+
+    running = False
+    await task
+
+    return lag
+
+
+def main() -> None:
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    random.seed(0)
+
+    content, objects = make_map(LENGTH)
+    raw = make_replay(objects, LENGTH)
+
+    # the first minute of the same play
+    minute = [o for o in objects if o[2] < 60_000]
+    raw_minute = make_replay(minute, 60_000)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "map.osu")
+
+        with open(path, "w") as f:
+            f.write(content)
+
+        print(f"{len(objects)} objects, {len(frames(raw))} frames, {len(raw)} bytes")
+
+        start = time.perf_counter()
+        old_check(raw_minute, minute)
+        elapsed = time.perf_counter() - start
+        scale = (LENGTH / 60_000) ** 2
+
+        print(f"{'before (1 minute)':<24} {elapsed:8.2f}s")
+        print(f"{'before (extrapolated)':<24} {elapsed * scale:8.2f}s")
+
+        start = time.perf_counter()
+        ret = analyse(raw, path, 0)
+        elapsed = time.perf_counter() - start
+
+        print(f"{'after (1 process)':<24} {elapsed:8.2f}s")
+        print(
+            f"  {ret['hits']}/{ret['objects']} hits, {ret['ur']:.1f} UR, "
+            f"{ret['frametime']:.1f}ms frames, flags: {ret['flags'] or 'none'}"
+        )
+
+        with ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            # start the workers up first, that isn't part of it
+            list(pool.map(math.sqrt, range(pool._max_workers)))
+
+            start = time.perf_counter()
+            lag = asyncio.run(loop_lag(pool, raw, path, amount))
+            elapsed = time.perf_counter() - start
+
+            print(
+                f"{f'after ({pool._max_workers} processes)':<24} {elapsed:8.2f}s "
+                f"{amount / elapsed:8.1f} replays/s, event loop waited {lag * 1000:.1f}ms at most"
+            )
+
+
+if __name__ == "__main__":
+    main()
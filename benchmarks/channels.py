@@ -0,0 +1,108 @@
+"""
+Join/leave churn and message fan-out on a 5k member channel.
+
+"before" emulates the old list based membership, "after" goes through
+`Player.join_channel`/`leave_channel` and `Channel.enqueue`. Both fan out
+to their members in the order the churn left them in; in creation order
+the players are next to each other in memory, which is a lot faster and
+not what a channel looks like after a while.
+
+    python -m benchmarks.channels
+"""
+from objects.collections import Tokens, Channels
+from objects.channel import Channel
+from objects.player import Player
+from objects import services
+from packets import writer
+import asyncio
+import random
+import time
+
+MEMBERS = 5_000
+CHURN = 20_000
+
+
+def old_churn(connected: list[Player], churn: list[Player]) -> float:
+    start = time.perf_counter()
+
+    for p in churn:
+        connected.remove(p)
+        connected.append(p)
+
+    return time.perf_counter() - start
+
+
+async def new_churn(chan: Channel, churn: list[Player]) -> float:
+    start = time.perf_counter()
+
+    for p in churn:
+        await p.leave_channel(chan, kicked=False)
+        await p.join_channel(chan)
+
+    return time.perf_counter() - start
+
+
+def old_fanout(members: list[Player], frame: bytes, sender: int) -> float:
+    start = time.perf_counter()
+
+    for p in members:
+        if p.id not in [sender]:
+            p.enqueue(frame)
+
+    return time.perf_counter() - start
+
+
+def new_fanout(chan: Channel, frame: bytes, sender: int) -> float:
+    start = time.perf_counter()
+    chan.enqueue(frame, ignore={sender})
+    return time.perf_counter() - start
+
+
+async def main() -> None:
+    # channel info updates go to everyone online; leave that
+    # out, so we're only measuring the membership itself.
+    services.players = Tokens()
+    services.channels = Channels()
+
+    services.channels.add({"name": "#osu", "description": "bench"})
+    chan = services.channels.get("#osu")
+
+    members = [Player(f"user {i}", i, 4, "") for i in range(MEMBERS)]
+
+    for p in members:
+        await p.join_channel(chan)
+
+    churn = random.choices(members, k=CHURN)
+    connected = list(members)
+
+    before = old_churn(connected, churn)
+    after = await new_churn(chan, churn)
+
+    print(
+        f"join/leave x{CHURN}: before {before * 1e3:.1f}ms "
+        f"after {after * 1e3:.1f}ms ({before / after:.1f}x)"
+    )
+
+    frame = writer.SendMessage("user 0", "hello!", "#osu", 0)
+
+    before = after = float("inf")
+
+    for _ in range(20):
+        before = min(before, old_fanout(connected, frame, 0))
+
+        for p in members:
+            p.dequeue()
+
+        after = min(after, new_fanout(chan, frame, 0))
+
+        for p in members:
+            p.dequeue()
+
+    print(
+        f"message to {MEMBERS} members: before {before * 1e3:.2f}ms "
+        f"after {after * 1e3:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
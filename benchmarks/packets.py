@@ -0,0 +1,204 @@
+"""
+Micro-benchmark for the packet encoder.
+
+Compares the old coroutine based `write` dispatch against the
+compiled packet layouts in `packets.writer`.
+
+    python -m benchmarks.packets
+"""
+from constants.packets import BanchoPackets
+from constants.player import bStatus
+from constants.playmode import Mode
+from constants.mods import Mods
+from objects.match import Match
+from objects.collections import Tokens
+from types import SimpleNamespace
+from objects import services
+from packets import writer
+from packets.writer import Types
+import asyncio
+import struct
+import timeit
+
+N = 20_000
+
+
+#
+# The encoder as it was, before the layouts got compiled.
+#
+
+
+async def old_uleb128(value: int) -> bytearray:
+    if value == 0:
+        return bytearray(b"\x00")
+
+    data = bytearray()
+    length = 0
+
+    while value > 0:
+        data.append(value & 0x7F)
+        value >>= 7
+        if value != 0:
+            data[length] |= 0x80
+
+        length += 1
+
+    return data
+
+
+async def old_str(string: str) -> bytearray:
+    if not string:
+        return bytearray(b"\x00")
+
+    data = bytearray(b"\x0B")
+    data += await old_uleb128(len(string.encode()))
+    data += string.encode()
+    return data
+
+
+async def old_write(pID: int, *args) -> bytes:
+    data = bytearray(struct.pack("<Hx", pID))
+
+    for value, d_type in args:
+        if d_type == Types.string:
+            data += await old_str(value)
+        elif d_type == Types.int32:
+            data += bytearray(value.to_bytes(4, "little", signed=True))
+        elif d_type == Types.byte:
+            data += bytearray(struct.pack("<b", value))
+        elif d_type == Types.ubyte:
+            data += bytearray(struct.pack("<B", value))
+        else:
+            data += struct.pack(f"<{writer.formats[d_type]}", value)
+
+    data[3:3] += struct.pack("<I", len(data) - 3)
+    return bytes(data)
+
+
+async def old_presence(p) -> bytes:
+    return await old_write(
+        BanchoPackets.CHO_USER_PRESENCE,
+        (p.id, Types.int32),
+        (p.username, Types.string),
+        (p.timezone, Types.byte),
+        (p.country, Types.ubyte),
+        (0, Types.byte),
+        (p.longitude, Types.float32),
+        (p.latitude, Types.float32),
+        (p.rank, Types.int32),
+    )
+
+
+async def old_stats(p) -> bytes:
+    return await old_write(
+        BanchoPackets.CHO_USER_STATS,
+        (p.id, Types.int32),
+        (p.status.value, Types.uint8),
+        (p.status_text, Types.string),
+        (p.beatmap_md5, Types.string),
+        (p.current_mods, Types.int32),
+        (p.play_mode, Types.uint8),
+        (p.beatmap_id, Types.int32),
+        (p.ranked_score, Types.int64),
+        (p.accuracy / 100.0, Types.float32),
+        (p.playcount, Types.int32),
+        (p.total_score, Types.int64),
+        (p.rank, Types.int32),
+        (p.pp, Types.int16),
+    )
+
+
+async def old_message(sender: str, msg: str, chan: str, id: int) -> bytes:
+    return await old_write(
+        BanchoPackets.CHO_SEND_MESSAGE,
+        (sender, Types.string),
+        (msg, Types.string),
+        (chan, Types.string),
+        (id, Types.int32),
+    )
+
+
+def bench(name: str, old, new) -> None:
+    loop = asyncio.new_event_loop()
+
+    async def run_old():
+        for _ in range(N):
+            await old()
+
+    before = timeit.timeit(lambda: loop.run_until_complete(run_old()), number=1)
+    after = timeit.timeit(new, number=N)
+
+    loop.close()
+
+    print(
+        f"{name:<14} before: {before / N * 1e6:6.2f}us  "
+        f"after: {after / N * 1e6:6.2f}us  ({before / after:.1f}x)"
+    )
+
+
+def main() -> None:
+    p = SimpleNamespace(
+        id=1000,
+        username="Aoba",
+        safe_name="aoba",
+        token="benchmark",
+        timezone=24,
+        country=59,
+        privileges=4,
+        longitude=12.5,
+        latitude=55.6,
+        rank=1,
+        status=bStatus.PLAYING,
+        status_text="Camellia - Exit This Earth's Atomosphere [Evolution]",
+        beatmap_md5="a" * 32,
+        current_mods=Mods.HIDDEN | Mods.DOUBLETIME,
+        play_mode=Mode.OSU,
+        beatmap_id=2000000,
+        ranked_score=123456789012,
+        accuracy=98.76,
+        playcount=12345,
+        total_score=234567890123,
+        pp=12345,
+    )
+
+    # players keep their packets encoded, and only redo them when they change
+    p.presence_packet = writer.encode_presence(p)
+    p.stats_packet = writer.encode_stats(p)
+
+    # the writer skips players that aren't online
+    services.players = Tokens()
+    services.players.add(p)
+
+    m = Match()
+    m.host = p.id
+    m.match_name = "(Aoba) vs (Simon)"
+    m.map_title = p.status_text
+    m.map_md5 = p.beatmap_md5
+
+    bench("UserPresence", lambda: old_presence(p), lambda: writer.encode_presence(p))
+    bench("UpdateStats", lambda: old_stats(p), lambda: writer.encode_stats(p))
+    bench(
+        "SendMessage",
+        lambda: old_message("Aoba", "hello world!", "#osu", 1000),
+        lambda: writer.SendMessage("Aoba", "hello world!", "#osu", 1000),
+    )
+    bench(
+        "Notification",
+        lambda: old_write(BanchoPackets.CHO_NOTIFICATION, ("hi!", Types.string)),
+        lambda: writer.Notification("hi!"),
+    )
+
+    after = timeit.timeit(lambda: writer.MatchUpdate(m), number=N)
+    print(f"{'MatchUpdate':<14} after: {after / N * 1e6:6.2f}us")
+
+    # what's left of them when the player didn't change
+    for name, fn in (
+        ("UserPresence", writer.UserPresence),
+        ("UpdateStats", writer.UpdateStats),
+    ):
+        after = timeit.timeit(lambda: fn(p), number=N)
+        print(f"{name + ' (kept)':<14} after: {after / N * 1e6:6.2f}us")
+
+
+if __name__ == "__main__":
+    main()
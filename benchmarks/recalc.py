@@ -0,0 +1,102 @@
+"""
+Throughput of the pp recalculation, on the .osu files in a folder.
+
+"before" calculates every score on its own like `Score.set_data_from_submission`
+does, parsing the map every time. "after" is `tools.recalc.calculate`,
+once in this process and once fanned out over a process pool.
+
+    python -m benchmarks.recalc [.data/beatmaps] [scores per map]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from tools.recalc import calculate
+from constants.mods import Mods
+import random
+import oppai
+import time
+import sys
+import os
+
+MODS = (
+    Mods.NONE,
+    Mods.HIDDEN,
+    Mods.HARDROCK,
+    Mods.DOUBLETIME,
+    Mods.HIDDEN | Mods.HARDROCK,
+    Mods.HIDDEN | Mods.DOUBLETIME,
+)
+
+
+def old_calculate(path: str, scores: list) -> list:
+    ret = []
+
+    for id, mods, combo, nmiss, acc in scores:
+        ez = oppai.ezpp_new()
+
+        if mods:
+            oppai.ezpp_set_mods(ez, mods)
+
+        oppai.ezpp_set_combo(ez, combo)
+        oppai.ezpp_set_nmiss(ez, nmiss)
+        oppai.ezpp_set_accuracy_percent(ez, acc)
+
+        oppai.ezpp(ez, path)
+        ret.append((oppai.ezpp_pp(ez), id))
+
+        oppai.ezpp_free(ez)
+
+    return ret
+
+
+def main() -> None:
+    folder = sys.argv[1] if len(sys.argv) > 1 else ".data/beatmaps"
+    per_map = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    paths = [
+        os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".osu")
+    ][:100]
+
+    if not paths:
+        print(f"No .osu files in {folder}.")
+        return
+
+    random.seed(0)
+
+    maps = [
+        (
+            path,
+            [
+                (
+                    i,
+                    int(random.choice(MODS)),
+                    random.randint(1, 500),
+                    random.randint(0, 10),
+                    random.uniform(80, 100),
+                )
+                for i in range(per_map)
+            ],
+        )
+        for path in paths
+    ]
+    total = len(maps) * per_map
+
+    def run(name: str, fn) -> None:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:<24} {elapsed:8.2f}s {total / elapsed:10.0f} scores/s")
+
+    print(f"{total} scores on {len(maps)} maps")
+
+    run("before", lambda: [old_calculate(*m) for m in maps])
+    run("after (1 process)", lambda: [calculate(*m) for m in maps])
+
+    with ProcessPoolExecutor() as pool:
+        run(
+            f"after ({pool._max_workers} processes)",
+            lambda: list(pool.map(calculate, *zip(*maps))),
+        )
+
+
+if __name__ == "__main__":
+    main()
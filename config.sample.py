@@ -1,5 +1,64 @@
 conf = {
-    "server": {"debug": False, "domain": "YOUR.DOMAIN", "port": 8000},
+    "server": {
+        "debug": False,
+        "domain": "YOUR.DOMAIN",
+        "port": 8000,
+        # limits of each players outgoing packet queue, packets counts frames.
+        # the hard limits default to 4x the others, past them the player is
+        # logged out.
+        "queue": {"max_bytes": 1 << 20, "max_packets": 4096},
+        # how many frame bundles are kept for spectators falling behind
+        "spectator": {"buffer": 64},
+        # live pp in multiplayer, recalculated at most once per interval per slot
+        "pp": {"workers": 2, "interval": 1.0},
+        # beatmap leaderboards kept in memory, and how many scores they show
+        "leaderboards": {"size": 50, "cache": 4096},
+        # how many of a players best pp values are weighted, 0.95^200 is close enough to 0
+        "top_scores": 200,
+        # beatmaps kept in memory; pending/qualified maps and maps that
+        # weren't found expire sooner, since they can still change
+        "beatmaps": {
+            "cache": 10000,
+            "ttl": 86400,
+            "pending_ttl": 600,
+            "missing_ttl": 300,
+        },
+        # sql/redis statements slower than this (seconds) go in the slow query log
+        "queries": {"slow": 0.1, "slow_log": 100},
+        # the query stats and such, on 127.0.0.1 only; don't proxy this port
+        "internal": {"port": 8001},
+        # what's done after answering a score submission; unfinished
+        # jobs are kept in .data/jobs.journal and picked up after a restart
+        "jobs": {"workers": 4, "retries": 3, "backoff": 1.0, "fsync": False},
+        # beatmap plays and player stats are added up in memory and written this often (seconds)
+        "write_behind": {"interval": 5.0},
+        # replays are appended to segment files of this size; cache is bytes of replays kept in memory
+        "replays": {"segment_size": 256 << 20, "cache": 64 << 20, "fsync": False},
+        # osu!standard replays are checked in this many processes; scores where
+        # the unstable rate or the spread of key holds (ms) is below these,
+        # more than this share of hits snapped onto the circle, or the frame
+        # times are this far off 60fps are flagged for review (!anticheat)
+        "anticheat": {
+            "workers": 2,
+            "limits": {
+                "min_hits": 50,
+                "ur": 50.0,
+                "hold_std": 3.0,
+                "snaps": 0.15,
+                "frametime": 0.15,
+            },
+        },
+    },
+    # outgoing requests; rate limits are requests per minute for each host
+    "http": {
+        "limit": 100,
+        "limit_per_host": 10,
+        "timeout": 10,
+        "retries": 2,
+        "rate_limits": {"osu.ppy.sh": 600},
+    },
+    # local IP2Location LITE DB5 style csv, or a MaxMind .mmdb (needs maxminddb)
+    "geoip": {"path": ".data/geoip.csv", "cache": 65536},
     "mysql": {
         "host": "localhost",
         "user": "CHANGE THIS",
@@ -15,6 +74,8 @@ conf = {
     },
     "api_conf": {
         "osu_api_key": "CHANGE THIS",
+        # where .osu files are downloaded from, {} is the map id
+        "osu_files": "https://osu.ppy.sh/web/osu-getosufile.php?q={}",
         "mirrors": {
             "chimu": "https://api.chimu.moe/v1/",
             "katsu": "https://katsu.moe/",
@@ -8,8 +8,11 @@ from objects.bot import Louise
 from typing import Callable
 from objects.group import Group
 from packets import writer
+from objects import broadcast
 from typing import Union
 from objects import services
+from objects import rankings
+from anticheat import run as anticheat
 from utils import log
 import asyncio
 import random
@@ -226,10 +229,10 @@ async def verify_with_key(ctx: Context) -> str:
 
     ctx.author.privileges = Privileges.USER + Privileges.VERIFIED
     ctx.author.enqueue(
-        await writer.Notification(
+        writer.Notification(
             "Welcome to Ragnarok. You've successfully verified your account and gained beta access! If you see any bugs or anything unusal, please report it to one of the developers, through Github issues or Discord."
         )
-        + await writer.Notification(
+        + writer.Notification(
             "Please login again to prevent any corruption to your user data!"
         )
     )
@@ -293,7 +296,11 @@ async def start_match(ctx: Context) -> str:
                 if slot.status & SlotStatus.OCCUPIED:
                     if slot.status != SlotStatus.NOMAP:
                         slot.status = SlotStatus.PLAYING
-                        slot.p.enqueue(await writer.MatchStart(m))
+
+            m.in_progress = True
+            await m.load_pp()
+
+            broadcast.send(m.playing, writer.MatchStart(m))
 
             await m.enqueue_state(lobby=True)
             return "Starting match... Good luck!"
@@ -316,8 +323,9 @@ async def start_match(ctx: Context) -> str:
             slot.status = SlotStatus.PLAYING
 
     m.in_progress = True
+    await m.load_pp()
 
-    m.enqueue(await writer.MatchStart(m))
+    m.enqueue(writer.MatchStart(m))
     await m.enqueue_state()
     return "Starting match... Good luck!"
 
@@ -332,15 +340,17 @@ async def abort_match(ctx: Context) -> str:
     ):
         return
 
+    broadcast.send(m.playing, writer.write(BanchoPackets.CHO_MATCH_ABORT))
+
     for s in m.slots:
         if s.status == SlotStatus.PLAYING:
-            s.p.enqueue(await writer.write(BanchoPackets.CHO_MATCH_ABORT))
             s.status = SlotStatus.NOTREADY
 
             s.skipped = False
             s.loaded = False
 
     m.in_progress = False
+    await m.unload_pp()
 
     await m.enqueue_state(lobby=True)
     return "Aborted match."
@@ -391,7 +401,7 @@ async def move_slot(ctx: Context) -> str:
 
     ctx.args[1] = int(ctx.args[1]) - 1
 
-    player = services.players.get(ctx.args[0])
+    player = services.players.get_by_name(ctx.args[0])
 
     if not (target := m.find_user(player)):
         return "Slot is not occupied."
@@ -465,7 +475,7 @@ async def invite_people(ctx: Context) -> str:
         )
         response = await ctx.await_response()
 
-    if not (target := services.players.get(ctx.args[0])):
+    if not (target := services.players.get_by_name(ctx.args[0])):
         return "The user is not online."
 
     if target is ctx.author:
@@ -492,12 +502,12 @@ async def announce(ctx: Context) -> str:
     msg = " ".join(ctx.args[1:])
 
     if ctx.args[0] == "all":
-        services.players.enqueue(await writer.Notification(msg))
+        services.players.enqueue(writer.Notification(msg))
     else:
-        if not (target := services.players.get(ctx.args[0])):
+        if not (target := services.players.get_by_name(ctx.args[0])):
             return "Player is not online."
 
-        target.enqueue(await writer.Notification(msg))
+        target.enqueue(writer.Notification(msg))
 
     return "ok"
 
@@ -510,7 +520,7 @@ async def kick_user(ctx: Context) -> str:
         return "Usage: !kick <username>"
 
     if ctx.args[0].lower() == "all":
-        for p in services.players.players[:]:
+        for p in services.players.players:
             if (p == ctx.author) or p.bot:
                 continue
 
@@ -522,7 +532,7 @@ async def kick_user(ctx: Context) -> str:
         return "Player isn't online or couldn't be found in the database"
 
     await t.logout()
-    t.enqueue(await writer.Notification("You've been kicked!"))
+    t.enqueue(writer.Notification("You've been kicked!"))
 
     return f"Successfully kicked {t.username}"
 
@@ -550,9 +560,11 @@ async def restrict_user(ctx: Context) -> str:
     )
 
     t.privileges -= Privileges.VERIFIED
+    services.leaderboards.clear()
+    asyncio.create_task(rankings.remove_player(t.id))
 
     t.enqueue(
-        await writer.Notification("An admin has set your account in restricted mode!")
+        writer.Notification("An admin has set your account in restricted mode!")
     )
 
     return f"Successfully restricted {t.username}"
@@ -579,9 +591,11 @@ async def unrestrict_user(ctx: Context) -> str:
     )
 
     t.privileges |= Privileges.VERIFIED
+    services.leaderboards.clear()
+    await rankings.add_player(t.id)
 
     if t.token:  # if user is online
-        t.enqueue(await writer.Notification("An admin has unrestricted your account!"))
+        t.enqueue(writer.Notification("An admin has unrestricted your account!"))
 
     return f"Successfully unrestricted {t.username}"
 
@@ -594,7 +608,7 @@ async def bot_commands(ctx: Context) -> str:
         return f"{services.bot.username.lower()}."
 
     if ctx.args[0] == "reconnect":
-        if services.players.get(1):
+        if services.players.get_by_id(1):
             return f"{services.bot.username} is already connected."
 
         await Louise.init()
@@ -602,6 +616,235 @@ async def bot_commands(ctx: Context) -> str:
         return f"Successfully connected {services.bot.username}."
 
 
+@register_command("rankings", required_perms=Privileges.DEV)
+async def rankings_commands(ctx: Context) -> str:
+    """Manage the beatmap score rankings in redis."""
+
+    if not ctx.args:
+        return "Usage: !rankings <rebuild/check>"
+
+    if ctx.args[0] == "rebuild":
+        start = time.time()
+        count = await rankings.rebuild()
+        services.leaderboards.clear()
+
+        return f"Rebuilt the rankings with {count} scores in {time.time() - start:.2f}s."
+
+    if ctx.args[0] == "check":
+        if len(ctx.args) < 2:
+            return "Usage: !rankings check <username>"
+
+        if not (t := services.players.get_by_name(" ".join(ctx.args[1:]))):
+            return "Player isn't online."
+
+        # compare the incrementally kept pp against a full recalculation
+        ret = []
+        for (mode, relax), top in t.top_scores.items():
+            drift = await top.verify(t.id, mode, relax)
+            ret.append(
+                f"{mode.name} {'RX' if relax else 'VN'}: {top.pp:.2f}pp, off by {drift:.4f}pp"
+            )
+
+        return "\n".join(ret) or f"{t.username} hasn't set a new best yet."
+
+    return "Usage: !rankings <rebuild/check>"
+
+
+@register_command("replays", required_perms=Privileges.DEV)
+async def replays_commands(ctx: Context) -> str:
+    """Manage the replay store."""
+
+    if not ctx.args or ctx.args[0] != "compact":
+        return "Usage: !replays compact [threshold]"
+
+    try:
+        threshold = float(ctx.args[1]) if len(ctx.args) > 1 else 0.5
+    except ValueError:
+        return "The threshold has to be a number, like 0.5"
+
+    start = time.time()
+    removed, reclaimed = await services.replays.compact(threshold)
+
+    return (
+        f"Compacted {removed} segments, freeing {reclaimed / 2**20:.1f}MB "
+        f"in {time.time() - start:.2f}s."
+    )
+
+
+@register_command("anticheat", required_perms=Privileges.MODERATOR)
+async def anticheat_commands(ctx: Context) -> str:
+    """Review the scores flagged by the anticheat."""
+
+    if not ctx.args or ctx.args[0] not in ("list", "show", "dismiss"):
+        return "Usage: !anticheat <list/show/dismiss> [score id]"
+
+    if ctx.args[0] == "list":
+        reviews = await anticheat.reviews()
+
+        return "\n".join(
+            [f"{len(reviews)} scores waiting for review:"]
+            + [
+                f"{r['score_id']} by user {r['user_id']}: {', '.join(r['flags'])} | "
+                f"{r['ur']:.1f} UR, hold spread {r['hold_std']:.1f}ms, "
+                f"{r['snaps'] * 100:.0f}% snaps, {r['frametime']:.1f}ms frames"
+                for r in reviews[:10]
+            ]
+        )
+
+    if len(ctx.args) < 2 or not ctx.args[1].isdigit():
+        return f"Usage: !anticheat {ctx.args[0]} <score id>"
+
+    score_id = int(ctx.args[1])
+
+    if ctx.args[0] == "dismiss":
+        if not await anticheat.dismiss(score_id):
+            return "That score isn't waiting for review."
+
+        return f"Dismissed score {score_id}."
+
+    for r in await anticheat.reviews():
+        if r["score_id"] == score_id:
+            return "\n".join(f"{k}: {v}" for k, v in r.items())
+
+    return "That score isn't waiting for review."
+
+
+@register_command("perf", required_perms=Privileges.DEV)
+async def perf(ctx: Context) -> str:
+    """Performance statistics of the server."""
+
+    if not ctx.args:
+        return "Usage: !perf <queues/relay/leaderboards/beatmaps/http/sql/redis/slow/jobs/writes/replays/anticheat>"
+
+    if ctx.args[0] == "queues":
+        # the players with the most bytes waiting to be polled
+        lagging = sorted(
+            services.players.players, key=lambda p: p.queue.size, reverse=True
+        )[:10]
+
+        return "\n".join(
+            f"{p.username}: {p.queue.count} frames / {p.queue.size} bytes "
+            f"(peak {p.queue.high_water}, dropped {p.queue.dropped}, "
+            f"coalesced {p.queue.coalesced}, overflows {p.queue.overflows}"
+            f"{', stalled' if p.queue.stalled else ''}) "
+            f"| last poll {time.time() - p.last_update:.1f}s ago"
+            for p in lagging
+            if not p.bot
+        ) or "Nobody is online."
+
+    if ctx.args[0] == "relay":
+        hosts = sorted(
+            (p for p in services.players.players if p.relay),
+            key=lambda p: len(p.relay),
+            reverse=True,
+        )[:10]
+
+        ret = []
+        for host in hosts:
+            relay = host.relay
+            ret.append(
+                f"{host.username}: {len(relay)} spectators, {relay.rate:.1f} frames/s "
+                f"(buffered {len(relay.frames)}, skipped {relay.skipped})"
+            )
+
+            # the spectators that are furthest behind
+            for s in sorted(host.spectators, key=relay.lag, reverse=True)[:5]:
+                ret.append(f"  {s.username}: {relay.lag(s)} frames behind")
+
+        return "\n".join(ret) or "Nobody is being spectated."
+
+    if ctx.args[0] == "leaderboards":
+        lb = services.leaderboards
+        total = lb.hits + lb.misses
+
+        return (
+            f"{len(lb)}/{lb.max_entries} leaderboards cached, "
+            f"{lb.hits} hits / {lb.misses} misses "
+            f"({lb.hits / total * 100 if total else 0:.1f}% hit rate)"
+        )
+
+    if ctx.args[0] == "beatmaps":
+        bm = services.beatmaps
+        total = bm.hits + bm.misses
+
+        return (
+            f"{len(bm)}/{bm.max_entries} beatmaps cached, "
+            f"{bm.hits} hits / {bm.misses} misses / {bm.coalesced} coalesced "
+            f"({bm.hits / total * 100 if total else 0:.1f}% hit rate)"
+        )
+
+    if ctx.args[0] == "http":
+        return "\n".join(
+            f"{host}: {u.requests} requests, {u.errors} errors, {u.retries} retries, "
+            f"avg {u.latency / u.requests * 1000:.0f}ms / max {u.max_latency * 1000:.0f}ms, "
+            f"throttled {u.throttled:.1f}s"
+            for host, u in services.http.upstreams.items()
+            if u.requests
+        ) or "No requests made yet."
+
+    if ctx.args[0] in ("sql", "redis"):
+        # the statements that took the most time altogether
+        return "\n".join(
+            f"{s.count}x, {s.total:.2f}s total, avg {s.avg * 1000:.1f}ms / "
+            f"p99 {s.percentile(0.99) * 1000:.0f}ms / max {s.max * 1000:.0f}ms, "
+            f"{s.slow} slow | {s.fingerprint[:120]}"
+            for s in services.query_stats.top(kind=ctx.args[0])
+        ) or "No statements made yet."
+
+    if ctx.args[0] == "jobs":
+        jobs = services.jobs
+        ret = [f"{len(jobs)} jobs pending (peak {jobs.high_water})"]
+
+        for name, st in jobs.stats.items():
+            finished = st.done + st.failed
+            ret.append(
+                f"{name}: {st.done} done, {st.failed} failed, {st.retried} retried, "
+                f"avg {st.time / finished * 1000 if finished else 0:.1f}ms "
+                f"(max {st.max_time * 1000:.0f}ms), "
+                f"avg wait {st.wait / finished * 1000 if finished else 0:.0f}ms"
+            )
+
+        return "\n".join(ret)
+
+    if ctx.args[0] == "writes":
+        wb = services.write_behind
+
+        return (
+            f"{len(wb)} rows waiting, {wb.added} changes written as {wb.written} rows "
+            f"in {wb.flushes} flushes "
+            f"(avg {wb.flush_time / wb.flushes * 1000 if wb.flushes else 0:.1f}ms, "
+            f"max {wb.max_flush_time * 1000:.0f}ms), {wb.errors} failed"
+        )
+
+    if ctx.args[0] == "replays":
+        rs = services.replays
+        total = rs.hits + rs.misses
+        size = sum(rs.sizes.values())
+
+        return (
+            f"{len(rs)} replays in {len(rs.sizes)} segments, "
+            f"{size / 2**20:.1f}MB ({(size - sum(rs.live.values())) / 2**20:.1f}MB unused) | "
+            f"{len(rs.cache)} cached ({rs.cache_bytes / 2**20:.1f}MB), "
+            f"{rs.hits / total * 100 if total else 0:.1f}% hit rate"
+        )
+
+    if ctx.args[0] == "anticheat":
+        return (
+            f"{anticheat.checked} replays checked "
+            f"(avg {anticheat.check_time / anticheat.checked * 1000 if anticheat.checked else 0:.0f}ms), "
+            f"{anticheat.flagged} flagged"
+        )
+
+    if ctx.args[0] == "slow":
+        return "\n".join(
+            f"{q['elapsed'] * 1000:.0f}ms {q['kind']} from {q['handler']} "
+            f"({q['caller']}): {q['statement'][:120]}"
+            for q in list(services.query_stats.slow_log)[-10:]
+        ) or "No slow statements yet."
+
+    return "Usage: !perf <queues/relay/leaderboards/beatmaps/http/sql/redis/slow/jobs/writes/replays/anticheat>"
+
+
 @register_command("approve")
 async def approve_map(ctx: Context) -> str:
     """Change the ranked status of beatmaps."""
@@ -641,8 +884,7 @@ async def approve_map(ctx: Context) -> str:
 
     _map.approved = ranked_status
 
-    if ctx.author.last_np.hash_md5 in services.beatmaps:
-        services.beatmaps[ctx.author.last_np.hash_md5].approved = ranked_status
+    services.beatmaps.invalidate(_map, whole_set=not set_or_map)
 
     return resp
 
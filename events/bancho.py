@@ -1,4 +1,4 @@
-from constants.player import bStatus, Privileges
+from constants.player import bStatus, Privileges, PresenceFilter
 from constants.packets import BanchoPackets
 from objects.channel import Channel
 from packets.reader import Reader, Packet
@@ -11,25 +11,22 @@ from constants.mods import Mods
 from constants.match import *
 from typing import Callable
 from packets import writer
+from objects import broadcast
 from utils import general
 from objects import services
-from utils import score
 from utils import log
-from oppai import *
 import asyncio
 import bcrypt
-import struct
 import time
 import copy
-import os
 import re
 
 
 def register_event(packet: BanchoPackets, restricted: bool = False) -> Callable:
     def decorator(cb: Callable) -> None:
-        services.packets |= {
-            packet.value: Packet(packet=packet, callback=cb, restricted=restricted)
-        }
+        services.packets[packet.value] = Packet(
+            packet=packet, callback=cb, restricted=restricted
+        )
 
     return decorator
 
@@ -50,11 +47,8 @@ async def handle_bancho(req: Request):
 
     token = req.headers["osu-token"]
 
-    if not (player := services.players.get(token)):
-        return (
-            await writer.Notification("Server has restarted")
-            + await writer.ServerRestart()
-        )
+    if not (player := services.players.get_by_token(token)):
+        return writer.Notification("Server has restarted") + writer.ServerRestart()
 
     for p in (sr := Reader(req.body)):
         if player.is_restricted and (not p.restricted):
@@ -77,6 +71,12 @@ async def handle_bancho(req: Request):
     req.add_header("Content-Type", "text/html; charset=UTF-8")
     player.last_update = time.time()
 
+    # it stopped polling long enough for the queue to give up on it,
+    # the client has missed too much, so let it log in again.
+    if player.queue.stalled:
+        await player.logout()
+        return writer.Notification("You fell too far behind") + writer.ServerRestart()
+
     return player.dequeue() or b""
 
 
@@ -84,7 +84,7 @@ async def login(req: Request) -> bytes:
     req.add_header("cho-token", "no")
 
     start = time.time_ns()
-    data = bytearray(await writer.ProtocolVersion(19))
+    data = bytearray(writer.ProtocolVersion(19))
     # parse login info and client info.
     # {0}
 
@@ -108,7 +108,7 @@ async def login(req: Request) -> bytes:
             [login_info[0].lower().replace(" ", "_")],
         )
     ):
-        return await writer.UserID(-1)
+        return writer.UserID(-1)
 
     # encode user password and input password.
     phash = user_info["passhash"].encode("utf-8")
@@ -121,36 +121,34 @@ async def login(req: Request) -> bytes:
                 f"USER {user_info['username']} ({user_info['id']}) | Login fail. (WRONG PASSWORD)"
             )
 
-            return await writer.UserID(-1)
+            return writer.UserID(-1)
     else:
         if not bcrypt.checkpw(pmd5, phash):
             log.warn(
                 f"USER {user_info['username']} ({user_info['id']}) | Login fail. (WRONG PASSWORD)"
             )
 
-            return await writer.UserID(-1)
+            return writer.UserID(-1)
 
         services.bcrypt_cache[phash] = pmd5
 
-    if services.players.get(user_info["username"]):
+    if services.players.get_by_id(user_info["id"]):
         # user is already online? sus
-        return await writer.Notification(
-            "You're already online on the server!"
-        ) + await writer.UserID(-1)
+        return writer.Notification("You're already online on the server!") + writer.UserID(
+            -1
+        )
 
     # invalid security hash (old ver probably using that)
     if len(client_info[3].split(":")) < 4:
-        return await writer.UserID(-2)
+        return writer.UserID(-2)
 
     # check if user is restricted; pretty sure its like this lol
     if not user_info["privileges"] & Privileges.VERIFIED | Privileges.PENDING:
-        data += await writer.Notification(
-            "Your account has been set in restricted mode."
-        )
+        data += writer.Notification("Your account has been set in restricted mode.")
 
     # only allow 2021 clients
     # if not client_info[0].startswith("b2021"):
-    #     return await writer.UserID(-2)
+    #     return writer.UserID(-2)
 
     # check if the user is banned.
     if user_info["privileges"] & Privileges.BANNED:
@@ -158,7 +156,7 @@ async def login(req: Request) -> bytes:
             f"{user_info['username']} tried to login, but failed to do so, since they're banned."
         )
 
-        return await writer.UserID(-3)
+        return writer.UserID(-3)
 
     # TODO: Hardware ban check (security[3] and [4])
     """
@@ -169,7 +167,7 @@ async def login(req: Request) -> bytes:
     }
     """
     # if my_balls > sussy_balls:
-    #   return BanchoResponse(await writer.UserID(-5))
+    #   return BanchoResponse(writer.UserID(-5))
 
     kwargs = {
         "block_nonfriend": client_info[4],
@@ -192,52 +190,50 @@ async def login(req: Request) -> bytes:
             reciever=p,
         )
 
-    if (
-        not (user_info["lon"] or user_info["lat"] or user_info["cc"])
-        or user_info["country"] == "XX"
-    ):
-        await p.set_location()
-        await p.save_location()
-
-    asyncio.create_task(p.check_loc())
+    # only written back when it actually changed
+    if p.set_location():
+        asyncio.create_task(p.save_location())
 
-    data += await writer.UserID(p.id)
-    data += await writer.UserPriv(p.privileges)
-    data += await writer.MainMenuIcon()
-    data += await writer.FriendsList(*p.friends)
-    data += await writer.UserPresence(p, spoof=True)
-    data += await writer.UpdateStats(p)
+    data += writer.UserID(p.id)
+    data += writer.UserPriv(p.privileges)
+    data += writer.MainMenuIcon()
+    data += writer.FriendsList(*p.friends)
+    data += writer.UserPresence(p, spoof=True)
+    data += writer.UpdateStats(p)
 
     for chan in services.channels.channels:
         if chan.public:
-            data += await writer.ChanInfo(chan.name)
+            data += writer.ChanInfo(chan.name)
 
             if chan.auto_join:
-                data += await writer.ChanAutoJoin(chan.name)
+                data += writer.ChanAutoJoin(chan.name)
                 await p.join_channel(chan)
 
         if chan.staff and p.is_staff:
-            data += await writer.ChanInfo(chan.name)
-            data += await writer.ChanJoin(chan.name)
+            data += writer.ChanInfo(chan.name)
+            data += writer.ChanJoin(chan.name)
             await p.join_channel(chan)
 
+    # NOTE: current player don't need this
+    #       because it has been sent already
+    broadcast.presence(p, writer.UserPresence(p), ignore={p.id})
+    broadcast.presence(p, writer.UpdateStats(p), ignore={p.id})
+
     for player in services.players.players:
-        # NOTE: current player don't need this
-        #       because it has been sent already
         if player == p:
             continue
 
-        if player != p:
-            player.enqueue(await writer.UserPresence(p) + await writer.UpdateStats(p))
+        player.known_presence[p.id] = p.presence_version
+        player.known_stats[p.id] = p.stats_version
 
-        data += await writer.UserPresence(player)
-        data += await writer.UpdateStats(player)
+        data += p.unseen_presence(player)
+        data += p.unseen_stats(player)
 
-    data += await writer.ChanInfoEnd()
+    data += writer.ChanInfoEnd()
 
     et = (time.time_ns() - start) / 1e6
 
-    data += await writer.Notification(
+    data += writer.Notification(
         "Authorization took " + str(general.rag_round(et, 2)) + "ms."
     )
 
@@ -261,7 +257,7 @@ async def change_action(p: Player, sr: Reader) -> None:
     asyncio.create_task(p.update_stats_cache())
 
     if not p.is_restricted:
-        services.players.enqueue(await writer.UpdateStats(p))
+        broadcast.presence(p, writer.UpdateStats(p))
 
 
 async def _handle_command(chan: Channel, msg: str, p: Player):
@@ -335,13 +331,13 @@ async def logout(p: Player, sr: Reader) -> None:
 async def update_stats(p: Player, sr: Reader) -> None:
     # TODO: add this update for spectator as well
     #       since they need to have up-to-date beatmap info
-    p.enqueue(await writer.UpdateStats(p))
+    p.enqueue(writer.UpdateStats(p))
 
 
 # id: 4
 @register_event(BanchoPackets.OSU_PING, restricted=True)
 async def pong(p: Player, sr: Reader) -> None:
-    p.enqueue(await writer.Pong())
+    p.enqueue(writer.Pong())
 
 
 # id: 16
@@ -352,7 +348,7 @@ async def start_spectate(p: Player, sr: Reader) -> None:
     if p.privileges & Privileges.PENDING:
         return
 
-    if not (host := services.players.get(spec)):
+    if not (host := services.players.get_by_id(spec)):
         return
 
     await host.add_spectator(p)
@@ -378,14 +374,11 @@ async def spectating_frames(p: Player, sr: Reader) -> None:
     # TODO: make a proper R/W instead of echoing like this
     sframe = sr.read_raw()
 
-    # packing manually seems to be faster, so let's use that.
-    data = struct.pack("<HxI", BanchoPackets.CHO_SPECTATE_FRAMES, len(sframe)) + sframe
-
-    if p.privileges & Privileges.PENDING:
+    if p.privileges & Privileges.PENDING or not p.relay:
         return
 
-    for t in p.spectators:
-        t.enqueue(data)
+    # spectators pick these up from the relay when they poll.
+    p.relay.push(sframe)
 
 
 # id: 21
@@ -401,12 +394,10 @@ async def unable_to_spec(p: Player, sr: Reader) -> None:
     if p.privileges & Privileges.PENDING:
         return
 
-    ret = await writer.UsrCantSpec(id)
+    ret = writer.UsrCantSpec(id)
 
     host.enqueue(ret)
-
-    for t in host.spectators:
-        t.enqueue(ret)
+    broadcast.send(host.spectators, ret)
 
 
 # id: 25
@@ -421,7 +412,7 @@ async def send_private_message(p: Player, sr: Reader) -> None:
 
     sr.read_int32()  # sender id
 
-    if not (reciever := services.players.get(recieverr)):
+    if not (reciever := services.players.get_by_name(recieverr)):
         await p.shout("The player you're trying to reach is currently offline.")
         return
 
@@ -429,7 +420,7 @@ async def send_private_message(p: Player, sr: Reader) -> None:
         await p.send_message(msg, reciever=reciever)
     else:
         if np := services.regex["np"].search(msg):
-            p.last_np = await Beatmap.get_beatmap(beatmap_id=np.groups(1)[0])
+            p.last_np = await services.beatmaps.get(beatmap_id=np.groups(1)[0])
 
         if msg[0] == services.prefix:
             if resp := await cmd.handle_commands(
@@ -445,6 +436,7 @@ async def send_private_message(p: Player, sr: Reader) -> None:
 @register_event(BanchoPackets.OSU_PART_LOBBY)
 async def lobby_part(p: Player, sr: Reader) -> None:
     p.in_lobby = False
+    services.matches.lobby.pop(p.id, None)
 
 
 # id: 30
@@ -455,12 +447,14 @@ async def lobby_join(p: Player, sr: Reader) -> None:
     if p.privileges & Privileges.PENDING:
         return
 
+    services.matches.lobby[p.id] = p
+
     if p.match:
         await p.leave_match()
 
-    for match in services.matches.matches:
+    for match in services.matches.matches.values():
         if match.connected:
-            p.enqueue(await writer.Match(match))
+            p.enqueue(writer.Match(match))
 
 
 # id: 31
@@ -480,7 +474,7 @@ async def mp_join(p: Player, sr: Reader) -> None:
     matchpass = sr.read_str()
 
     if p.match or not (m := await services.matches.find(matchid)):
-        p.enqueue(await writer.MatchFail())
+        p.enqueue(writer.MatchFail())
         return
 
     await p.join_match(m, pwd=matchpass)
@@ -563,7 +557,7 @@ async def mp_change_settings(p: Player, sr: Reader) -> None:
         return
 
     if new_match.map_md5 != m.map_md5:
-        map = await Beatmap.get_beatmap(new_match.map_md5)
+        map = await services.beatmaps.get(new_match.map_md5)
 
         if map:
             m.map_md5 = map.hash_md5
@@ -612,10 +606,12 @@ async def mp_start(p: Player, sr: Reader) -> None:
         if slot.status & SlotStatus.OCCUPIED:
             if slot.status != SlotStatus.NOMAP:
                 slot.status = SlotStatus.PLAYING
-                slot.p.enqueue(await writer.MatchStart(m))
+
+    broadcast.send(m.playing, writer.MatchStart(m))
 
     m.in_progress = True
 
+    await m.load_pp()
     await m.enqueue_state(lobby=True)
 
 
@@ -626,55 +622,19 @@ async def mp_score_update(p: Player, sr: Reader) -> None:
         return
 
     raw_sr = copy.copy(sr)
-
-    print(sr.packet_data)
     raw = raw_sr.read_raw()
 
     s = sr.read_scoreframe()
 
-    if m.mods & Mods.RELAX or (
-        m.pp_win_condition and m.scoring_type == ScoringType.SCORE
-    ):
-        if os.path.isfile(f".data/beatmaps/{m.map_id}.osu"):
-            acc = (
-                general.rag_round(
-                    score.calculate_accuracy(
-                        m.mode,
-                        s.count_300,
-                        s.count_100,
-                        s.count_50,
-                        s.count_geki,
-                        s.count_katu,
-                        s.count_miss,
-                    ),
-                    2,
-                )
-                if s.count_300 != 0
-                else 0
-            )
-
-            ez = ezpp_new()
-
-            if m.mods:
-                ezpp_set_mods(ez, m.mods)
-
-            ezpp_set_combo(ez, s.max_combo)
-            ezpp_set_nmiss(ez, s.count_miss)
-            ezpp_set_accuracy_percent(ez, acc)
-
-            ezpp(ez, f".data/beatmaps/{m.map_id}.osu")
-            s.score = int(ezpp_pp(ez)) if acc != 0 else 0
-
-            ezpp_free(ez)
-        else:
-            log.fail(f"MATCH {m.match_id}: Couldn't find the osu beatmap.")
-
     slot_id = m.find_user_slot(p)
 
+    if m.pp:
+        s.score = await m.pp.calculate(slot_id, s)
+
     if services.debug:
         log.debug(f"{p.username} has slot id {slot_id} and has incoming score update.")
 
-    m.enqueue(await writer.MatchScoreUpdate(s, slot_id, raw))
+    m.enqueue(writer.MatchScoreUpdate(s, slot_id, raw))
 
 
 # id: 49
@@ -683,13 +643,14 @@ async def mp_complete(p: Player, sr: Reader) -> None:
     if not (m := p.match) or not m.in_progress:
         return
 
-    played = [slot.p for slot in m.slots if slot.status == SlotStatus.PLAYING]
+    played = m.playing
 
     for slot in m.slots:
         if slot.p in played:
             slot.status = SlotStatus.NOTREADY
 
     m.in_progress = False
+    await m.unload_pp()
 
     for slot in m.slots:
         if slot.status & SlotStatus.OCCUPIED and slot.status != SlotStatus.NOMAP:
@@ -699,8 +660,7 @@ async def mp_complete(p: Player, sr: Reader) -> None:
 
     await m.enqueue_state(lobby=True)
 
-    for pl in played:
-        pl.enqueue(await writer.MatchComplete())
+    broadcast.send(played, writer.MatchComplete())
 
     await m.enqueue_state(lobby=True)
 
@@ -747,7 +707,7 @@ async def mp_load_complete(p: Player, sr: Reader) -> None:
     m.find_user(p).loaded = True
 
     if all(s.loaded for s in m.slots if s.status == SlotStatus.PLAYING):
-        m.enqueue(await writer.MatchAllReady())
+        m.enqueue(writer.MatchAllReady())
 
 
 # id: 54
@@ -783,9 +743,10 @@ async def match_failed(p: Player, sr: Reader) -> None:
     if not (m := p.match) or not m.in_progress:
         return
 
-    for slot in m.slots:
-        if slot.p is not None:
-            slot.p.enqueue(await writer.MatchPlayerFailed(p.id))
+    broadcast.send(
+        [slot.p for slot in m.slots if slot.p is not None],
+        writer.MatchPlayerFailed(p.id),
+    )
 
 
 # id: 59
@@ -811,13 +772,13 @@ async def skip_request(p: Player, sr: Reader) -> None:
         return
 
     slot.skipped = True
-    m.enqueue(await writer.MatchPlayerReqSkip(p.id))
+    m.enqueue(writer.MatchPlayerReqSkip(p.id))
 
     for slot in m.slots:
         if slot.status == SlotStatus.PLAYING and not slot.skipped:
             return
 
-    m.enqueue(await writer.MatchSkip())
+    m.enqueue(writer.MatchSkip())
 
 
 # id: 63
@@ -844,9 +805,9 @@ async def mp_transfer_host(p: Player, sr: Reader) -> None:
         return
 
     m.host = slot.p.id
-    slot.p.enqueue(await writer.MatchTransferHost())
+    slot.p.enqueue(writer.MatchTransferHost())
 
-    m.enqueue(await writer.Notification(f"{slot.p.username} became host!"))
+    m.enqueue(writer.Notification(f"{slot.p.username} became host!"))
 
     await m.enqueue_state()
 
@@ -892,6 +853,13 @@ async def leave_osu_channel(p: Player, sr: Reader) -> None:
         await p.leave_channel(chan)
 
 
+# id: 79
+@register_event(BanchoPackets.OSU_RECEIVE_UPDATES, restricted=True)
+async def receive_updates(p: Player, sr: Reader) -> None:
+    # whose status changes the client wants to see
+    p.presence_filter = PresenceFilter(sr.read_int32())
+
+
 # id: 85
 @register_event(BanchoPackets.OSU_USER_STATS_REQUEST, restricted=True)
 async def request_stats(p: Player, sr: Reader) -> None:
@@ -905,10 +873,10 @@ async def request_stats(p: Player, sr: Reader) -> None:
         if user == p.id:
             continue
 
-        if not (u := services.players.get(user)):
+        if not (u := services.players.get_by_id(user)):
             continue
 
-        u.enqueue(await writer.UpdateStats(u))
+        p.enqueue(p.unseen_stats(u))
 
 
 # id: 87
@@ -919,7 +887,7 @@ async def mp_invite(p: Player, sr: Reader) -> None:
 
     _reciever = sr.read_int32()
 
-    if not (reciever := services.players.get(_reciever)):
+    if not (reciever := services.players.get_by_id(_reciever)):
         await p.shout("You can't invite someone who's offline.")
         return
 
@@ -942,9 +910,10 @@ async def change_pass(p: Player, sr: Reader) -> None:
 
     m.match_pass = new_data.match_pass
 
-    for slot in m.slots:
-        if slot.status & SlotStatus.OCCUPIED:
-            slot.p.enqueue(await writer.MatchPassChange(new_data.match_pass))
+    broadcast.send(
+        [slot.p for slot in m.slots if slot.status & SlotStatus.OCCUPIED],
+        writer.MatchPassChange(new_data.match_pass),
+    )
 
     await m.enqueue_state(lobby=True)
 
@@ -962,14 +931,14 @@ async def request_presence(p: Player, sr: Reader) -> None:
         if user == p.id:
             continue
 
-        if not (u := services.players.get(user)):
+        if not (u := services.players.get_by_id(user)):
             continue
 
-        u.enqueue(await writer.UserPresence(u))
+        p.enqueue(p.unseen_presence(u))
 
 
 # id: 98
 @register_event(BanchoPackets.OSU_USER_PRESENCE_REQUEST_ALL, restricted=True)
 async def request_presence_all(p: Player, sr: Reader) -> None:
     for player in services.players.players:
-        player.enqueue(await writer.UserPresence(player))
+        p.enqueue(p.unseen_presence(player))
@@ -0,0 +1,80 @@
+"""
+Endpoints that are only for us, fx. the query stats. They have their own
+listener on 127.0.0.1 instead of being on the public routers, so the
+reverse proxy never passes anything to them.
+
+    curl 127.0.0.1:8001/queries[?reset]
+"""
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import urlsplit, parse_qs
+from objects import services
+from utils import log
+import asyncio
+import json
+
+Handler = Callable[[dict[str, list[str]]], Awaitable[tuple[int, Any]]]
+
+endpoints: dict[str, Handler] = {}
+listener: Optional[asyncio.AbstractServer] = None
+
+
+def endpoint(path: str) -> Callable[[Handler], Handler]:
+    def wrapper(handler: Handler) -> Handler:
+        endpoints[path] = handler
+        return handler
+
+    return wrapper
+
+
+@endpoint("/queries")
+async def query_stats(args: dict[str, list[str]]) -> tuple[int, Any]:
+    if "reset" in args:
+        services.query_stats.reset()
+
+    return 200, services.query_stats.as_dict()
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        line = (await reader.readline()).decode(errors="ignore").split()
+
+        # nothing here takes a body, so the headers are skipped
+        while (await reader.readline()).strip():
+            pass
+
+        if len(line) < 2:
+            return
+
+        url = urlsplit(line[1])
+
+        if handler := endpoints.get(url.path):
+            code, content = await handler(parse_qs(url.query, keep_blank_values=True))
+        else:
+            code, content = 404, {"error": "not found"}
+
+        body = json.dumps(content).encode()
+        writer.write(
+            f"HTTP/1.1 {code} {'OK' if code == 200 else 'Not Found'}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start(config: dict[str, Any]) -> None:
+    global listener
+
+    port = config.get("port", services.port + 1)
+    listener = await asyncio.start_server(handle, "127.0.0.1", port)
+
+    log.info(f"✓ Internal endpoints on http://127.0.0.1:{port}/")
+
+
+def stop() -> None:
+    if listener:
+        listener.close()
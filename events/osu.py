@@ -1,27 +1,27 @@
 from constants.beatmap import Approved
 from objects.beatmap import Beatmap
-from objects.channel import Channel
 from constants.mods import Mods
+from constants.playmode import Mode
 from objects import services
+from objects import rankings
 from utils import log
 from objects.score import Score, SubmitStatus
+from objects.topscores import TopScores
 from collections import defaultdict
 from constants.player import Privileges
 from lenhttp import Router, Request
 from typing import Callable, Union, Any
 from functools import wraps
-from anticheat import run
+from anticheat import run  # registers the anticheat job
 from utils import general
+from utils import replay
 from urllib.parse import unquote
-import numpy as np
 import aiofiles
-import aiohttp
 import math
 import os
 import copy
 import bcrypt
 import hashlib
-import asyncio
 
 
 def check_auth(u: str, pw: str, cho_auth: bool = False, method="GET"):
@@ -66,7 +66,7 @@ def check_auth(u: str, pw: str, cho_auth: bool = False, method="GET"):
 
                     services.bcrypt_cache[phash] = pmd5
             else:
-                if not (p := services.players.get(player)):
+                if not (p := services.players.get_by_name(player)):
                     return b""
 
                 if p.passhash in services.bcrypt_cache:
@@ -127,24 +127,6 @@ async def registration(req: Request) -> Union[dict[str, Any], bytes]:
     return b"ok"
 
 
-async def save_beatmap_file(id: int) -> None:
-    if not os.path.exists(f".data/beatmaps/{id}.osu"):
-        async with aiohttp.ClientSession() as sess:
-            # I hope this is legal.
-            async with sess.get(
-                f"https://osu.ppy.sh/web/osu-getosufile.php?q={id}",
-                headers={"user-agent": "osu!"},
-            ) as resp:
-                if not await resp.text():
-                    log.fail(
-                        f"Couldn't fetch the .osu file of {id}. Maybe because api rate limit?"
-                    )
-                    return b""
-
-                async with aiofiles.open(f".data/beatmaps/{id}.osu", "w+") as osu:
-                    await osu.write(await resp.text())
-
-
 # @osu.add_endpoint("/web/bancho_connect.php")
 # @check_auth("u", "h", cho_auth = True)
 # async def bancho_connect(req: Request) -> bytes:
@@ -159,25 +141,14 @@ async def get_scores(req: Request) -> bytes:
     hash = req.get_args["c"]
     mode = int(req.get_args["m"])
 
-    if not hash in services.beatmaps:
-        b = await Beatmap.get_beatmap(hash, req.get_args["i"])
-    else:
-        b = services.beatmaps[hash]
-
-    if not b:
-        if not hash in services.beatmaps:
-            services.beatmaps[hash] = None
-
+    if not (b := await services.beatmaps.get(hash, req.get_args["i"])):
         return b"-1|true"
 
     if b.approved <= Approved.UPDATE:
-        if not hash in services.beatmaps:
-            services.beatmaps[hash] = b
-
         return f"{b.approved.value}|false".encode()
 
     # no need for check, as its in the decorator
-    if not (p := services.players.get(unquote(req.get_args["us"]))):
+    if not (p := services.players.get_by_name(unquote(req.get_args["us"]))):
         return b"what"
 
     # pretty sus
@@ -187,44 +158,28 @@ async def get_scores(req: Request) -> bytes:
     if int(req.get_args["mods"]) & Mods.RELAX and not p.relax:
         p.relax = True
 
-    ret = b.web_format
-    order = ("score", "pp")[p.relax]
+    count, ret = 0, ""
 
     if b.approved >= Approved.RANKED:
-        if not (
-            data := await services.sql.fetch(
-                "SELECT id FROM scores WHERE user_id = %s "
-                "AND relax = %s AND hash_md5 = %s AND mode = %s "
-                f"AND status = 3 ORDER BY {order} DESC LIMIT 1",
-                (p.id, p.relax, b.hash_md5, mode),
-            )
-        ):
-            ret += "\n"
-        else:
-            s = await Score.set_data_from_sql(data["id"])
-
-            ret += s.web_format
+        personal, lb = await services.leaderboards.get(b, mode, p.relax, p.id)
 
-        async for play in services.sql.iterall(
-            "SELECT s.id FROM scores s INNER JOIN users u ON u.id = s.user_id "
-            "WHERE s.hash_md5 = %s AND s.mode = %s AND s.relax = %s AND s.status = 3 "
-            f"AND u.privileges & 4 ORDER BY s.{order} DESC, s.submitted ASC LIMIT 50",
-            (b.hash_md5, mode, p.relax),
-        ):
-            ls = await Score.set_data_from_sql(play["id"])
+        # the beatmap is shared, so the count comes from the leaderboard
+        count, ret = lb.count, personal + lb.scores
 
-            await ls.calculate_position()
+    services.beatmap_files.prefetch(b.hash_md5, b.map_id)
 
-            ls.map.scores += 1
+    return (b.web_format(count) + ret).encode()
 
-            ret += ls.web_format
 
-    asyncio.create_task(save_beatmap_file(b.map_id))
+@services.jobs.register("replay")
+async def save_replay(score_id: int, raw: bytes) -> None:
+    await services.replays.put(score_id, raw)
 
-    if not hash in services.beatmaps:
-        services.beatmaps[hash] = b
 
-    return ret.encode()  # placeholder
+@services.jobs.register("announce")
+async def announce(channel: str, msg: str) -> None:
+    if chan := services.channels.get(channel):
+        await chan.send(msg, sender=services.bot)
 
 
 @osu.add_endpoint("/web/osu-submit-modular-selector.php", methods=["POST"])
@@ -251,30 +206,44 @@ async def score_submission(req: Request) -> bytes:
     passed = s.status >= SubmitStatus.PASSED
     s.play_time = req.post_args["st" if passed else "ft"]
 
-    # handle needed things, if the map is ranked.
-    if s.map.approved >= Approved.RANKED:
-        if not s.player.is_restricted:
-            s.map.plays += 1
+    # only the score itself is saved before answering,
+    # everything else is left to the background jobs.
+    ranked = s.map.approved >= Approved.RANKED and not s.player.is_restricted
 
-            if passed:
-                s.map.passes += 1
+    # restrict the player if they
+    # somehow managed to submit a
+    # score without a replay.
+    if ranked and passed and "score" not in req.files.keys():
+        await s.player.restrict()
+        return b"error: no"
 
-                # restrict the player if they
-                # somehow managed to submit a
-                # score without a replay.
-                if "score" not in req.files.keys():
-                    await s.player.restrict()
-                    return b"error: no"
+    s.id = await s.save_to_db()
 
-                with open(f".data/replays/{s.id}.osr", "wb+") as file:
-                    file.write(req.files["score"])
+    if ranked:
+        s.map.add_play(passed)
 
-                await services.sql.execute(
-                    "UPDATE beatmaps SET plays = %s, passes = %s WHERE hash = %s",
-                    (s.map.plays, s.map.passes, s.map.hash_md5),
+        if passed:
+            # the journal is the only copy of the replay until the job ran,
+            # so it has to be written before the client hears back.
+            # same key, so the replay is saved before the anticheat reads it.
+            await services.jobs.put(
+                "replay", s.id, req.files["score"], key=f"replay:{s.id}"
+            )
+
+            if s.mode == Mode.OSU:
+                services.jobs.put(
+                    "anticheat",
+                    s.id,
+                    s.player.id,
+                    s.map.hash_md5,
+                    s.map.map_id,
+                    s.mods,
+                    key=f"replay:{s.id}",
                 )
 
-    s.id = await s.save_to_db() + 1
+    if s.status == SubmitStatus.BEST:
+        services.leaderboards.invalidate(s.map.hash_md5, s.mode.value, s.relax)
+        await rankings.add(s)
 
     if passed:
         stats = s.player
@@ -291,9 +260,9 @@ async def score_submission(req: Request) -> bytes:
             stats.playcount += 1
             stats.total_score += s.score
 
-            if s.status == SubmitStatus.BEST:
-                table = ("stats", "stats_rx")[s.relax]
+            sus = 0
 
+            if s.status == SubmitStatus.BEST:
                 sus = s.score
 
                 if s.pb:
@@ -301,38 +270,33 @@ async def score_submission(req: Request) -> bytes:
 
                 stats.ranked_score += sus
 
-                scores = await services.sql.fetchall(
-                    "SELECT pp, accuracy FROM scores "
-                    "WHERE user_id = %s AND mode = %s "
-                    "AND status = 3 AND relax = %s",
-                    (stats.id, s.mode.value, s.relax),
-                )
-
-                avg_accuracy = np.array([x[1] for x in scores])
+                if not (top := stats.top_scores.get((s.mode, s.relax))):
+                    # the new best is already saved, so this includes it.
+                    top = await TopScores.load(stats.id, s.mode, s.relax)
+                    stats.top_scores[(s.mode, s.relax)] = top
+                elif s.pb:
+                    top.replace((s.pb.pp, s.pb.accuracy), (s.pp, s.accuracy))
+                else:
+                    top.add(s.pp, s.accuracy)
 
-                stats.accuracy = float(np.mean(avg_accuracy))
+                stats.accuracy = top.accuracy
+                stats.pp = math.ceil(top.pp)
 
-                weighted = np.sum(
-                    [score[0] * 0.95 ** (place) for place, score in enumerate(scores)]
-                )
-                weighted += 416.6667 * (1 - 0.9994 ** len(scores))
-                stats.pp = math.ceil(weighted)
-
-                s.rank = await stats.update_rank(s.relax, s.mode) + 1
-                await stats.update_stats(s.mode, s.relax)
+                stats.update_rank(s.relax, s.mode)
 
                 if s.position == 1 and not stats.is_restricted:
                     modes = {0: "osu!", 1: "osu!taiko", 2: "osu!catch", 3: "osu!mania"}[
                         s.mode.value
                     ]
 
-                    chan: Channel = services.channels.get("#announce")
-
-                    await chan.send(
+                    services.jobs.put(
+                        "announce",
+                        "#announce",
                         f"{s.player.embed} achieved #1 on {s.map.embed} ({modes}) [{'RX' if s.relax else 'VN'}]",
-                        sender=services.bot,
                     )
 
+            stats.update_stats(s.mode, s.relax, 1, s.score, sus)
+
         if not s.relax:
             ret: list = []
 
@@ -429,12 +393,6 @@ async def score_submission(req: Request) -> bytes:
                 )
             )
 
-            # asyncio.create_task(
-            #     run.run_anticheat(
-            #         s, f".data/replays/{s.id}.osr", f".data/beatmaps/{s.map.map_id}.osu"
-            #     )
-            # )
-
             stats.last_score = s
         else:
             return b"error: disabled"
@@ -447,14 +405,28 @@ async def score_submission(req: Request) -> bytes:
 @osu.add_endpoint("/web/osu-getreplay.php")
 @check_auth("u", "h")
 async def get_replay(req: Request) -> bytes:
-    try:
-        async with aiofiles.open(f".data/replays/{req.get_args['c']}.osr", "rb") as raw:
-            if replay := await raw.read():
-                return replay
-    except OSError as e:
-        log.info(f"Replay ID {req.get_args['c']} cannot be loaded! (File not found?)")
+    if not (score_id := req.get_args["c"]).isdigit():
+        return b""
 
-    return b""
+    if not (replay := await services.replays.get(int(score_id))):
+        log.info(f"Replay ID {score_id} cannot be loaded! (Not found?)")
+        return b""
+
+    return replay
+
+
+@osu.add_endpoint("/web/replays/<score_id>")
+async def export_replay(
+    req: Request, score_id: str
+) -> Union[tuple[int, bytes], bytes]:
+    # the full .osr, unlike osu-getreplay.php that only has the frames
+    if not score_id.isdigit() or not (parts := await replay.export(int(score_id))):
+        return (404, b"")
+
+    req.add_header("Content-Type", "application/octet-stream")
+    req.add_header("Content-Disposition", f'attachment; filename="{score_id}.osr"')
+
+    return b"".join(parts)
 
 
 @osu.add_endpoint("/web/osu-getfriends.php")
@@ -549,10 +521,10 @@ async def osu_direct(req: Request) -> bytes:
 
     log.debug(url)
 
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(url) as resp:
-            a = await resp.text()
-            return a.encode()
+    if not (resp := await services.http.get(url)):
+        return b""
+
+    return resp.data
 
 
 @osu.add_endpoint("/web/osu-search-set.php")
@@ -1,70 +1,174 @@
-from typing import Any, AsyncIterable, Optional
+from typing import Any, AsyncIterator, AsyncIterable, Callable, Optional, Sequence
+from contextlib import asynccontextmanager
+from abc import ABC, abstractmethod
 import aiomysql
+import time
 
+Params = Optional[tuple[Any, ...]] | Any
 
-class Database:
-    def __init__(self):
-        self.pool = None
+# called with (query, params, seconds) after every query
+Hook = Callable[[str, Params, float], None]
 
-    async def connect(self, config: dict[str, str]) -> None:
-        self.pool = await aiomysql.create_pool(**config)
 
-    async def disconnect(self) -> None:
-        self.pool.close()
-        await self.pool.wait_close()
+def _cursor(_dict: bool):
+    return aiomysql.DictCursor if _dict else aiomysql.Cursor
 
-    async def _fetch(
-        self,
-        query: str,
-        params: Optional[tuple[Any, ...]] | Any = None,
-        _dict: bool = False,
-    ):
-        if _dict:
-            cursor = aiomysql.DictCursor
-        else:
-            cursor = aiomysql.Cursor
 
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(cursor) as cur:
+class _Queries(ABC):
+    """
+    The queries, on top of whatever connection `_acquire` hands out. The
+    connection is held until the whole result is read, so no other
+    coroutine can get it in the meantime.
+    """
+
+    hooks: list[Hook]
+    autocommit: bool
+
+    @abstractmethod
+    def _acquire(self):
+        """An async context manager giving a connection."""
+
+    async def _commit(self, conn) -> None:
+        if not self.autocommit:
+            await conn.commit()
+
+    async def _execute(self, cur, query: str, params: Params, many: bool = False):
+        start = time.perf_counter()
+
+        try:
+            if many:
+                await cur.executemany(query, params)
+            else:
                 await cur.execute(query, params)
+        finally:
+            elapsed = time.perf_counter() - start
 
-                return conn, cur
+            for hook in self.hooks:
+                hook(query, params, elapsed)
 
-    async def execute(
-        self, query: str, params: Optional[tuple[Any, ...]] | Any = None
-    ) -> int:
-        conn, cur = await self._fetch(query, params)
+    async def execute(self, query: str, params: Params = None) -> int:
+        async with self._acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._execute(cur, query, params)
+                await self._commit(conn)
 
-        await conn.commit()
-        return cur.lastrowid
+                return cur.lastrowid
 
-    async def fetchall(
+    async def executemany(self, query: str, params: Sequence[tuple[Any, ...]]) -> int:
+        # aiomysql turns INSERT ... VALUES into a single multi-row insert.
+        async with self._acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._execute(cur, query, params, many=True)
+                await self._commit(conn)
+
+                return cur.rowcount
+
+    async def insert_many(
         self,
-        query: str,
-        params: Optional[tuple[Any, ...]] | Any = None,
-        _dict: bool = False,
-    ) -> dict[str, Any]:
-        _, cur = await self._fetch(query, params)
+        table: str,
+        columns: Sequence[str],
+        rows: Sequence[tuple[Any, ...]],
+        batch: int = 1000,
+    ) -> int:
+        query = (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
 
-        return await cur.fetchall()
+        count = 0
+        for i in range(0, len(rows), batch):
+            count += await self.executemany(query, rows[i : i + batch])
+
+        return count
 
     async def fetch(
-        self,
-        query: str,
-        params: Optional[tuple[Any, ...]] | Any = None,
-        _dict: bool = True,
-    ) -> dict[str, Any]:
-        _, cur = await self._fetch(query, params, _dict)
+        self, query: str, params: Params = None, _dict: bool = True
+    ) -> Optional[dict[str, Any]]:
+        async with self._acquire() as conn:
+            async with conn.cursor(_cursor(_dict)) as cur:
+                await self._execute(cur, query, params)
+
+                return await cur.fetchone()
+
+    async def fetchval(self, query: str, params: Params = None) -> Any:
+        """First column of the first row, for the hot paths."""
+        if row := await self.fetch(query, params, _dict=False):
+            return row[0]
+
+    async def fetchall(
+        self, query: str, params: Params = None, _dict: bool = False
+    ) -> list:
+        async with self._acquire() as conn:
+            async with conn.cursor(_cursor(_dict)) as cur:
+                await self._execute(cur, query, params)
 
-        return await cur.fetchone()
+                return await cur.fetchall()
 
     async def iterall(
-        self,
-        query: str,
-        params: Optional[tuple[Any, ...]] | Any = None,
-        _dict: bool = True,
+        self, query: str, params: Params = None, _dict: bool = True
+    ) -> AsyncIterable[dict[str, Any]]:
+        async with self._acquire() as conn:
+            async with conn.cursor(_cursor(_dict)) as cur:
+                await self._execute(cur, query, params)
+
+                async for row in cur:
+                    yield row
+
+    async def stream(
+        self, query: str, params: Params = None, _dict: bool = True
     ) -> AsyncIterable[dict[str, Any]]:
-        _, cur = await self._fetch(query, params, _dict)
+        # unbuffered, so huge results never sit in memory at once.
+        cursor = aiomysql.SSDictCursor if _dict else aiomysql.SSCursor
+
+        async with self._acquire() as conn:
+            async with conn.cursor(cursor) as cur:
+                await self._execute(cur, query, params)
+
+                async for row in cur:
+                    yield row
+
+
+class Transaction(_Queries):
+    """Queries on one connection, committed together or not at all."""
+
+    def __init__(self, conn, hooks: list[Hook]) -> None:
+        self.conn = conn
+        self.hooks = hooks
+
+        # the transaction commits, not every query
+        self.autocommit = True
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[Any]:
+        yield self.conn
+
+
+class Database(_Queries):
+    def __init__(self):
+        self.pool = None
+        self.autocommit: bool = False
+        self.hooks: list[Hook] = []
+
+    async def connect(self, config: dict[str, str]) -> None:
+        self.autocommit = bool(config.get("autocommit", False))
+        self.pool = await aiomysql.create_pool(**config)
+
+    async def disconnect(self) -> None:
+        self.pool.close()
+        await self.pool.wait_closed()
+
+    def _acquire(self):
+        return self.pool.acquire()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Transaction]:
+        async with self.pool.acquire() as conn:
+            await conn.begin()
 
-        async for row in cur:
-            yield row
+            try:
+                yield Transaction(conn, self.hooks)
+            except BaseException:
+                await conn.rollback()
+                raise
+            else:
+                await conn.commit()
@@ -0,0 +1,146 @@
+from typing import Any, Optional
+from functools import lru_cache
+from array import array
+from utils import log
+import ipaddress
+import bisect
+import socket
+import struct
+import csv
+import os
+
+try:
+    import maxminddb
+except ImportError:  # only needed for .mmdb files
+    maxminddb = None
+
+_ipv4 = struct.Struct("!I")
+
+
+def _parse_ip(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+
+    return _ipv4.unpack(socket.inet_aton(value))[0]
+
+
+class GeoIP:
+    """
+    IP to location lookups, from a local database instead of asking an
+    api on every login.
+
+    CSV files are loaded into sorted arrays of IPv4 ranges, and looked up
+    with a binary search. The columns default to the IP2Location LITE
+    DB5 layout, (ip from, ip to, country code, country, region, city,
+    lat, lon); IPs can be numbers or dotted. MaxMind .mmdb files are
+    read through `maxminddb`, if it's installed.
+    """
+
+    def __init__(self) -> None:
+        self.starts: array = array("I")
+        self.ends: array = array("I")
+        self.countries: array = array("H")
+        self.lats: array = array("d")
+        self.lons: array = array("d")
+
+        # country codes, indexed by self.countries
+        self.codes: list[str] = []
+
+        self.reader = None
+
+        self.lookup = lru_cache(maxsize=65536)(self._lookup)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def load(self, config: dict[str, Any]) -> None:
+        if not (path := config.get("path")) or not os.path.isfile(path):
+            log.warn(
+                "No GeoIP database found, locations of players won't be looked up."
+            )
+            return
+
+        self.lookup = lru_cache(maxsize=config.get("cache", 65536))(self._lookup)
+
+        if path.endswith(".mmdb"):
+            if not maxminddb:
+                log.fail("Install maxminddb to use a .mmdb GeoIP database.")
+                return
+
+            self.reader = maxminddb.open_database(path)
+            log.info(f"Loaded the GeoIP database {path}")
+            return
+
+        columns = config.get("columns", {})
+        country_col = columns.get("country", 2)
+        lat_col = columns.get("lat", 6)
+        lon_col = columns.get("lon", 7)
+
+        indexes: dict[str, int] = {}
+        rows = []
+
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if ":" in row[0] or not row[0][:1].isdigit():
+                    continue  # IPv6 ranges and headers
+
+                code = row[country_col].upper()
+
+                if (idx := indexes.get(code)) is None:
+                    idx = indexes[code] = len(self.codes)
+                    self.codes.append(code)
+
+                rows.append(
+                    (
+                        _parse_ip(row[0]),
+                        _parse_ip(row[1]),
+                        idx,
+                        float(row[lat_col]) if len(row) > lat_col else 0.0,
+                        float(row[lon_col]) if len(row) > lon_col else 0.0,
+                    )
+                )
+
+        rows.sort()
+
+        for start, end, idx, lat, lon in rows:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.countries.append(idx)
+            self.lats.append(lat)
+            self.lons.append(lon)
+
+        log.info(f"Loaded {len(rows)} IP ranges from {path}")
+
+    def _lookup(self, ip: str) -> Optional[tuple[float, float, str]]:
+        """Returns (lat, lon, country code), or None if it isn't known."""
+        if self.reader:
+            try:
+                ret = self.reader.get(ip)
+            except ValueError:
+                return
+
+            if not ret or "country" not in ret:
+                return
+
+            loc = ret.get("location", {})
+            return (
+                loc.get("latitude", 0.0),
+                loc.get("longitude", 0.0),
+                ret["country"]["iso_code"],
+            )
+
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return
+
+        if addr.version != 4 or not addr.is_global:
+            return
+
+        value = int(addr)
+        idx = bisect.bisect_right(self.starts, value) - 1
+
+        if idx < 0 or value > self.ends[idx]:
+            return
+
+        return self.lats[idx], self.lons[idx], self.codes[self.countries[idx]]
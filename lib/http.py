@@ -0,0 +1,149 @@
+from typing import Any, Optional
+from urllib.parse import urlsplit
+from utils import log
+import aiohttp
+import asyncio
+import json
+import time
+
+
+class Response:
+    def __init__(self, status: int, data: bytes) -> None:
+        self.status: int = status
+        self.data: bytes = data
+
+    def __bool__(self) -> bool:
+        return self.status == 200
+
+    def text(self) -> str:
+        return self.data.decode(errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.data) if self.data else None
+
+
+class Upstream:
+    """Rate limit and counters of a single host."""
+
+    def __init__(self, per_minute: float = 0) -> None:
+        # a token bucket, that allows a burst of up to a minutes worth.
+        self.rate: float = per_minute / 60
+        self.capacity: float = per_minute
+        self.tokens: float = per_minute
+        self.updated: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+        self.requests: int = 0
+        self.errors: int = 0
+        self.retries: int = 0
+        self.throttled: float = 0.0  # seconds spent waiting on the limit
+        self.latency: float = 0.0
+        self.max_latency: float = 0.0
+
+    async def acquire(self) -> None:
+        if not self.rate:
+            return
+
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                self.throttled += wait
+
+                await asyncio.sleep(wait)
+
+                self.tokens = 1
+                self.updated = time.monotonic()
+
+            self.tokens -= 1
+
+
+class HTTPClient:
+    """
+    The one session every outgoing request goes through, so connections
+    are kept alive and reused instead of set up for every request.
+    """
+
+    def __init__(self) -> None:
+        self.session: aiohttp.ClientSession = None
+        self.upstreams: dict[str, Upstream] = {}
+
+        self.rate_limits: dict[str, float] = {}
+        self.retries: int = 2
+        self.backoff: float = 0.5
+
+    async def connect(self, config: dict[str, Any]) -> None:
+        self.rate_limits = config.get("rate_limits", {})
+        self.retries = config.get("retries", 2)
+        self.backoff = config.get("backoff", 0.5)
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.get("limit", 100),
+                limit_per_host=config.get("limit_per_host", 10),
+                keepalive_timeout=config.get("keepalive", 30),
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=config.get("timeout", 10),
+                connect=config.get("connect_timeout", 3),
+            ),
+        )
+
+    async def disconnect(self) -> None:
+        await self.session.close()
+
+    def upstream(self, host: str) -> Upstream:
+        if not (u := self.upstreams.get(host)):
+            u = self.upstreams[host] = Upstream(self.rate_limits.get(host, 0))
+
+        return u
+
+    async def get(self, url: str, **kwargs) -> Optional[Response]:
+        return await self.request("GET", url, **kwargs)
+
+    async def request(self, method: str, url: str, **kwargs) -> Optional[Response]:
+        """
+        Returns None if the host couldn't be reached. Connection errors,
+        timeouts and 429/5xx responses are retried with backoff.
+        """
+        host = urlsplit(url).hostname
+        u = self.upstream(host)
+        resp = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                u.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            await u.acquire()
+
+            start = time.perf_counter()
+            u.requests += 1
+
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    resp = Response(r.status, await r.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                u.errors += 1
+                # not the whole url, it might have our api key in it
+                log.warn(f"{method} request to {host} failed: {e!r}")
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                u.latency += elapsed
+                u.max_latency = max(u.max_latency, elapsed)
+
+            if resp.status == 429 or resp.status >= 500:
+                u.errors += 1
+                continue
+
+            return resp
+
+        # the last response, even if it's an error
+        return resp
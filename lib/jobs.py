@@ -0,0 +1,329 @@
+from typing import Any, Awaitable, Callable, Optional
+from collections import defaultdict, deque
+from utils import log
+import asyncio
+import base64
+import json
+import time
+import os
+
+Handler = Callable[..., Awaitable[None]]
+
+
+def _encode(arg: Any) -> Any:
+    if isinstance(arg, (bytes, bytearray)):
+        return {"b64": base64.b64encode(arg).decode()}
+
+    return arg
+
+
+def _decode(arg: Any) -> Any:
+    if isinstance(arg, dict) and "b64" in arg:
+        return base64.b64decode(arg["b64"])
+
+    return arg
+
+
+class Job:
+    __slots__ = ("id", "name", "args", "key", "attempts", "queued")
+
+    def __init__(self, id: int, name: str, args: tuple, key: Optional[str]) -> None:
+        self.id: int = id
+        self.name: str = name
+        self.args: tuple = args
+        self.key: Optional[str] = key
+        self.attempts: int = 0
+        self.queued: float = time.monotonic()
+
+    def entry(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "args": [*map(_encode, self.args)],
+            "key": self.key,
+        }
+
+
+class JobStats:
+    def __init__(self) -> None:
+        self.queued: int = 0
+        self.done: int = 0
+        self.failed: int = 0
+        self.retried: int = 0
+        self.time: float = 0.0  # spent running
+        self.max_time: float = 0.0
+        self.wait: float = 0.0  # from being queued until done
+
+
+class JobQueue:
+    """
+    Work that doesn't have to be done before answering a request.
+
+    Jobs are a registered handler name and json-able args (bytes are
+    fine too), run by a fixed amount of worker coroutines. Every job is
+    written to a journal, and marked once it's done, so whatever didn't
+    finish is picked up again after a restart; handlers should be fine
+    with running twice. `put` returns a future that's done once the job
+    is in the journal, to await when losing the job isn't an option,
+    like when it carries the only copy of something. Jobs with the same key run one after the other,
+    in the order they were added, a job being retried included. Failed
+    jobs are retried with backoff, after whatever got added in the
+    meantime without a key.
+    """
+
+    def __init__(self, path: str = ".data/jobs.journal") -> None:
+        self.path: str = path
+        self.handlers: dict[str, Handler] = {}
+
+        self.queue: asyncio.Queue = None
+        self.workers: list[asyncio.Task] = []
+        self.busy: set[asyncio.Task] = set()  # workers in the middle of a job
+        self.stopped: bool = False
+        # key -> jobs waiting for the one with that key that's queued or running
+        self.waiting: dict[str, deque[Job]] = {}
+
+        self.amount: int = 4
+        self.retries: int = 3
+        self.backoff: float = 1.0
+        self.fsync: bool = False
+
+        self.next_id: int = 0
+        self.pending: dict[int, Job] = {}
+        self.high_water: int = 0
+
+        # journal lines waiting to be written, by a single task in the background,
+        # and the futures of whoever is waiting for them to be written.
+        self.lines: list[str] = []
+        self.waiters: list[asyncio.Future] = []
+        self.flushing: Optional[asyncio.Task] = None
+        self.written: int = 0
+
+        self.stats: defaultdict[str, JobStats] = defaultdict(JobStats)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def register(self, name: str) -> Callable[[Handler], Handler]:
+        def wrapper(cb: Handler) -> Handler:
+            self.handlers[name] = cb
+            return cb
+
+        return wrapper
+
+    async def start(self, config: dict[str, Any]) -> None:
+        self.amount = config.get("workers", 4)
+        self.retries = config.get("retries", 3)
+        self.backoff = config.get("backoff", 1.0)
+        self.fsync = config.get("fsync", False)
+
+        self.queue = asyncio.Queue()
+
+        loop = asyncio.get_running_loop()
+        unfinished = await loop.run_in_executor(None, self._load)
+
+        for job in unfinished:
+            self.next_id = max(self.next_id, job.id + 1)
+            self._enqueue(job)
+
+        if unfinished:
+            log.info(f"Picked up {len(unfinished)} unfinished jobs")
+
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.amount)
+        ]
+
+    def put(
+        self, name: str, *args: Any, key: Optional[str] = None
+    ) -> asyncio.Future:
+        job = Job(self.next_id, name, args, key)
+        self.next_id += 1
+
+        written = self._journal(job.entry())
+        self._enqueue(job)
+
+        return written
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """
+        Lets the jobs that are running finish and writes out the journal;
+        whatever is still queued is picked up again on the next start.
+        """
+        self.stopped = True
+
+        for worker in self.workers:
+            if worker not in self.busy:
+                worker.cancel()
+
+        if self.workers:
+            _, running = await asyncio.wait(self.workers, timeout=timeout)
+
+            if running:
+                log.warn(f"{len(running)} jobs didn't finish in {timeout}s, leaving them")
+
+                for worker in running:
+                    worker.cancel()
+
+        self.workers = []
+
+        while self.flushing:
+            await asyncio.wait([self.flushing])
+
+    def _enqueue(self, job: Job) -> None:
+        self.pending[job.id] = job
+        self.high_water = max(self.high_water, len(self.pending))
+        self.stats[job.name].queued += 1
+
+        if job.key:
+            if (waiting := self.waiting.get(job.key)) is not None:
+                waiting.append(job)
+                return
+
+            self.waiting[job.key] = deque()
+
+        self.queue.put_nowait(job)
+
+    async def _worker(self) -> None:
+        while not self.stopped:
+            job: Job = await self.queue.get()
+            worker = asyncio.current_task()
+
+            self.busy.add(worker)
+            try:
+                await self._run(job)
+            finally:
+                self.busy.discard(worker)
+
+    async def _run(self, job: Job) -> None:
+        stats = self.stats[job.name]
+
+        if not (handler := self.handlers.get(job.name)):
+            log.fail(f"There's no handler for {job.name} jobs, dropping it.")
+            self._done(job)
+            return
+
+        job.attempts += 1
+        start = time.perf_counter()
+
+        try:
+            await handler(*job.args)
+        except Exception as e:
+            if job.attempts <= self.retries:
+                stats.retried += 1
+
+                delay = self.backoff * 2 ** (job.attempts - 1)
+                log.warn(
+                    f"{job.name} job failed ({e!r}), trying again in {delay:.1f}s"
+                )
+
+                asyncio.get_running_loop().call_later(
+                    delay, self.queue.put_nowait, job
+                )
+                return
+
+            stats.failed += 1
+            log.fail(f"{job.name} job failed {job.attempts} times, giving up: {e!r}")
+        else:
+            stats.done += 1
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+        stats.wait += time.monotonic() - job.queued
+        self._done(job)
+
+    def _done(self, job: Job) -> None:
+        del self.pending[job.id]
+        self._journal({"done": job.id})
+
+        # the next one with the same key can go now
+        if job.key and (waiting := self.waiting.get(job.key)) is not None:
+            if waiting:
+                self.queue.put_nowait(waiting.popleft())
+            else:
+                del self.waiting[job.key]
+
+    def _journal(self, entry: dict[str, Any]) -> asyncio.Future:
+        written = asyncio.get_running_loop().create_future()
+
+        self.lines.append(json.dumps(entry) + "\n")
+        self.waiters.append(written)
+
+        if not self.flushing:
+            self.flushing = asyncio.create_task(self._flush())
+
+        return written
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        try:
+            while self.lines:
+                lines, self.lines = self.lines, []
+                waiters, self.waiters = self.waiters, []
+
+                # once everything is done the journal can start over
+                truncate = not self.pending and self.written > 10000
+
+                try:
+                    await loop.run_in_executor(None, self._append, lines, truncate)
+                except Exception as e:
+                    log.fail(f"Failed to write {len(lines)} lines to the job journal: {e!r}")
+
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+
+                    continue
+
+                self.written = 0 if truncate else self.written + len(lines)
+
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self.flushing = None
+
+    def _append(self, lines: list[str], truncate: bool) -> None:
+        with open(self.path, "w" if truncate else "a") as f:
+            if not truncate:
+                f.writelines(lines)
+
+            f.flush()
+
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _load(self) -> list[Job]:
+        if not os.path.isfile(self.path):
+            return []
+
+        jobs: dict[int, Job] = {}
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # the last line, if we died while writing it
+
+                if "done" in entry:
+                    jobs.pop(entry["done"], None)
+                    continue
+
+                jobs[entry["id"]] = Job(
+                    entry["id"],
+                    entry["name"],
+                    tuple(map(_decode, entry["args"])),
+                    entry.get("key"),
+                )
+
+        # only keep what's still left
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(json.dumps(job.entry()) + "\n" for job in jobs.values())
+
+        os.replace(tmp, self.path)
+        self.written = len(jobs)
+
+        return [*jobs.values()]
@@ -0,0 +1,235 @@
+from typing import Any, Optional
+from collections import deque
+from functools import lru_cache, partial
+from lib.database import Hook, Params
+from aioredis.client import Pipeline
+from utils import log
+import aioredis
+import bisect
+import time
+import sys
+import os
+import re
+
+# upper bounds of the histogram buckets, in seconds; the last bucket is everything above
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_strings = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_hashes = re.compile(r"\b[0-9a-fA-F]{32}\b")
+_numbers = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_params = re.compile(r"%s|%\(\w+\)s")
+_lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_spaces = re.compile(r"\s+")
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_lib = os.path.join(_root, "lib")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(query: str) -> str:
+    """
+    The query with its literals taken out, so the same statement with
+    different values (or ids formatted into it) is counted as one.
+    """
+    query = _strings.sub("?", query)
+    query = _hashes.sub("?", query)
+    query = _numbers.sub("?", query)
+    query = _params.sub("?", query)
+    query = _lists.sub("(?+)", query)
+
+    return _spaces.sub(" ", query).strip()
+
+
+def _callers() -> tuple[str, str]:
+    # the frames of whatever is awaiting the query are still on the stack,
+    # so the innermost one of ours that isn't in lib/ made the query, and
+    # the outermost one is the handler it came from.
+    caller = handler = ""
+    frame = sys._getframe(2)
+
+    while frame:
+        path = frame.f_code.co_filename
+
+        if path.startswith(_root) and not path.startswith(_lib):
+            handler = (
+                f"{os.path.relpath(path, _root)}:{frame.f_lineno} "
+                f"({frame.f_code.co_name})"
+            )
+            caller = caller or handler
+
+        frame = frame.f_back
+
+    return caller, handler
+
+
+class Statement:
+    def __init__(self, kind: str, fingerprint: str) -> None:
+        self.kind: str = kind
+        self.fingerprint: str = fingerprint
+
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.slow: int = 0
+        self.buckets: list[int] = [0] * (len(BUCKETS) + 1)
+
+    def add(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.buckets[bisect.bisect_left(BUCKETS, elapsed)] += 1
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket the q-th percentile falls in."""
+        wanted = q * self.count
+        seen = 0
+
+        for idx, amount in enumerate(self.buckets):
+            seen += amount
+
+            if seen >= wanted and amount:
+                return BUCKETS[idx] if idx < len(BUCKETS) else self.max
+
+        return 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "statement": self.fingerprint,
+            "count": self.count,
+            "total": self.total,
+            "avg": self.avg,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "slow": self.slow,
+            "buckets": dict(zip([*map(str, BUCKETS), "inf"], self.buckets)),
+        }
+
+
+class QueryStats:
+    """
+    Counts, time and a latency histogram of every statement, sql and
+    redis, grouped by their fingerprint. Anything slower than the
+    threshold also goes in the slow log, with where it was made from.
+    """
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        self.threshold: float = config.get("slow", 0.1)
+        self.statements: dict[tuple[str, str], Statement] = {}
+        self.slow_log: deque[dict[str, Any]] = deque(maxlen=config.get("slow_log", 100))
+        self.started: float = time.time()
+
+    def hook(self, kind: str) -> Hook:
+        return partial(self.record, kind)
+
+    def record(self, kind: str, query: str, params: Params, elapsed: float) -> None:
+        key = (kind, fingerprint(query))
+
+        if not (stmt := self.statements.get(key)):
+            stmt = self.statements[key] = Statement(*key)
+
+        stmt.add(elapsed)
+
+        if elapsed < self.threshold:
+            return
+
+        stmt.slow += 1
+        caller, handler = _callers()
+
+        # no params; they can have passwords and such in them
+        self.slow_log.append(
+            {
+                "time": time.time(),
+                "kind": kind,
+                "elapsed": elapsed,
+                "statement": query[:500],
+                "caller": caller,
+                "handler": handler,
+            }
+        )
+
+        log.warn(
+            f"Slow {kind} statement ({elapsed * 1000:.0f}ms) from {handler}: {key[1][:200]}"
+        )
+
+    def top(
+        self, amount: int = 10, kind: Optional[str] = None, key: str = "total"
+    ) -> list[Statement]:
+        return sorted(
+            (s for s in self.statements.values() if not kind or s.kind == kind),
+            key=lambda s: getattr(s, key),
+            reverse=True,
+        )[:amount]
+
+    def reset(self) -> None:
+        self.statements.clear()
+        self.slow_log.clear()
+        self.started = time.time()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "since": self.started,
+            "threshold": self.threshold,
+            "statements": [s.as_dict() for s in self.top(len(self.statements))],
+            "slow": list(self.slow_log),
+        }
+
+
+class TimedRedis(aioredis.Redis):
+    """aioredis client that reports every command to its hooks, like `Database`."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.hooks: list[Hook] = []
+
+    async def execute_command(self, *args, **options) -> Any:
+        start = time.perf_counter()
+
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            # command and key, the values only go in the params
+            statement = " ".join(str(arg) for arg in args[:2])
+            for hook in self.hooks:
+                hook(statement, args[2:], elapsed)
+
+    def pipeline(
+        self, transaction: bool = True, shard_hint: Optional[str] = None
+    ) -> "TimedPipeline":
+        pipe = TimedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+        pipe.hooks = self.hooks
+
+        return pipe
+
+
+class TimedPipeline(Pipeline):
+    """
+    Pipelines don't go through `execute_command` of the client, so they're
+    timed as a whole when they run, as one statement of the commands in it.
+    """
+
+    hooks: list[Hook] = []
+
+    async def execute(self, raise_on_error: bool = True) -> list[Any]:
+        if not (stack := self.command_stack):
+            return await super().execute(raise_on_error)
+
+        start = time.perf_counter()
+
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            statement = "PIPELINE " + " ".join(sorted({str(a[0]) for a, _ in stack}))
+            for hook in self.hooks:
+                hook(statement, (len(stack),), elapsed)
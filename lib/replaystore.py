@@ -0,0 +1,388 @@
+from typing import Any, Iterator, Optional
+from collections import OrderedDict
+from utils import log
+import asyncio
+import struct
+import zlib
+import mmap
+import os
+
+# in front of every replay in a segment: score id, length, crc32
+_header = struct.Struct("<QII")
+# a line of the index: score id, segment, offset of the data, length; 0 removes it
+_entry = struct.Struct("<QIQI")
+
+
+class ReplayStore:
+    """
+    Replays, appended to big segment files instead of a file for each.
+
+    Where every replay is, (segment, offset, length) by score id, is
+    kept in memory and in an append-only index file, so saving one is
+    two appends. Replays in a segment have a small header with their
+    score id and crc, so the index can be rebuilt from the segments if
+    it's ever lost. Segments are read through mmap, and the most
+    recently read replays are kept in memory.
+
+    Replaced and removed replays leave their old copy behind, until
+    `compact` moves what's left of mostly dead segments to the end and
+    deletes them.
+    """
+
+    def __init__(self, path: str = ".data/replays") -> None:
+        self.path: str = path
+
+        self.index: dict[int, tuple[int, int, int]] = {}
+        self.sizes: dict[int, int] = {}  # segment -> bytes in it
+        self.live: dict[int, int] = {}  # segment -> bytes still in the index
+
+        self.active: int = 0
+        self.active_fd: int = -1
+        self.index_fd: int = -1
+        self.maps: dict[int, mmap.mmap] = {}
+
+        self.segment_size: int = 256 << 20
+        self.fsync: bool = False
+
+        self.cache: OrderedDict[int, bytes] = OrderedDict()
+        self.cache_bytes: int = 0
+        self.cache_size: int = 64 << 20
+
+        # writes and compaction, reads don't need it
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.written: int = 0
+
+    def __contains__(self, score_id: int) -> bool:
+        return score_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def segment(self, n: int) -> str:
+        return os.path.join(self.path, f"{n:08d}.seg")
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.path, "index")
+
+    # the blocking parts, ran in an executor
+
+    def load(self, config: dict[str, Any], readonly: bool = False) -> None:
+        """
+        `readonly` only reads what's there, so it can be used next to a
+        running server; nothing can be written then.
+        """
+        self.segment_size = config.get("segment_size", 256 << 20)
+        self.cache_size = config.get("cache", 64 << 20)
+        self.fsync = config.get("fsync", False)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        names = os.listdir(self.path)
+        segments = sorted(int(name[:-4]) for name in names if name.endswith(".seg"))
+
+        if legacy := sum(
+            name.endswith(".osr") and name != "0.osr" for name in names
+        ):
+            log.warn(
+                f"There are {legacy} replays from before they were packed, "
+                "move them over with `python -m tools.replays migrate`."
+            )
+
+        for n in segments:
+            self.sizes[n] = os.path.getsize(self.segment(n))
+            self.live[n] = 0
+
+        if os.path.isfile(self.index_path):
+            self._read_index(readonly)
+        else:
+            if segments:
+                log.warn("The replay index is missing, rebuilding it from the segments.")
+
+            self._rebuild_index(segments, readonly)
+
+        self.active = segments[-1] if segments else 0
+
+        if not readonly:
+            self.sizes.setdefault(self.active, 0)
+            self.live.setdefault(self.active, 0)
+            self.active_fd = os.open(
+                self.segment(self.active), os.O_RDWR | os.O_CREAT | os.O_APPEND
+            )
+
+        for n in segments:
+            self._map(n)
+
+        log.info(f"Found {len(self.index)} replays in {len(self.sizes)} segments")
+
+    def _read_index(self, readonly: bool = False) -> None:
+        with open(self.index_path, "rb") as f:
+            raw = f.read()
+
+        # a torn last entry, from dying halfway through writing it
+        usable = len(raw) - len(raw) % _entry.size
+
+        for score_id, n, offset, length in _entry.iter_unpack(
+            memoryview(raw)[:usable]
+        ):
+            self._set(score_id, (n, offset, length) if length else None)
+
+        # anything pointing past the end of its segment never made it to disk
+        for score_id, (n, offset, length) in list(self.index.items()):
+            if offset + length > self.sizes.get(n, 0):
+                self._set(score_id, None)
+
+        if readonly:
+            return
+
+        self.index_fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND)
+
+        if usable != len(raw):
+            os.ftruncate(self.index_fd, usable)
+
+    def _rebuild_index(self, segments: list[int], readonly: bool = False) -> None:
+        # removed replays that weren't compacted away yet come back, but
+        # replaced ones don't; the newer copy is always further along.
+        for n in segments:
+            for score_id, offset, length in self.scan(n):
+                self._set(score_id, (n, offset, length))
+
+        if not readonly:
+            self._write_index()
+
+    def scan(self, n: int, verify: bool = False) -> Iterator[tuple[int, int, int]]:
+        """Every replay in a segment, as (score id, offset, length)."""
+        with open(self.segment(n), "rb") as f:
+            pos = 0
+
+            while header := f.read(_header.size):
+                if len(header) < _header.size:
+                    return
+
+                score_id, length, crc = _header.unpack(header)
+                data = f.read(length)
+
+                if len(data) < length:
+                    return  # cut off
+
+                if verify and zlib.crc32(data) != crc:
+                    log.warn(f"Replay of score {score_id} in segment {n} is corrupted")
+                else:
+                    yield score_id, pos + _header.size, length
+
+                pos += _header.size + length
+
+    def _write_index(self) -> None:
+        # the live entries only, so the index doesn't grow forever
+        tmp = self.index_path + ".tmp"
+
+        with open(tmp, "wb") as f:
+            f.write(
+                b"".join(
+                    _entry.pack(score_id, *loc) for score_id, loc in self.index.items()
+                )
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, self.index_path)
+
+        if self.index_fd != -1:
+            os.close(self.index_fd)
+
+        self.index_fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND)
+
+    def _set(self, score_id: int, loc: Optional[tuple[int, int, int]]) -> None:
+        if old := self.index.pop(score_id, None):
+            self.live[old[0]] -= old[2]
+
+        if loc:
+            self.index[score_id] = loc
+            self.live[loc[0]] = self.live.get(loc[0], 0) + loc[2]
+
+    def _map(self, n: int) -> Optional[mmap.mmap]:
+        if not os.path.getsize(self.segment(n)):
+            return  # can't map an empty file
+
+        with open(self.segment(n), "rb") as f:
+            mm = self.maps[n] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return mm
+
+    def write(self, score_id: int, data: bytes) -> tuple[int, int, int]:
+        if self.sizes[self.active] + _header.size + len(data) > self.segment_size:
+            self._seal()
+
+        n = self.active
+        offset = self.sizes[n] + _header.size
+
+        os.write(
+            self.active_fd, _header.pack(score_id, len(data), zlib.crc32(data)) + data
+        )
+        os.write(self.index_fd, _entry.pack(score_id, n, offset, len(data)))
+
+        if self.fsync:
+            self.sync()
+
+        self.sizes[n] = offset + len(data)
+        self._set(score_id, (n, offset, len(data)))
+        self.written += 1
+
+        return n, offset, len(data)
+
+    def _seal(self) -> None:
+        os.fsync(self.active_fd)
+        os.close(self.active_fd)
+
+        self.active += 1
+        self.sizes[self.active] = 0
+        self.live[self.active] = 0
+        self.active_fd = os.open(
+            self.segment(self.active), os.O_RDWR | os.O_CREAT | os.O_APPEND
+        )
+
+    def _remove(self, score_id: int) -> None:
+        os.write(self.index_fd, _entry.pack(score_id, 0, 0, 0))
+        self._set(score_id, None)
+
+    def read(self, loc: tuple[int, int, int]) -> bytes:
+        n, offset, length = loc
+
+        if n not in self.sizes:
+            raise ValueError(f"segment {n} was compacted")
+
+        mm = self.maps.get(n)
+
+        if not mm or len(mm) < offset + length:
+            # the segment being written to grew since it was mapped. the old
+            # map is left for whoever might still be reading from it.
+            mm = self._map(n)
+
+        return mm[offset : offset + length]
+
+    def view(self, score_id: int) -> Optional[memoryview]:
+        """
+        The replay straight out of the mapped segment, without copying
+        it. Only for tools, since it stops its segment from being closed.
+        """
+        if not (loc := self.index.get(score_id)):
+            return
+
+        n, offset, length = loc
+
+        if not (mm := self.maps.get(n)) or len(mm) < offset + length:
+            mm = self._map(n)
+
+        return memoryview(mm)[offset : offset + length]
+
+    def rewrite(self, threshold: float) -> tuple[int, int]:
+        removed = reclaimed = 0
+
+        for n in sorted(self.sizes):
+            if n == self.active or self.live[n] > self.sizes[n] * threshold:
+                continue
+
+            reclaimed += self.sizes[n] - self.live[n]
+
+            for score_id, loc in [
+                (score_id, loc) for score_id, loc in self.index.items() if loc[0] == n
+            ]:
+                self.write(score_id, self.read(loc))
+
+            removed += 1
+            del self.sizes[n], self.live[n]
+
+            if mm := self.maps.pop(n, None):
+                mm.close()
+
+            os.remove(self.segment(n))
+
+        if removed:
+            self._write_index()
+
+        return removed, reclaimed
+
+    def sync(self) -> None:
+        os.fsync(self.active_fd)
+        os.fsync(self.index_fd)
+
+    def close(self) -> None:
+        for mm in self.maps.values():
+            mm.close()
+
+        self.maps.clear()
+
+        for fd in (self.active_fd, self.index_fd):
+            if fd != -1:
+                os.close(fd)
+
+        self.active_fd = self.index_fd = -1
+
+    # and the async side
+
+    def _cache(self, score_id: int, data: bytes) -> None:
+        if len(data) > self.cache_size // 4:
+            return
+
+        if old := self.cache.pop(score_id, None):
+            self.cache_bytes -= len(old)
+
+        self.cache[score_id] = data
+        self.cache_bytes += len(data)
+
+        while self.cache_bytes > self.cache_size:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old)
+
+    def _uncache(self, score_id: int) -> None:
+        if old := self.cache.pop(score_id, None):
+            self.cache_bytes -= len(old)
+
+    async def get(self, score_id: int) -> Optional[bytes]:
+        if (data := self.cache.get(score_id)) is not None:
+            self.cache.move_to_end(score_id)
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+
+        # twice, in case compaction moved it while we were reading
+        for _ in range(2):
+            if not (loc := self.index.get(score_id)):
+                return
+
+            try:
+                data = await loop.run_in_executor(None, self.read, loc)
+            except (ValueError, OSError):
+                continue
+
+            self._cache(score_id, data)
+            return data
+
+    async def put(self, score_id: int, data: bytes) -> None:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.write, score_id, data)
+
+        # new scores, #1s especially, are the ones that get watched
+        self._cache(score_id, data)
+
+    async def remove(self, score_id: int) -> None:
+        self._uncache(score_id)
+
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._remove, score_id)
+
+    async def compact(self, threshold: float = 0.5) -> tuple[int, int]:
+        """
+        Rewrites full segments where at most `threshold` of the bytes are
+        still used; returns how many were removed and the bytes freed.
+        """
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.rewrite, threshold)
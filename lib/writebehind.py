@@ -0,0 +1,157 @@
+from typing import Any, Optional, Sequence
+from lib.database import Database
+from utils import log
+import asyncio
+import time
+
+
+def _combine(current: list, row: list, deltas: int, newer: bool = True) -> None:
+    for idx in range(deltas):
+        current[idx] += row[idx]
+
+    if newer:
+        current[deltas:] = row[deltas:]
+
+
+class WriteBehind:
+    """
+    Counters that are added up in memory, and written every `interval`
+    seconds instead of on every change.
+
+    Statements take the deltas first, then any plain values and the key
+    last, like `UPDATE t SET a = a + %s, b = %s WHERE id = %s`; deltas of
+    the same key are summed, values are replaced by the newest one.
+    Each flush is a single transaction, so a busy row is only updated
+    once per flush however often it changed.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self.db: Database = db
+        self.interval: float = 5.0
+
+        # statement -> key -> [*deltas, *values]
+        self.pending: dict[str, dict[tuple, list]] = {}
+        # what's being written right now, still counts for `get`
+        self.flushing: dict[str, dict[tuple, list]] = {}
+        # statement -> how many of the params are deltas
+        self.deltas: dict[str, int] = {}
+
+        self.task: Optional[asyncio.Task] = None
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+        self.added: int = 0
+        self.written: int = 0
+        self.flushes: int = 0
+        self.errors: int = 0
+        self.flush_time: float = 0.0
+        self.max_flush_time: float = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.pending.values())
+
+    async def start(self, config: dict[str, Any]) -> None:
+        self.interval = config.get("interval", 5.0)
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+        await self.flush()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                log.fail(f"Failed to write {len(self)} pending rows: {e!r}")
+
+    def add(
+        self,
+        statement: str,
+        key: tuple,
+        deltas: Sequence[int | float],
+        values: Sequence[Any] = (),
+    ) -> None:
+        self.added += 1
+        self._merge(self.pending, statement, key, [*deltas, *values], len(deltas))
+
+    def _merge(
+        self,
+        into: dict[str, dict[tuple, list]],
+        statement: str,
+        key: tuple,
+        row: list,
+        deltas: int,
+        newer: bool = True,
+    ) -> None:
+        self.deltas[statement] = deltas
+        rows = into.setdefault(statement, {})
+
+        if current := rows.get(key):
+            _combine(current, row, deltas, newer)
+        else:
+            rows[key] = row
+
+    def get(self, statement: str, key: tuple) -> Optional[list]:
+        """
+        What hasn't been written for this key yet, to apply on top of
+        whatever is read from the database in the meantime.
+        """
+        ret = None
+
+        for pending in (self.flushing, self.pending):
+            if not (row := pending.get(statement, {}).get(key)):
+                continue
+
+            if ret is None:
+                ret = list(row)
+            else:
+                _combine(ret, row, self.deltas[statement])
+
+        return ret
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if not self.pending:
+                return
+
+            self.flushing, self.pending = self.pending, {}
+            start = time.perf_counter()
+
+            try:
+                async with self.db.transaction() as tx:
+                    for statement, rows in self.flushing.items():
+                        # always the same order, so two flushes can't deadlock
+                        await tx.executemany(
+                            statement,
+                            [(*rows[key], *key) for key in sorted(rows)],
+                        )
+            except BaseException:
+                self.errors += 1
+
+                # keep them for the next flush, with anything added since
+                for statement, rows in self.flushing.items():
+                    for key, row in rows.items():
+                        self._merge(
+                            self.pending,
+                            statement,
+                            key,
+                            row,
+                            self.deltas[statement],
+                            newer=False,
+                        )
+
+                raise
+            else:
+                self.flushes += 1
+                self.written += sum(len(rows) for rows in self.flushing.values())
+            finally:
+                self.flushing = {}
+
+                elapsed = time.perf_counter() - start
+                self.flush_time += elapsed
+                self.max_flush_time = max(self.max_flush_time, elapsed)
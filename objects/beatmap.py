@@ -1,9 +1,11 @@
-import aiohttp
 from objects import services
 from utils import log
 from constants.playmode import Mode
 from constants.beatmap import Approved
 
+# plays and passes are counted up in memory, and written with the next write behind flush
+PLAYS = "UPDATE beatmaps SET plays = plays + %s, passes = passes + %s WHERE hash = %s"
+
 
 class Beatmap:
     def __init__(self):
@@ -42,11 +44,16 @@ class Beatmap:
         self.rating: float = 0.0  # added
 
         self.approved: Approved = Approved.PENDING
-        self.scores: int = 0
+
+    def add_play(self, passed: bool) -> None:
+        self.plays += 1
+        self.passes += passed
+
+        services.write_behind.add(PLAYS, (self.hash_md5,), (1, int(passed)))
 
     @property
     def file(self) -> str:
-        return f"{self.map_id}.osu"
+        return f"{self.hash_md5}.osu"
 
     @property
     def pass_procent(self) -> float:
@@ -68,9 +75,8 @@ class Beatmap:
     def embed(self) -> str:
         return f"[{self.url} {self.full_title}]"
 
-    @property
-    def web_format(self) -> str:
-        return f"{self.approved}|false|{self.map_id}|{self.set_id}|{self.scores}\n0\n{self.display_title}\n{self.rating}"
+    def web_format(self, scores: int = 0) -> str:
+        return f"{self.approved}|false|{self.map_id}|{self.set_id}|{scores}\n0\n{self.display_title}\n{self.rating}"
 
     @staticmethod
     def add_chart(name: str, prev: int | float = 0.0, after: int | float = 0.0) -> str:
@@ -125,6 +131,10 @@ class Beatmap:
         b.passes = ret["passes"]
         b.favorites = ret["favorites"]
 
+        if pending := services.write_behind.get(PLAYS, (b.hash_md5,)):
+            b.plays += pending[0]
+            b.passes += pending[1]
+
         b.rating = ret["rating"]
 
         return b
@@ -154,18 +164,15 @@ class Beatmap:
     async def _get_beatmap_from_osuapi(cls, hash: str, beatmap_id: int) -> "Beatmap":
         b = cls()
 
-        async with aiohttp.ClientSession() as session:
-            # get the beatmap with its hash
-            async with session.get(
-                f"https://osu.ppy.sh/api/get_beatmaps?k={services.osu_key}&{'h' if hash else 'b'}={hash or beatmap_id}"
-            ) as resp:
-                if not resp or resp.status != 200:
-                    return
+        # get the beatmap with its hash
+        resp = await services.http.get(
+            f"https://osu.ppy.sh/api/get_beatmaps?k={services.osu_key}&{'h' if hash else 'b'}={hash or beatmap_id}"
+        )
 
-                if not (b_data := await resp.json()):
-                    return
+        if not resp or not (b_data := resp.json()):
+            return
 
-                ret = b_data[0]
+        ret = b_data[0]
 
         b.set_id = int(ret["beatmapset_id"])
         b.map_id = int(ret["beatmap_id"])
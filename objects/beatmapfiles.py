@@ -0,0 +1,158 @@
+from typing import Optional
+from objects import services
+from utils import log
+import tempfile
+import asyncio
+import hashlib
+import time
+import re
+import os
+
+_md5 = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BeatmapFiles:
+    """
+    .osu files, stored by their md5.
+
+    Since the name is the content, an updated map just gets a new file
+    and the old version stays around for the scores set on it. Which
+    files exist is kept in memory, downloads of the same file are only
+    done once, and they are checked against the md5 before being moved
+    into place.
+    """
+
+    def __init__(self, path: str = ".data/beatmaps") -> None:
+        self.path: str = path
+        self.url: str = services.config["api_conf"].get(
+            "osu_files", "https://osu.ppy.sh/web/osu-getosufile.php?q={}"
+        )
+
+        self.files: set[str] = set()
+        self.downloads: dict[str, asyncio.Future] = {}
+        # hashes of outdated versions -> (the md5 we got instead, until when)
+        self.outdated: dict[str, tuple[str, float]] = {}
+        self.outdated_for: float = 24 * 60 * 60
+
+        self.downloaded: int = 0
+        self.mismatched: int = 0
+        self.failed: int = 0
+
+    def __contains__(self, hash: str) -> bool:
+        return hash in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def file(self, hash: str) -> str:
+        return os.path.join(self.path, f"{hash}.osu")
+
+    def load(self) -> None:
+        for entry in os.scandir(self.path):
+            name, ext = os.path.splitext(entry.name)
+
+            if ext != ".osu":
+                continue
+
+            if _md5.match(name):
+                self.files.add(name)
+                continue
+
+            # from before files were stored by their md5 ({map id}.osu)
+            with open(entry.path, "rb") as f:
+                hash = hashlib.md5(f.read()).hexdigest()
+
+            os.replace(entry.path, self.file(hash))
+            self.files.add(hash)
+
+        log.info(f"Found {len(self.files)} .osu files")
+
+    def _write(self, hash: str, data: bytes) -> None:
+        # written next to it first, so nobody ever reads half a file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+
+            os.replace(tmp, self.file(hash))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    async def _download(self, hash: str, map_id: int) -> Optional[str]:
+        resp = await services.http.get(
+            self.url.format(map_id), headers={"user-agent": "osu!"}
+        )
+
+        if not resp or not (data := resp.data):
+            log.fail(
+                f"Couldn't fetch the .osu file of {map_id}. Maybe because api rate limit?"
+            )
+            self.failed += 1
+            return
+
+        actual = hashlib.md5(data).hexdigest()
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, actual, data)
+
+        self.files.add(actual)
+        self.downloaded += 1
+
+        if actual != hash:
+            # the map got updated since; keep it, it's still a valid version.
+            log.warn(f"The .osu file of {map_id} is {actual}, expected {hash}")
+            self.mismatched += 1
+
+            # so it isn't downloaded again every time the old version is asked for
+            self.outdated[hash] = (actual, time.time() + self.outdated_for)
+            return
+
+        return self.file(hash)
+
+    async def get(self, hash: str, map_id: int) -> Optional[str]:
+        """Path to the .osu file with this md5, downloaded if we don't have it."""
+        if hash in self.files:
+            return self.file(hash)
+
+        if self.is_outdated(hash):
+            return
+
+        if download := self.downloads.get(hash):
+            return await asyncio.shield(download)
+
+        download = self.downloads[hash] = asyncio.get_running_loop().create_future()
+
+        try:
+            path = await self._download(hash, map_id)
+        except asyncio.CancelledError:
+            download.cancel()
+            raise
+        except Exception as e:
+            log.fail(f"Failed to download the .osu file of {map_id}: {e}")
+            self.failed += 1
+            path = None
+        finally:
+            del self.downloads[hash]
+
+        download.set_result(path)
+        return path
+
+    def is_outdated(self, hash: str) -> bool:
+        if not (entry := self.outdated.get(hash)):
+            return False
+
+        if entry[1] < time.time():
+            del self.outdated[hash]
+            return False
+
+        return True
+
+    def prefetch(self, hash: str, map_id: int) -> None:
+        if (
+            hash not in self.files
+            and hash not in self.downloads
+            and not self.is_outdated(hash)
+        ):
+            asyncio.create_task(self.get(hash, map_id))
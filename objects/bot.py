@@ -1,6 +1,8 @@
 from objects.player import Player
 from constants.player import bStatus
+from packets.queue import NullQueue
 from packets import writer
+from objects import broadcast
 from objects import services
 
 
@@ -20,12 +22,13 @@ class Louise:
         p.status_text = "over deez nutz"
 
         p.bot = True
+        p.queue = NullQueue()  # louise never polls
 
         services.bot = p
 
         services.players.add(p)
 
-        for player in services.players.players:
-            player.enqueue(await writer.UserPresence(p) + await writer.UpdateStats(p))
+        broadcast.everyone(writer.UserPresence(p))
+        broadcast.everyone(writer.UpdateStats(p))
 
         return True
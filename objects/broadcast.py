@@ -0,0 +1,78 @@
+from typing import Container, Iterable, Optional, TYPE_CHECKING
+from constants.player import PresenceFilter
+from objects import services
+
+if TYPE_CHECKING:
+    from objects.channel import Channel
+    from objects.match import Match
+    from objects.player import Player
+
+# Packets are encoded once into an immutable frame, and every recipient
+# only gets a reference to that frame appended to their queue. The queue
+# itself is joined together when the client polls (`Player.dequeue`).
+
+
+def send(
+    recipients: Iterable["Player"], frame: bytes, ignore: Container[int] = ()
+) -> None:
+    if not frame:
+        return
+
+    # never share something that can change under our feet
+    if type(frame) is not bytes:
+        frame = bytes(frame)
+
+    if ignore:
+        for p in recipients:
+            if p.id not in ignore:
+                p.enqueue(frame)
+    else:
+        for p in recipients:
+            p.enqueue(frame)
+
+
+def everyone(frame: bytes, ignore: Container[int] = ()) -> None:
+    send(services.players.players, frame, ignore)
+
+
+def channel(c: "Channel", frame: bytes, ignore: Container[int] = ()) -> None:
+    send(c.connected.values(), frame, ignore)
+
+
+def match(
+    m: "Match", frame: bytes, ignore: Container[int] = (), lobby: bool = False
+) -> None:
+    send(m.connected, frame, ignore)
+
+    if lobby:
+        send(services.matches.lobby.values(), frame, ignore)
+
+
+def friends(
+    p: "Player",
+    frame: bytes,
+    ignore: Container[int] = (),
+    recipients: Optional[Iterable["Player"]] = None,
+) -> None:
+    """Everyone online (or in `recipients`) who has `p` on their friends list."""
+    if recipients is None:
+        recipients = services.players.players
+
+    send([f for f in recipients if p.id in f.friends], frame, ignore)
+
+
+def presence(p: "Player", frame: bytes, ignore: Container[int] = ()) -> None:
+    """
+    The presence or stats of `p`: to everyone, except players who only
+    want to hear about their friends.
+    """
+    wants_all, wants_friends = [], []
+
+    for f in services.players.players:
+        if f.presence_filter == PresenceFilter.FRIENDS:
+            wants_friends.append(f)
+        else:
+            wants_all.append(f)
+
+    send(wants_all, frame, ignore)
+    friends(p, frame, ignore, wants_friends)
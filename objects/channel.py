@@ -1,5 +1,6 @@
-from typing import TYPE_CHECKING
+from typing import Container, TYPE_CHECKING
 
+from objects import broadcast
 from objects import services
 from packets import writer
 from utils import log
@@ -21,7 +22,8 @@ class Channel:
 
         self.staff: bool = kwargs.get("staff", False)
 
-        self.connected: list[Player] = []
+        # {player id: player}, in the order they joined
+        self.connected: dict[int, "Player"] = {}
 
     def __repr__(self) -> str:
         return (
@@ -29,7 +31,7 @@ class Channel:
             f'display="{self.name}", '
             f'name="{self._name}", '
             f'description="{self.description}", '
-            f"connected={self.connected[0:3]}..."
+            f"connected={[*self.connected.values()][0:3]}..."
             ")"
         )
 
@@ -41,22 +43,20 @@ class Channel:
     def is_dm(self) -> bool:
         return self._name[0] != "#"
 
-    def enqueue(self, data: bytes, ignore: list[int] = []) -> None:
-        for p in self.connected:
-            if p.id not in ignore:
-                p.enqueue(data)
+    def enqueue(self, data: bytes, ignore: Container[int] = ()) -> None:
+        broadcast.channel(self, data, ignore)
 
     async def update_info(self) -> None:
-        services.players.enqueue(await writer.ChanInfo(self._name))
+        services.players.enqueue(writer.ChanInfo(self._name))
 
     async def force_join(self, p: "Player") -> None:
         if self in p.channels:
             return
 
         p.channels.append(self)
-        self.connected.append(p)
+        self.connected[p.id] = p
 
-        p.enqueue(await writer.ChanJoin(self._name))
+        p.enqueue(writer.ChanJoin(self._name))
 
         await self.update_info()
 
@@ -65,9 +65,9 @@ class Channel:
             return
 
         p.channels.remove(self)
-        self.connected.remove(p)
+        self.connected.pop(p.id, None)
 
-        p.enqueue(await writer.ChanKick(self._name))
+        p.enqueue(writer.ChanKick(self._name))
 
         await self.update_info()
 
@@ -76,10 +76,10 @@ class Channel:
             if not (self in sender.channels or self.read_only):
                 return
 
-        ret = await writer.SendMessage(
+        ret = writer.SendMessage(
             sender=sender.username, message=message, channel=self.name, id=sender.id
         )
 
-        self.enqueue(ret, ignore=[sender.id])
+        self.enqueue(ret, ignore={sender.id})
 
         log.chat(f"<{sender.username}> {message} [{self._name}]")
@@ -1,30 +1,76 @@
-from typing import TYPE_CHECKING, Any, Union
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Union
 
+from objects import broadcast
 from objects import services
+from objects.beatmap import Beatmap
 from objects.channel import Channel
 from objects.match import Match
 from objects.player import Player
+from constants.beatmap import Approved
+from collections import OrderedDict
+from utils import log
+import asyncio
+import heapq
+import time
 
 
 class Tokens:
     def __init__(self):
-        self.players: list[Player] = []
+        self.by_id: dict[int, Player] = {}
+        self.by_token: dict[str, Player] = {}
+        self.by_name: dict[str, Player] = {}  # safe usernames
+
+        self._snapshot: Optional[tuple[Player, ...]] = ()
+
+    def __contains__(self, p: Player) -> bool:
+        return self.by_id.get(p.id) is p
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    @property
+    def players(self) -> tuple[Player, ...]:
+        # rebuilt only after someone logs in or out, and safe
+        # to iterate while others are logging in or out.
+        if self._snapshot is None:
+            self._snapshot = tuple(self.by_id.values())
+
+        return self._snapshot
 
     def add(self, p: Player) -> None:
-        self.players.append(p)
+        if old := self.by_id.get(p.id):
+            self.remove(old)
+
+        self.by_id[p.id] = p
+        self.by_token[p.token] = p
+        self.by_name[p.safe_name] = p
+
+        self._snapshot = None
 
     def remove(self, p: Player) -> None:
-        self.players.remove(p)
+        if self.by_id.get(p.id) is not p:
+            return
+
+        del self.by_id[p.id]
+        self.by_token.pop(p.token, None)
+        self.by_name.pop(p.safe_name, None)
+
+        self._snapshot = None
+
+    def get_by_id(self, id: int) -> Optional[Player]:
+        return self.by_id.get(id)
+
+    def get_by_token(self, token: str) -> Optional[Player]:
+        return self.by_token.get(token)
+
+    def get_by_name(self, name: str) -> Optional[Player]:
+        return self.by_name.get(name.lower().replace(" ", "_"))
 
     def get(self, value: Union[str, int]) -> Player:
-        for p in self.players:
-            if (
-                p.id == value
-                or p.username == value
-                or p.token == value
-                or p.safe_name == value
-            ):
-                return p
+        if isinstance(value, int):
+            return self.by_id.get(value)
+
+        return self.by_token.get(value) or self.get_by_name(value)
 
     async def get_offline(self, value: Union[str, int]) -> Player:
         if p := self.get(value):
@@ -48,38 +94,168 @@ class Tokens:
         return p
 
     def enqueue(self, packet: bytes) -> None:
-        for p in self.players:
-            p.enqueue(packet)
+        broadcast.everyone(packet)
 
 
 class Channels:
     def __init__(self):
-        self.channels: list[Channel] = []
+        self.by_name: dict[str, Channel] = {}  # raw names, fx. #multi_1
+        self.by_display: dict[str, Channel] = {}
+
+    @property
+    def channels(self) -> Iterable[Channel]:
+        return self.by_name.values()
 
     def add(self, data: dict[str, Any]) -> None:
-        self.channels.append(Channel(**data))
+        self.register(Channel(**data))
+
+    def register(self, c: Channel) -> None:
+        self.by_name[c._name] = c
+
+        # the first channel with a display name wins, like it used to
+        self.by_display.setdefault(c.name, c)
 
     def remove(self, c: Channel) -> None:
-        self.channels.remove(c)
+        if self.by_name.get(c._name) is c:
+            del self.by_name[c._name]
 
-    def get(self, name: str) -> Channel:
-        for chan in self.channels:
-            if chan._name == name or chan.name == name:
-                return chan
+        if self.by_display.get(c.name) is c:
+            del self.by_display[c.name]
+
+    def get(self, name: str) -> Optional[Channel]:
+        return self.by_name.get(name) or self.by_display.get(name)
 
 
 class Matches:
     def __init__(self):
-        self.matches: list["Match"] = []
+        self.matches: dict[int, "Match"] = {}
+
+        # ids of removed matches, handed out again lowest first
+        self.free_ids: list[int] = []
+        self.next_id: int = 0
+
+        # players browsing the multiplayer lobby
+        self.lobby: dict[int, Player] = {}
+
+    def allocate_id(self) -> int:
+        if self.free_ids:
+            return heapq.heappop(self.free_ids)
+
+        self.next_id += 1
+        return self.next_id - 1
 
     async def remove(self, m: "Match"):
-        if m in self.matches:
-            self.matches.remove(m)
+        if self.matches.get(m.match_id) is not m:
+            return
 
-    async def find(self, match_id: int) -> "Match":
-        for match in self.matches:
-            if match_id == match.match_id:
-                return match
+        await m.unload_pp()
+
+        del self.matches[m.match_id]
+        heapq.heappush(self.free_ids, m.match_id)
+
+    async def find(self, match_id: int) -> Optional["Match"]:
+        return self.matches.get(match_id)
 
     async def add(self, m: "Match"):
-        self.matches.append(m)
+        m.match_id = self.allocate_id()
+        self.matches[m.match_id] = m
+
+
+class Beatmaps:
+    """
+    Beatmaps by hash and map id, bounded and evicted least recently used.
+
+    Maps that weren't found are cached too, for a shorter time, and maps
+    that can still change status (pending, qualified...) expire sooner
+    than ranked/loved ones. Concurrent misses for the same map wait on
+    the first lookup, instead of all going to sql and the osu! api.
+    """
+
+    def __init__(self) -> None:
+        conf = services.config["server"].get("beatmaps", {})
+
+        self.max_entries: int = conf.get("cache", 10000)
+        self.ttl: float = conf.get("ttl", 24 * 60 * 60)
+        self.pending_ttl: float = conf.get("pending_ttl", 10 * 60)
+        self.missing_ttl: float = conf.get("missing_ttl", 5 * 60)
+
+        # hash or map id -> (expires at, beatmap or None)
+        self.cache: OrderedDict[Union[str, int], tuple[float, Optional[Beatmap]]] = (
+            OrderedDict()
+        )
+        self.lookups: dict[Union[str, int], asyncio.Future] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def expiry(self, b: Optional[Beatmap]) -> float:
+        if not b:
+            return time.time() + self.missing_ttl
+
+        if b.approved in (Approved.RANKED, Approved.APPROVED, Approved.LOVED):
+            return time.time() + self.ttl
+
+        return time.time() + self.pending_ttl
+
+    def _set(self, key: Union[str, int], entry: tuple[float, Optional[Beatmap]]):
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def add(self, key: Union[str, int], b: Optional[Beatmap]) -> None:
+        entry = (self.expiry(b), b)
+
+        if not b:
+            self._set(key, entry)
+            return
+
+        self._set(b.hash_md5, entry)
+        self._set(b.map_id, entry)
+
+    async def get(self, hash: str = "", beatmap_id: int = 0) -> Optional[Beatmap]:
+        key = hash or int(beatmap_id)
+
+        if (entry := self.cache.get(key)) and entry[0] > time.time():
+            self.cache.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+        if lookup := self.lookups.get(key):
+            self.coalesced += 1
+            return await asyncio.shield(lookup)
+
+        self.misses += 1
+
+        lookup = self.lookups[key] = asyncio.get_running_loop().create_future()
+
+        try:
+            b = await Beatmap.get_beatmap(hash, beatmap_id)
+        except asyncio.CancelledError:
+            lookup.cancel()
+            raise
+        except Exception as e:
+            log.fail(f"Failed to look up the beatmap {key}: {e}")
+            b = None
+        else:
+            self.add(key, b)
+        finally:
+            del self.lookups[key]
+
+        lookup.set_result(b)
+        return b
+
+    def invalidate(self, b: Beatmap, whole_set: bool = False) -> None:
+        for key in [
+            key
+            for key, (_, cached) in self.cache.items()
+            if cached
+            and (cached.set_id == b.set_id if whole_set else cached.map_id == b.map_id)
+        ]:
+            del self.cache[key]
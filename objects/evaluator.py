@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+from constants.playmode import Mode
+from constants.mods import Mods
+from objects import services
+from utils import general
+from utils import score
+import asyncio
+import oppai
+import time
+
+if TYPE_CHECKING:
+    from objects.match import Match
+    from objects.score import ScoreFrame
+
+executor = ThreadPoolExecutor(
+    max_workers=services.config["server"].get("pp", {}).get("workers", 2),
+    thread_name_prefix="pp",
+)
+
+
+class Evaluator:
+    """
+    Live pp of a multiplayer match.
+
+    The beatmap is parsed once when the match starts, and the context is
+    kept around with autocalc on, so later updates only recalculate pp.
+    Every slot is recalculated at most once per `interval` seconds; score
+    frames in between reuse the last value.
+    """
+
+    def __init__(self, path: str, mode: Mode, mods: Mods) -> None:
+        conf = services.config["server"].get("pp", {})
+
+        self.path: str = path
+        self.mode: Mode = mode
+        self.mods: Mods = mods
+        self.interval: float = conf.get("interval", 1.0)
+
+        self.ez = None
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+        # slot id -> (last calculated, pp)
+        self.last: dict[int, tuple[float, int]] = {}
+
+    @classmethod
+    async def load(cls, m: "Match") -> Optional["Evaluator"]:
+        if not (path := await services.beatmap_files.get(m.map_md5, m.map_id)):
+            return
+
+        self = cls(path, m.mode, m.mods)
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self._parse)
+
+        return self
+
+    def _parse(self) -> None:
+        self.ez = oppai.ezpp_new()
+        oppai.ezpp_set_autocalc(self.ez, 1)
+
+        if self.mods:
+            oppai.ezpp_set_mods(self.ez, self.mods)
+
+        oppai.ezpp(self.ez, self.path)
+
+    def _calculate(self, combo: int, nmiss: int, acc: float) -> int:
+        oppai.ezpp_set_combo(self.ez, combo)
+        oppai.ezpp_set_nmiss(self.ez, nmiss)
+        oppai.ezpp_set_accuracy_percent(self.ez, acc)
+
+        return int(oppai.ezpp_pp(self.ez))
+
+    async def calculate(self, slot_id: int, s: "ScoreFrame") -> int:
+        now = time.time()
+        calculated, pp = self.last.get(slot_id, (0.0, 0))
+
+        if now - calculated < self.interval:
+            return pp
+
+        # mark it before awaiting, so frames arriving
+        # in the meantime don't start another calculation.
+        self.last[slot_id] = (now, pp)
+
+        if not s.count_300:
+            self.last[slot_id] = (now, 0)
+            return 0
+
+        acc = general.rag_round(
+            score.calculate_accuracy(
+                self.mode,
+                s.count_300,
+                s.count_100,
+                s.count_50,
+                s.count_geki,
+                s.count_katu,
+                s.count_miss,
+            ),
+            2,
+        )
+
+        async with self.lock:
+            if not self.ez:
+                return pp
+
+            loop = asyncio.get_running_loop()
+            pp = await loop.run_in_executor(
+                executor, self._calculate, s.max_combo, s.count_miss, acc
+            )
+
+        self.last[slot_id] = (now, pp)
+        return pp
+
+    async def close(self) -> None:
+        async with self.lock:
+            if self.ez:
+                oppai.ezpp_free(self.ez)
+                self.ez = None
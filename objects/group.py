@@ -23,6 +23,6 @@ class Group(Channel):
         }
         c = cls(**kwargs)
         await owner.join_channel(c)
-        services.channels.channels.append(c)
+        services.channels.register(c)
         await c.update_info()
         return c
@@ -0,0 +1,144 @@
+from typing import TYPE_CHECKING, Any
+from collections import OrderedDict
+from objects import services
+import math
+
+if TYPE_CHECKING:
+    from objects.beatmap import Beatmap
+
+
+class Leaderboard:
+    def __init__(self, scores: str, count: int, personal: dict[int, str]) -> None:
+        # rendered score lines of the top scores
+        self.scores: str = scores
+        self.count: int = count
+
+        # score line of everyone in the top scores, by user id
+        self.personal: dict[int, str] = personal
+
+        # best score line of players outside the top who looked at it,
+        # "\n" if they don't have one.
+        self.others: dict[int, str] = {}
+
+
+class Leaderboards:
+    """
+    Beatmap leaderboards, as sent to the client, keyed by
+    (beatmap hash, mode, relax).
+
+    A leaderboard is fetched with a single query, which also returns the
+    requesting players best and the position of each score. The best of
+    players outside the top is kept with it once they looked it up.
+    Entries are dropped when someone sets a new best on the map.
+    """
+
+    def __init__(self) -> None:
+        conf = services.config["server"].get("leaderboards", {})
+
+        self.size: int = conf.get("size", 50)
+        self.max_entries: int = conf.get("cache", 4096)
+
+        self.cache: OrderedDict[tuple[str, int, bool], Leaderboard] = OrderedDict()
+
+        # bumped on every invalidation, so a leaderboard fetched
+        # while a new best came in isn't cached.
+        self.version: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    @staticmethod
+    def web_format(row: dict[str, Any], relax: bool) -> str:
+        return (
+            f"\n{row['id']}|{row['username']}|{row['score'] if not relax else math.ceil(row['pp'])}|"
+            f"{row['max_combo']}|{row['count_50']}|{row['count_100']}|{row['count_300']}|{row['count_miss']}|"
+            f"{row['count_katu']}|{row['count_geki']}|{row['perfect']}|{row['mods']}|{row['user_id']}|"
+            f"{row['position']}|{row['submitted']}|1"
+        )
+
+    async def fetch(
+        self, hash: str, mode: int, relax: bool, user_id: int, size: int
+    ) -> list[dict[str, Any]]:
+        order = ("score", "pp")[relax]
+
+        # the positions are numbered over the whole map, so the
+        # players best gets the right one, even outside the top.
+        return await services.sql.fetchall(
+            "SELECT * FROM (SELECT s.id, s.user_id, u.username, s.score, s.pp, "
+            "s.max_combo, s.count_50, s.count_100, s.count_300, s.count_miss, "
+            "s.count_katu, s.count_geki, s.perfect, s.mods, s.submitted, "
+            f"ROW_NUMBER() OVER (ORDER BY s.{order} DESC, s.submitted ASC) AS position "
+            "FROM scores s INNER JOIN users u ON u.id = s.user_id "
+            "WHERE s.hash_md5 = %s AND s.mode = %s AND s.relax = %s "
+            "AND s.status = 3 AND u.privileges & 4) ranked "
+            "WHERE position <= %s OR user_id = %s ORDER BY position",
+            (hash, mode, relax, size, user_id),
+            _dict=True,
+        )
+
+    async def get(
+        self, b: "Beatmap", mode: int, relax: bool, user_id: int
+    ) -> tuple[str, Leaderboard]:
+        key = (b.hash_md5, mode, relax)
+
+        if lb := self.cache.get(key):
+            self.cache.move_to_end(key)
+            self.hits += 1
+
+            if user_id in lb.personal:
+                return lb.personal[user_id], lb
+
+            if user_id in lb.others:
+                return lb.others[user_id], lb
+
+            # the player isn't in the top, so only look up their best.
+            rows = await self.fetch(b.hash_md5, mode, relax, user_id, 0)
+            personal = self.web_format(rows[0], relax) if rows else "\n"
+
+            self.remember(lb, user_id, personal)
+            return personal, lb
+
+        self.misses += 1
+        version = self.version
+
+        personal = "\n"
+        top = {}
+
+        for row in await self.fetch(b.hash_md5, mode, relax, user_id, self.size):
+            line = self.web_format(row, relax)
+
+            if row["user_id"] == user_id:
+                personal = line
+
+            if row["position"] <= self.size:
+                top[row["user_id"]] = line
+
+        lb = Leaderboard("".join(top.values()), len(top), top)
+
+        if user_id not in top:
+            self.remember(lb, user_id, personal)
+
+        if version == self.version:
+            self.cache[key] = lb
+
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+        return personal, lb
+
+    def remember(self, lb: Leaderboard, user_id: int, line: str) -> None:
+        if len(lb.others) >= self.size:
+            del lb.others[next(iter(lb.others))]
+
+        lb.others[user_id] = line
+
+    def invalidate(self, hash: str, mode: int, relax: bool) -> None:
+        self.cache.pop((hash, mode, relax), None)
+        self.version += 1
+
+    def clear(self) -> None:
+        self.cache.clear()
+        self.version += 1
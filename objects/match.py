@@ -1,10 +1,13 @@
 from constants.match import SlotStatus, SlotTeams, TeamType, ScoringType
 from objects.channel import Channel
+from objects.evaluator import Evaluator
 from constants.playmode import Mode
 from constants.mods import Mods
 from packets import writer
+from objects import broadcast
 from objects import services
-from typing import TYPE_CHECKING
+from utils import log
+from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
     from objects.player import Player
@@ -60,6 +63,7 @@ class Match:
 
         self.scoring_type: ScoringType = ScoringType.SCORE
         self.pp_win_condition: bool = False
+        self.pp: Optional[Evaluator] = None
         self.team_type: TeamType = TeamType.HEAD2HEAD
 
         self.seed: int = 0
@@ -102,27 +106,54 @@ class Match:
     async def transfer_host(self, slot) -> None:
         self.host = slot.p.id
 
-        slot.p.enqueue(await writer.MatchTransferHost())
+        slot.p.enqueue(writer.MatchTransferHost())
 
-        self.enqueue(await writer.Notification(f"{slot.p.username} became host!"))
+        self.enqueue(writer.Notification(f"{slot.p.username} became host!"))
 
         await self.enqueue_state()
 
     async def enqueue_state(
         self, immune: set[int] = set(), lobby: bool = False
     ) -> None:
-        for p in self.connected:
-            if p.id not in immune:
-                p.enqueue(await writer.MatchUpdate(self))
+        frame = writer.MatchUpdate(self)
+
+        broadcast.match(self, frame, ignore=immune)
 
         if lobby:
-            chan = services.channels.get("#lobby")
-            chan.enqueue(await writer.MatchUpdate(self))
+            broadcast.send(services.matches.lobby.values(), frame)
+
+    async def load_pp(self) -> None:
+        # the one of the last map, if it wasn't finished
+        await self.unload_pp()
+
+        if not (
+            self.mods & Mods.RELAX
+            or (self.pp_win_condition and self.scoring_type == ScoringType.SCORE)
+        ):
+            return
+
+        if not (pp := await Evaluator.load(self)):
+            log.fail(f"{self!r}: Couldn't find the osu beatmap.")
+
+            if host := services.players.get_by_id(self.host):
+                host.enqueue(
+                    writer.Notification(
+                        "Couldn't find the beatmap, there won't be live pp this match."
+                    )
+                )
+
+            return
+
+        self.pp = pp
+
+    async def unload_pp(self) -> None:
+        if self.pp:
+            await self.pp.close()
+            self.pp = None
 
     def enqueue(self, data, lobby: bool = False) -> None:
-        for p in self.connected:
-            p.enqueue(data)
+        broadcast.match(self, data, lobby=lobby)
 
-        if lobby:
-            chan = services.channels.get("#lobby")
-            chan.enqueue(data)
+    @property
+    def playing(self) -> list["Player"]:
+        return [slot.p for slot in self.slots if slot.status == SlotStatus.PLAYING]
@@ -7,19 +7,41 @@ from constants.playmode import Mode
 from typing import TYPE_CHECKING
 from constants.mods import Mods
 from objects.match import Match
+from objects.relay import Relay
 from typing import Optional
+from packets.queue import PacketQueue
 from packets import writer
+from objects import broadcast
 from objects import services
+from objects import rankings
 from utils import log
-from copy import copy
+import itertools
 import asyncio
-import aiohttp
 import time
 import uuid
 
 if TYPE_CHECKING:
     from objects.beatmap import Beatmap
     from objects.score import Score
+    from objects.topscores import TopScores
+
+# shared between all players, so a version
+# is never reused after someone relogs.
+versions = itertools.count(1)
+
+
+def stats_statement(mode: int, relax: int) -> str:
+    table = ("stats", "stats_rx")[relax]
+    se = ("std", "taiko", "catch", "mania")[mode]
+
+    # the counters are added on top, so nothing is lost
+    # if the row changed since we read it.
+    return (
+        f"UPDATE {table} SET playcount_{se} = playcount_{se} + %s, "
+        f"total_score_{se} = total_score_{se} + %s, "
+        f"ranked_score_{se} = ranked_score_{se} + %s, "
+        f"pp_{se} = %s, accuracy_{se} = %s, level_{se} = %s WHERE id = %s"
+    )
 
 
 class Player:
@@ -42,7 +64,8 @@ class Player:
         self.passhash: str = passhash
 
         self.country_code: str = country
-        self.country: str = country_code
+        # the number osu! shows the flag of, the database calls it cc
+        self.country: int = kwargs.get("cc", country_code)
 
         self.ip: str = kwargs.get("ip", "127.0.0.1")
         self.longitude: float = lon
@@ -69,6 +92,7 @@ class Player:
         self.channels: list[Channel] = []
         self.spectators: list[Player] = []
         self.spectating: Player = None
+        self.relay: Relay = None
         self.match: Match = None
 
         self.ranked_score: int = 0
@@ -79,11 +103,16 @@ class Player:
         self.rank: int = 0
         self.pp: int = 0
 
+        # (mode, relax) -> best scores, loaded on their first new best
+        self.top_scores: dict[tuple[Mode, bool], "TopScores"] = {}
+
         self.relax: int = 0  # 0 for vn / 1 for rx
 
         self.block_unknown_pms: bool = kwargs.get("block_nonfriend", False)
 
-        self.queue: bytes = bytearray()
+        # frames waiting for the client to poll them. the frames themselves
+        # are shared between players, the queue is per player
+        self.queue: PacketQueue = PacketQueue()
 
         self.login_time: float = time.time()
         self.last_update: float = 0.0
@@ -98,6 +127,18 @@ class Player:
         self.last_np: "Beatmap" = None
         self.last_score: "Score" = None
 
+        # encoded presence and stats packets, which only gets
+        # re-encoded when one of the fields they're made of changes.
+        self._presence: tuple[tuple, bytes] = ((), b"")
+        self._stats: tuple[tuple, bytes] = ((), b"")
+
+        self.presence_version: int = 0
+        self.stats_version: int = 0
+
+        # {player id: version} of the packets we've last been sent
+        self.known_presence: dict[int, int] = {}
+        self.known_stats: dict[int, int] = {}
+
     def __repr__(self) -> str:
         return (
             "Player("
@@ -122,17 +163,81 @@ class Player:
     def safe_username(self, name) -> str:
         return name.lower().replace(" ", "_")
 
+    @property
+    def presence_packet(self) -> bytes:
+        key = (
+            self.username,
+            self.timezone,
+            self.country,
+            self.privileges,
+            self.longitude,
+            self.latitude,
+            self.rank,
+        )
+
+        if key != self._presence[0]:
+            self._presence = (key, writer.encode_presence(self))
+            self.presence_version = next(versions)
+
+        return self._presence[1]
+
+    @property
+    def stats_packet(self) -> bytes:
+        key = (
+            self.status,
+            self.status_text,
+            self.beatmap_md5,
+            self.current_mods,
+            self.play_mode,
+            self.beatmap_id,
+            self.ranked_score,
+            self.accuracy,
+            self.playcount,
+            self.total_score,
+            self.rank,
+            self.pp,
+        )
+
+        if key != self._stats[0]:
+            self._stats = (key, writer.encode_stats(self))
+            self.stats_version = next(versions)
+
+        return self._stats[1]
+
+    def unseen_presence(self, p: "Player") -> bytes:
+        """`p`'s presence, or nothing if we already got the latest version of it."""
+        if not (packet := writer.UserPresence(p)):
+            return b""
+
+        if self.known_presence.get(p.id) == p.presence_version:
+            return b""
+
+        self.known_presence[p.id] = p.presence_version
+        return packet
+
+    def unseen_stats(self, p: "Player") -> bytes:
+        """`p`'s stats, or nothing if we already got the latest version of it."""
+        if not (packet := writer.UpdateStats(p)):
+            return b""
+
+        if self.known_stats.get(p.id) == p.stats_version:
+            return b""
+
+        self.known_stats[p.id] = p.stats_version
+        return packet
+
     def enqueue(self, packet: bytes) -> None:
-        self.queue += packet
+        if packet:
+            self.queue.push(packet)
+
+    def dequeue(self) -> bytes:
+        if self.spectating and (frames := self.spectating.relay.pull(self)):
+            return (self.queue.flush() or b"") + frames
 
-    def dequeue(self) -> None:
-        if self.queue:
-            ret = bytes(self.queue)
-            self.queue.clear()
-            return ret
+        return self.queue.flush()
 
     async def shout(self, text: str):
-        self.enqueue(await writer.Notification(text))
+        self.enqueue(writer.Notification(text))
 
     async def logout(self) -> None:
         if self.channels:
@@ -142,48 +247,53 @@ class Player:
         if self.match:
             await self.leave_match()
 
+        services.matches.lobby.pop(self.id, None)
+
         if self.spectating:
-            # leave spectating code and stuff idk
-            ...
+            await self.spectating.remove_spectator(self)
 
         services.players.remove(self)
 
-        for player in services.players.players:
-            if player != self:
-                player.enqueue(await writer.Logout(self.id))
+        broadcast.everyone(writer.Logout(self.id), ignore={self.id})
 
     async def add_spectator(self, p) -> None:
         # TODO: Create temp spec channel
-        joined = await writer.FellasJoinSpec(p.id)
+        if not self.relay:
+            self.relay = Relay(self)
+
+        broadcast.send(self.spectators, writer.FellasJoinSpec(p.id))
 
-        for s in self.spectators:
-            s.enqueue(joined)
-            p.enqueue(await writer.FellasJoinSpec(s.id))
+        p.enqueue(self.relay.add(p))
 
-        self.enqueue(await writer.UsrJoinSpec(p.id))
+        self.enqueue(writer.UsrJoinSpec(p.id))
         self.spectators.append(p)
 
         p.spectating = self
 
     async def remove_spectator(self, p) -> None:
         # TODO: Remove chan and part chan
-        left = await writer.FellasLeftSpec(p.id)
-
-        for s in self.spectators:
-            s.enqueue(left)
+        broadcast.send(self.spectators, writer.FellasLeftSpec(p.id))
 
-        self.enqueue(await writer.UsrLeftSpec(p.id))
+        self.enqueue(writer.UsrLeftSpec(p.id))
         self.spectators.remove(p)
+        self.relay.remove(p)
+
+        if not self.spectators:
+            self.relay = None
 
         p.spectating = None
 
     async def join_match(self, m: Match, pwd: Optional[str] = "") -> None:
-        if self.match or pwd != m.match_pass or not m in services.matches.matches:
-            self.enqueue(await writer.MatchFail())
+        if (
+            self.match
+            or pwd != m.match_pass
+            or services.matches.matches.get(m.match_id) is not m
+        ):
+            self.enqueue(writer.MatchFail())
             return  # user is already in a match
 
         if (free_slot := m.get_free_slot()) == -1:
-            self.enqueue(await writer.MatchFail())
+            self.enqueue(writer.MatchFail())
             log.warn(f"{self.username} tried to join a full match ({m!r})")
             return
 
@@ -212,7 +322,7 @@ class Player:
 
         self.match.connected.append(self)
 
-        self.enqueue(await writer.MatchJoin(self.match))  # join success
+        self.enqueue(writer.MatchJoin(self.match))  # join success
 
         log.info(f"{self.username} joined {m}")
         await self.match.enqueue_state(lobby=True)
@@ -223,7 +333,7 @@ class Player:
 
         await self.leave_channel(self.match.chat)
 
-        m = copy(self.match)
+        m = self.match
         self.match = None
 
         slot.reset()
@@ -237,7 +347,7 @@ class Player:
         if not m.connected:
             log.info(f"{m} is empty! Removing...")
 
-            m.enqueue(await writer.MatchDispose(m.match_id), lobby=True)
+            m.enqueue(writer.MatchDispose(m.match_id), lobby=True)
 
             await services.matches.remove(m)
             return
@@ -260,9 +370,9 @@ class Player:
             return
 
         self.channels.append(chan)
-        chan.connected.append(self)
+        chan.connected[self.id] = self
 
-        self.enqueue(await writer.ChanJoin(chan.name))
+        self.enqueue(writer.ChanJoin(chan.name))
 
         await chan.update_info()
 
@@ -271,16 +381,16 @@ class Player:
             return
 
         self.channels.remove(chan)
-        chan.connected.remove(self)
+        chan.connected.pop(self.id, None)
 
         if kicked:
-            self.enqueue(await writer.ChanKick(chan.name))
+            self.enqueue(writer.ChanKick(chan.name))
 
         await chan.update_info()
 
     async def send_message(self, message, reciever: "Player" = None):
         reciever.enqueue(
-            await writer.SendMessage(
+            writer.SendMessage(
                 sender=self.username,
                 message=message,
                 channel=reciever.username,
@@ -295,7 +405,7 @@ class Player:
             self.friends.add(player["id"])
 
     async def handle_friend(self, user: int) -> None:
-        if not (t := services.players.get(user)):
+        if not (t := services.players.get_by_id(user)):
             return  # user isn't online; ignore
 
         # remove friend
@@ -326,6 +436,8 @@ class Player:
             # is already restricted.
 
         self.privileges -= Privileges.VERIFIED
+        services.leaderboards.clear()
+        asyncio.create_task(rankings.remove_player(self.id))
 
         asyncio.create_task(
             services.db.execute(
@@ -338,31 +450,31 @@ class Player:
 
         log.info(f"{self.username} has been put in restricted mode!")
 
-    async def update_stats(self, mode: Mode = Mode.NONE, relax: int = -1) -> None:
+    def update_stats(
+        self,
+        mode: Mode = Mode.NONE,
+        relax: int = -1,
+        playcount: int = 0,
+        total_score: int = 0,
+        ranked_score: int = 0,
+    ) -> None:
+        """
+        Saves how much the counters went up by, and the current
+        pp/accuracy/level, with the next write behind flush.
+        """
         if (m := mode) == Mode.NONE:
             m = self.play_mode
 
         if (rx := relax) == -1:
             rx = self.relax
 
-        spec_tables = ("stats", "stats_rx")[rx]
-        se = ("std", "taiko", "catch", "mania")[m]
-
         self.get_level()
 
-        await services.sql.execute(
-            f"UPDATE {spec_tables} SET pp_{se} = %s, playcount_{se} = %s, "
-            f"accuracy_{se} = %s, total_score_{se} = %s, "
-            f"ranked_score_{se} = %s, level_{se} = %s WHERE id = %s",
-            (
-                self.pp,
-                self.playcount,
-                round(self.accuracy, 2),
-                self.total_score,
-                self.ranked_score,
-                self.level,
-                self.id,
-            ),
+        services.write_behind.add(
+            stats_statement(m.value, int(rx)),
+            (self.id,),
+            (playcount, total_score, ranked_score),
+            (self.pp, round(self.accuracy, 2), self.level),
         )
 
     def get_level(self):
@@ -370,52 +482,30 @@ class Player:
             if req_score < self.total_score < levels[idx + 1]:
                 self.level = idx + 1
 
-    # used for background tasks
-    async def check_loc(self):
-        lon, lat, cc, c = await self.set_location(get=True)
-
-        if lon != self.longitude:
-            self.longitude = lon
-
-        if lat != self.latitude:
-            self.latitude = lat
-
-        if c != self.country_code:
-            self.country_code = c
+    def set_location(self) -> bool:
+        """Look up where the player is, returns whether it changed."""
+        if not (ret := services.geoip.lookup(self.ip)):
+            return False
 
-        if cc != self.country:
-            self.country = cc
+        lat, lon, cc = ret
 
-        await self.save_location()
+        if cc not in country_codes:
+            return False
 
-    async def set_location(self, get: bool = False):
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(
-                f"http://ip-api.com/json/{self.ip}?fields=status,message,countryCode,region,lat,lon"
-            ) as resp:
-                if not (ret := await resp.json()):
-                    return  # sus
-
-                if ret["status"] == "fail":
-                    log.fail(
-                        f"Unable to get {self.username}'s location. Response: {ret['message']}"
-                    )
-                    return
-
-                if not get:
-                    self.latitude = ret["lat"]
-                    self.longitude = ret["lon"]
-                    self.country = country_codes[ret["countryCode"]]
-                    self.country_code = ret["countryCode"]
+        # the database keeps them with less precision
+        if (
+            cc == self.country_code
+            and abs(lat - self.latitude) < 1e-3
+            and abs(lon - self.longitude) < 1e-3
+        ):
+            return False
 
-                    return
+        self.latitude = lat
+        self.longitude = lon
+        self.country = country_codes[cc]
+        self.country_code = cc
 
-                return (
-                    ret["lat"],
-                    ret["lon"],
-                    country_codes[ret["countryCode"]],
-                    ret["countryCode"],
-                )
+        return True
 
     async def save_location(self):
         await services.sql.execute(
@@ -436,6 +526,17 @@ class Player:
             (self.id),
         )
 
+        # whatever didn't get written yet
+        if ret and (
+            pending := services.write_behind.get(
+                stats_statement(mode, relax), (self.id,)
+            )
+        ):
+            ret["playcount"] += pending[0]
+            ret["total_score"] += pending[1]
+            ret["ranked_score"] += pending[2]
+            ret["pp"], ret["accuracy"], ret["level"] = pending[3:]
+
         ret["rank"] = await self.get_rank(relax, mode)
 
         return ret
@@ -447,15 +548,13 @@ class Player:
         )
         return _rank + 1 if _rank is not None else 0
 
-    async def update_rank(self, relax: int = 0, mode: Mode = Mode.OSU) -> int:
+    def update_rank(self, relax: int = 0, mode: Mode = Mode.OSU) -> None:
+        """Moves the player on the global leaderboard, in the background."""
         if not self.is_restricted:
-            await services.redis.zadd(
-                f"ragnarok:{'leaderboard' if not relax else 'leaderboard_rx'}:{mode}",
-                {str(self.id): self.pp},
+            services.jobs.put(
+                "rank", self.id, mode.value, int(relax), self.pp, key=f"rank:{self.id}"
             )
 
-        return await self.get_rank(relax, mode)
-
     async def update_stats_cache(self) -> bool:
         ret = await self.get_stats(self.relax, self.play_mode)
 
@@ -468,3 +567,19 @@ class Player:
         self.pp = math.ceil(ret["pp"])
 
         return True
+
+
+@services.jobs.register("rank")
+async def save_rank(user_id: int, mode: int, relax: int, pp: int) -> None:
+    await services.redis.zadd(
+        f"ragnarok:{'leaderboard' if not relax else 'leaderboard_rx'}:{mode}",
+        {str(user_id): pp},
+    )
+
+    # the client asks for its stats again after submitting,
+    # but this might not have been done by then.
+    p = services.players.get_by_id(user_id)
+
+    if p and p.play_mode.value == mode and int(p.relax) == relax:
+        p.rank = await p.get_rank(relax, p.play_mode)
+        p.enqueue(writer.UpdateStats(p))
@@ -0,0 +1,152 @@
+from typing import Any, TYPE_CHECKING
+from objects import services
+from utils import log
+import time
+
+if TYPE_CHECKING:
+    from objects.score import Score
+
+# Every (beatmap, mode, relax) leaderboard is mirrored in a sorted set,
+# holding the best score of every unrestricted player, valued by score
+# (or pp on relax). Scores that are equal are ordered by their member,
+# which starts with the inverted submit time, so the earlier score wins.
+
+PREFIX = "ragnarok:scores"
+
+_select = (
+    "SELECT s.hash_md5, s.mode, s.relax, s.user_id, s.score, s.pp, s.submitted "
+    "FROM scores s INNER JOIN users u ON u.id = s.user_id "
+    "WHERE s.status = 3 AND u.privileges & 4"
+)
+
+
+def key(hash: str, mode: int, relax: bool) -> str:
+    return f"{PREFIX}:{hash}:{int(mode)}:{int(relax)}"
+
+
+def member(user_id: int, submitted: int) -> str:
+    return f"{0xFFFFFFFF - int(submitted):010d}:{user_id}"
+
+
+def value(score: int, pp: float, relax: bool) -> float:
+    return pp if relax else score
+
+
+def _key_of(s: "Score") -> str:
+    return key(s.map.hash_md5, s.mode, s.relax)
+
+
+def _add_row(pipe, row: dict[str, Any]) -> None:
+    pipe.zadd(
+        key(row["hash_md5"], row["mode"], row["relax"]),
+        {
+            member(row["user_id"], row["submitted"]): value(
+                row["score"], row["pp"], row["relax"]
+            )
+        },
+    )
+
+
+async def _ensure(s: "Score") -> str:
+    k = _key_of(s)
+
+    # maps nobody looked at since the last rebuild
+    # are filled from the database the first time.
+    if not await services.redis.exists(k):
+        async with services.redis.pipeline(transaction=False) as pipe:
+            async for row in services.sql.iterall(
+                _select + " AND s.hash_md5 = %s AND s.mode = %s AND s.relax = %s",
+                (s.map.hash_md5, s.mode.value, s.relax),
+            ):
+                _add_row(pipe, row)
+
+            await pipe.execute()
+
+    return k
+
+
+async def position(s: "Score") -> int:
+    k = await _ensure(s)
+
+    mine = member(s.player.id, s.submitted)
+    rank = await services.redis.zrevrank(k, mine)
+
+    if rank is not None:
+        return rank + 1
+
+    # not on the leaderboard (yet), so count everything above it; of the
+    # scores with the same value, the ones with a bigger member, which
+    # were submitted earlier, like the sql leaderboard does.
+    v = value(s.score, s.pp, s.relax)
+
+    async with services.redis.pipeline(transaction=False) as pipe:
+        pipe.zcount(k, f"({v}", "+inf")
+        pipe.zrangebyscore(k, v, v)
+        above, ties = await pipe.execute()
+
+    return above + sum(m > mine.encode() for m in ties) + 1
+
+
+async def add(s: "Score") -> None:
+    if s.player.is_restricted:
+        return
+
+    k = await _ensure(s)
+
+    async with services.redis.pipeline(transaction=False) as pipe:
+        if s.pb:
+            pipe.zrem(k, member(s.player.id, s.pb.submitted))
+
+        pipe.zadd(
+            k, {member(s.player.id, s.submitted): value(s.score, s.pp, s.relax)}
+        )
+        await pipe.execute()
+
+
+async def remove_player(user_id: int) -> None:
+    async with services.redis.pipeline(transaction=False) as pipe:
+        async for row in services.sql.iterall(
+            "SELECT hash_md5, mode, relax, submitted FROM scores "
+            "WHERE user_id = %s AND status = 3",
+            (user_id),
+        ):
+            pipe.zrem(
+                key(row["hash_md5"], row["mode"], row["relax"]),
+                member(user_id, row["submitted"]),
+            )
+
+        await pipe.execute()
+
+
+async def add_player(user_id: int) -> None:
+    async with services.redis.pipeline(transaction=False) as pipe:
+        async for row in services.sql.iterall(_select + " AND s.user_id = %s", (user_id)):
+            _add_row(pipe, row)
+
+        await pipe.execute()
+
+
+async def rebuild(batch: int = 5000) -> int:
+    start = time.time()
+
+    async for k in services.redis.scan_iter(match=f"{PREFIX}:*", count=batch):
+        await services.redis.unlink(k)
+
+    count = 0
+
+    async with services.redis.pipeline(transaction=False) as pipe:
+        async for row in services.sql.iterall(_select):
+            _add_row(pipe, row)
+            count += 1
+
+            if not count % batch:
+                await pipe.execute()
+
+        await pipe.execute()
+
+    log.info(
+        f"Rebuilt the score rankings with {count} scores "
+        f"in {time.time() - start:.2f}s"
+    )
+
+    return count
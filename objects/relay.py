@@ -0,0 +1,91 @@
+from constants.packets import BanchoPackets
+from typing import TYPE_CHECKING
+from collections import deque
+from objects import services
+from packets import writer
+import itertools
+import struct
+import time
+
+if TYPE_CHECKING:
+    from objects.player import Player
+
+_header = struct.Struct("<HxI")
+
+
+class Relay:
+    """
+    Spectator frames of a single host.
+
+    Frame bundles go into a ring buffer, and every spectator keeps a
+    cursor into it. When a spectator polls, it gets everything after
+    its cursor as one slice, and if it fell so far behind that the buffer
+    wrapped around, it just skips ahead to the oldest frame still kept.
+    """
+
+    def __init__(self, host: "Player") -> None:
+        conf = services.config["server"].get("spectator", {})
+
+        self.host: "Player" = host
+        self.frames: deque[bytes] = deque(maxlen=conf.get("buffer", 64))
+
+        # sequence number of the next frame
+        self.head: int = 0
+        self.cursors: dict[int, int] = {}
+
+        # FellasJoinSpec of every spectator, so new ones
+        # don't make us encode it for everyone again.
+        self.joined: dict[int, bytes] = {}
+
+        self.skipped: int = 0
+        self.rate: float = 0.0
+        self._window_start: float = time.time()
+        self._window_frames: int = 0
+
+    def __len__(self) -> int:
+        return len(self.cursors)
+
+    @property
+    def tail(self) -> int:
+        return self.head - len(self.frames)
+
+    def add(self, p: "Player") -> bytes:
+        self.cursors[p.id] = self.head
+
+        ret = b"".join(self.joined.values())
+        self.joined[p.id] = writer.FellasJoinSpec(p.id)
+
+        return ret
+
+    def remove(self, p: "Player") -> None:
+        self.cursors.pop(p.id, None)
+        self.joined.pop(p.id, None)
+
+    def push(self, sframe: bytes) -> None:
+        self.frames.append(
+            _header.pack(BanchoPackets.CHO_SPECTATE_FRAMES, len(sframe)) + sframe
+        )
+        self.head += 1
+
+        self._window_frames += 1
+        if (elapsed := time.time() - self._window_start) >= 1:
+            self.rate = self._window_frames / elapsed
+            self._window_start += elapsed
+            self._window_frames = 0
+
+    def pull(self, p: "Player") -> bytes:
+        cursor = self.cursors.get(p.id)
+
+        if cursor is None or cursor == self.head:
+            return b""
+
+        if cursor < (tail := self.tail):
+            self.skipped += tail - cursor
+            cursor = tail
+
+        self.cursors[p.id] = self.head
+
+        return b"".join(itertools.islice(self.frames, cursor - tail, None))
+
+    def lag(self, p: "Player") -> int:
+        return self.head - self.cursors.get(p.id, self.head)
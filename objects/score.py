@@ -10,6 +10,7 @@ from constants.mods import Mods
 from base64 import b64decode
 from enum import IntEnum
 from objects import services
+from objects import rankings
 from utils import score
 import oppai as pp
 import math
@@ -114,7 +115,7 @@ class Score:
         s.id = data["id"]
 
         s.player = await services.players.get_offline(data["user_id"])  # type: ignore
-        s.map = await Beatmap.get_beatmap(data["hash_md5"])
+        s.map = await services.beatmaps.get(data["hash_md5"])
 
         s.score = data["score"]
         s.pp = data["pp"]
@@ -163,15 +164,12 @@ class Score:
 
         s = cls()
 
-        if not (player := services.players.get(data[1].rstrip())):
+        if not (player := services.players.get_by_name(data[1].rstrip())):
             return
 
         s.player = player
 
-        if data[0] in services.beatmaps:
-            s.map = services.beatmaps[data[0]]
-        else:
-            s.map = await Beatmap.get_beatmap(data[0])
+        s.map = await services.beatmaps.get(data[0])
 
         (
             s.count_300,
@@ -209,13 +207,13 @@ class Score:
         s.relax = bool(int(data[13]) & Mods.RELAX)
 
         if passed:
-            await s.calculate_position()
-
             if s.map.approved not in (
                 Approved.LOVED,
                 Approved.PENDING,
                 Approved.WIP,
                 Approved.GRAVEYARD,
+            ) and (
+                path := await services.beatmap_files.get(s.map.hash_md5, s.map.map_id)
             ):
                 ez = pp.ezpp_new()
 
@@ -226,11 +224,14 @@ class Score:
                 pp.ezpp_set_nmiss(ez, s.count_miss)
                 pp.ezpp_set_accuracy_percent(ez, s.accuracy)
 
-                pp.ezpp(ez, f".data/beatmaps/{s.map.file}")
+                pp.ezpp(ez, path)
                 s.pp = pp.ezpp_pp(ez)
 
                 pp.ezpp_free(ez)
 
+            # relax is ranked by pp, so it has to be known first
+            await s.calculate_position()
+
             # find our previous best score on the map
             if prev_best := await services.sql.fetch(
                 "SELECT id FROM scores WHERE user_id = %s "
@@ -285,18 +286,7 @@ class Score:
         return s
 
     async def calculate_position(self) -> None:
-        ret = await services.sql.fetch(
-            "SELECT COUNT(*) AS rank FROM scores s "
-            "INNER JOIN beatmaps b ON b.hash = s.hash_md5 "
-            "INNER JOIN users u ON u.id = s.user_id "
-            "WHERE s.score > %s AND s.relax = %s "
-            "AND b.hash = %s AND u.privileges & 4 "
-            "AND s.status = 3 AND s.mode = %s "
-            "ORDER BY s.score DESC, s.submitted DESC",
-            (self.score, self.relax, self.map.hash_md5, self.mode.value),
-        )
-
-        self.position = ret["rank"] + 1
+        self.position = await rankings.position(self)
 
     async def save_to_db(self) -> int:
         return await services.sql.execute(
@@ -1,13 +1,21 @@
-from typing import Any, Callable, Pattern, TYPE_CHECKING
+from typing import Any, Callable, Optional, Pattern, TYPE_CHECKING
+from constants.packets import BanchoPackets
 from lenhttp import Router, LenHTTP
 from lib.database import Database
+from lib.http import HTTPClient
+from lib.geoip import GeoIP
+from lib.querystats import QueryStats
+from lib.jobs import JobQueue
+from lib.writebehind import WriteBehind
+from lib.replaystore import ReplayStore
 from config import conf
 import aioredis
 import re
 
 if TYPE_CHECKING:
-    from objects.collections import Tokens, Channels, Matches
-    from objects.beatmap import Beatmap
+    from objects.collections import Tokens, Channels, Matches, Beatmaps
+    from objects.beatmapfiles import BeatmapFiles
+    from objects.leaderboard import Leaderboards
     from objects.player import Player
     from packets.reader import Packet
 
@@ -22,7 +30,8 @@ bancho: Router
 avatar: Router
 osu: Router
 
-packets: dict[int, "Packet"] = {}
+# indexed by packet id; None for packets we don't handle
+packets: list[Optional["Packet"]] = [None] * (max(BanchoPackets) + 1)
 tasks: list[dict[str, Callable]] = []
 
 bot: "Player"
@@ -32,7 +41,15 @@ prefix: str = "!"
 config: dict[str, dict[str, Any]] = conf
 
 sql: Database
+http: HTTPClient
+geoip: GeoIP
 redis: aioredis.Redis
+query_stats: QueryStats
+write_behind: WriteBehind
+replays: ReplayStore
+
+# handlers are registered on import, so it has to exist before that
+jobs: JobQueue = JobQueue()
 
 bcrypt_cache: dict[str, bytes] = {}
 
@@ -53,10 +70,12 @@ Simon & Aoba
 players: "Tokens"
 channels: "Channels"
 matches: "Matches"
+leaderboards: "Leaderboards"
 
 osu_key: str = config["api_conf"]["osu_api_key"]
 
-beatmaps: dict[str, "Beatmap"] = {}
+beatmaps: "Beatmaps"
+beatmap_files: "BeatmapFiles"
 
 regex: dict[str, Pattern[str]] = {
     "np": re.compile(
@@ -0,0 +1,122 @@
+from constants.playmode import Mode
+from objects import services
+import numpy as np
+import bisect
+
+
+class TopScores:
+    """
+    Best scores of a player in one mode, so a new best only updates
+    their pp and accuracy instead of reading all their scores again.
+
+    Only the top `size` pp values are kept, sorted; everything below that
+    is weighted with 0.95^size or less. Accuracy is kept as a sum over
+    all bests, which is also what the bonus pp counts.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size: int = size
+        self.weights: np.ndarray = 0.95 ** np.arange(size + 1)
+
+        # negated, so bisect keeps them in descending pp order.
+        self.pps: list[float] = []
+        self.weighted: float = 0.0
+
+        self.accuracy_sum: float = 0.0
+        self.count: int = 0
+
+    @classmethod
+    async def load(cls, user_id: int, mode: Mode, relax: bool) -> "TopScores":
+        self = cls(services.config["server"].get("top_scores", 200))
+
+        rows = await services.sql.fetchall(
+            "SELECT pp, accuracy FROM scores "
+            "WHERE user_id = %s AND mode = %s "
+            "AND status = 3 AND relax = %s ORDER BY pp DESC",
+            (user_id, mode.value, relax),
+        )
+
+        if not rows:
+            return self
+
+        data = np.array(rows, dtype=np.float64)
+        top = data[: self.size, 0]
+
+        self.pps = (-top).tolist()
+        self.weighted = float(np.dot(top, self.weights[: len(top)]))
+
+        self.accuracy_sum = float(data[:, 1].sum())
+        self.count = len(data)
+
+        return self
+
+    @staticmethod
+    def calculate(pps: np.ndarray, accuracies: np.ndarray) -> tuple[float, float]:
+        """Total pp and accuracy of a players bests, `pps` sorted descending."""
+        if not len(pps):
+            return 0.0, 0.0
+
+        weighted = float(np.dot(pps, 0.95 ** np.arange(len(pps))))
+        weighted += 416.6667 * (1 - 0.9994 ** len(pps))
+
+        return weighted, float(accuracies.mean())
+
+    @property
+    def pp(self) -> float:
+        return self.weighted + 416.6667 * (1 - 0.9994**self.count)
+
+    @property
+    def accuracy(self) -> float:
+        return self.accuracy_sum / self.count if self.count else 0.0
+
+    def _below(self, idx: int) -> float:
+        # weighted pp of everything from idx and down
+        return float(
+            np.dot(np.negative(self.pps[idx:]), self.weights[idx : len(self.pps)])
+        )
+
+    def add(self, pp: float, accuracy: float) -> None:
+        self.accuracy_sum += accuracy
+        self.count += 1
+
+        idx = bisect.bisect_left(self.pps, -pp)
+
+        if idx >= self.size:
+            return
+
+        # everything below moves down a place, so their weight goes down by 0.95
+        below = self._below(idx)
+        self.weighted += pp * self.weights[idx] - below * 0.05
+
+        self.pps.insert(idx, -pp)
+
+        if len(self.pps) > self.size:
+            self.weighted += self.pps.pop() * self.weights[self.size]
+
+    def remove(self, pp: float, accuracy: float) -> None:
+        self.accuracy_sum -= accuracy
+        self.count -= 1
+
+        # the database might have stored it with less precision
+        idx = bisect.bisect_left(self.pps, -pp - 0.01)
+
+        if idx >= len(self.pps) or abs(self.pps[idx] + pp) > 0.01:
+            return  # not in the top
+
+        pp = -self.pps.pop(idx)
+
+        # and everything below moves up a place
+        below = self._below(idx)
+        self.weighted += below * 0.05 - pp * self.weights[idx]
+
+    def replace(self, old: tuple[float, float], new: tuple[float, float]) -> None:
+        self.remove(*old)
+        self.add(*new)
+
+    async def verify(self, user_id: int, mode: Mode, relax: bool) -> float:
+        """Recalculate from the database, and return how far off we were."""
+        fresh = await TopScores.load(user_id, mode, relax)
+        drift = self.pp - fresh.pp
+
+        self.__dict__.update(fresh.__dict__)
+        return drift
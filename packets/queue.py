@@ -0,0 +1,169 @@
+from constants.packets import BanchoPackets
+from typing import Optional
+from enum import IntEnum
+from objects import services
+import struct
+
+_id = struct.Struct("<i")
+
+
+class Policy(IntEnum):
+    KEEP = 0  # never dropped
+    COALESCE = 1  # only the latest one per user is kept
+    SHED = 2  # the first thing to go, once the queue is full
+
+
+policies: dict[int, Policy] = {
+    BanchoPackets.CHO_USER_STATS: Policy.COALESCE,
+    BanchoPackets.CHO_USER_PRESENCE: Policy.COALESCE,
+    BanchoPackets.CHO_SPECTATE_FRAMES: Policy.SHED,
+    BanchoPackets.CHO_MATCH_SCORE_UPDATE: Policy.SHED,
+}
+
+
+class PacketQueue:
+    """
+    Outgoing frames of a player, capped by bytes and frames. A frame is
+    whatever was handed to `push` in one go, a single packet most of the
+    time, but fx. login data is several packets in one frame, so `count`
+    and `max_packets` count frames, not packets.
+
+    Stats and presence updates are coalesced, so only the latest one per
+    user is sent, and spectator frames/score updates are shed first when
+    a client stops polling. Anything else is kept past the limits, but
+    counted as an overflow, so we can see who is lagging behind. Once that
+    reaches the hard limits the queue gives up: it's emptied, marked as
+    stalled and takes nothing anymore, and the player has to log in again.
+    """
+
+    def __init__(self) -> None:
+        conf = services.config["server"].get("queue", {})
+
+        self.max_bytes: int = conf.get("max_bytes", 1 << 20)
+        self.max_packets: int = conf.get("max_packets", 4096)
+
+        # only frames that are never dropped can get past the limits above
+        self.hard_bytes: int = conf.get("hard_bytes", self.max_bytes * 4)
+        self.hard_packets: int = conf.get("hard_packets", self.max_packets * 4)
+
+        # dropped/coalesced frames are left as None
+        self.frames: list[Optional[bytes]] = []
+        self.latest: dict[tuple[int, int], int] = {}
+
+        self.size: int = 0
+        self.count: int = 0
+
+        self.high_water: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.overflows: int = 0
+        self.stalled: bool = False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _discard(self, idx: int) -> None:
+        frame = self.frames[idx]
+        self.frames[idx] = None
+
+        self.size -= len(frame)
+        self.count -= 1
+
+    def _full(self, length: int) -> bool:
+        return self.size + length > self.max_bytes or self.count >= self.max_packets
+
+    def _shed(self, length: int) -> None:
+        for idx, frame in enumerate(self.frames):
+            if not self._full(length):
+                return
+
+            if frame and policies.get(frame[0] | frame[1] << 8) == Policy.SHED:
+                self._discard(idx)
+                self.dropped += 1
+
+    def _stall(self) -> None:
+        self.dropped += self.count + 1
+        self.stalled = True
+
+        self.frames.clear()
+        self.latest.clear()
+
+        self.size = 0
+        self.count = 0
+
+    def _overflow(self, length: int, policy: Optional[Policy]) -> bool:
+        """Makes room for a frame if it can, returns whether it's kept."""
+        self._shed(length)
+
+        if not self._full(length):
+            return True
+
+        if policy is Policy.SHED:
+            self.dropped += 1
+            return False
+
+        if self.size + length > self.hard_bytes or self.count >= self.hard_packets:
+            self._stall()
+            return False
+
+        self.overflows += 1
+        return True
+
+    def push(self, frame: bytes) -> None:
+        # this runs once per recipient of every broadcast, so the usual
+        # case (a frame that is kept, with room left) is kept short.
+        if self.stalled:
+            self.dropped += 1
+            return
+
+        packet = frame[0] | frame[1] << 8
+        policy = policies.get(packet)
+
+        if policy is Policy.COALESCE:
+            key = (packet, _id.unpack_from(frame, 7)[0])
+
+            if (idx := self.latest.get(key)) is not None:
+                self._discard(idx)
+                self.coalesced += 1
+
+            self.latest[key] = len(self.frames)
+
+        size = self.size + len(frame)
+
+        if size > self.max_bytes or self.count >= self.max_packets:
+            if not self._overflow(len(frame), policy):
+                return
+
+            size = self.size + len(frame)
+
+        self.frames.append(frame)
+
+        self.size = size
+        self.count += 1
+
+        if size > self.high_water:
+            self.high_water = size
+
+    def flush(self) -> Optional[bytes]:
+        if not self.count:
+            return
+
+        ret = b"".join(filter(None, self.frames))
+
+        self.frames.clear()
+        self.latest.clear()
+
+        self.size = 0
+        self.count = 0
+
+        return ret
+
+
+class NullQueue(PacketQueue):
+    """For players that never poll, fx. the bot."""
+
+    def push(self, frame: bytes) -> None:
+        self.dropped += 1
+
+    def flush(self) -> None:
+        return
@@ -1,4 +1,4 @@
-from typing import AnyStr, Callable, Iterator
+from typing import Callable, Iterator
 from constants.packets import BanchoPackets
 from objects.score import ScoreFrame
 from constants.playmode import Mode
@@ -21,9 +21,49 @@ class Packet:
     restricted: bool
 
 
+HEADER = struct.Struct("<HxI")
+
+_int8 = struct.Struct("<b")
+_uint8 = struct.Struct("<B")
+_int16 = struct.Struct("<h")
+_uint16 = struct.Struct("<H")
+_int32 = struct.Struct("<i")
+_uint32 = struct.Struct("<I")
+_int64 = struct.Struct("<q")
+_uint64 = struct.Struct("<Q")
+_float32 = struct.Struct("<f")
+_float64 = struct.Struct("<d")
+
+
+def decode(body: memoryview) -> list[tuple[int, memoryview]]:
+    """
+    Splits a whole request body into (packet id, payload) records in a
+    single pass. A truncated packet at the end of the body is dropped.
+    """
+    records = []
+    offset, end = 0, len(body)
+
+    while offset + HEADER.size <= end:
+        packet, plen = HEADER.unpack_from(body, offset)
+        offset += HEADER.size
+
+        if offset + plen > end:
+            break
+
+        records.append((packet, body[offset : offset + plen]))
+        offset += plen
+
+    return records
+
+
 class Reader:
     def __init__(self, packet_data: bytes):
         self.packet_data = memoryview(packet_data)
+        self.records = decode(self.packet_data)
+        self.index = 0
+
+        # payload of the current packet; every read is relative to that
+        self.data = self.packet_data[:0]
         self.offset = 0
         self.packet, self.plen = None, 0
 
@@ -31,115 +71,109 @@ class Reader:
         return self
 
     def __next__(self) -> Packet:
-        while self.data:
-            self.packet, self.plen = self.read_headers()
-
-            if self.packet not in services.packets and (not self.packet > 109):
-                if services.debug and self.packet not in IGNORED_PACKETS:
-                    log.warn(
-                        f"Packet <{BanchoPackets(self.packet)} | {BanchoPackets(self.packet).name}> has been requested although it's an unregistered packet."
-                    )
-
-                if self.plen != 0:
-                    self.offset += self.plen
-            else:
-                break
-        else:
-            raise StopIteration
+        handlers = services.packets
 
-        self.packet = BanchoPackets(self.packet)
+        while self.index < len(self.records):
+            self.packet, self.data = self.records[self.index]
+            self.index += 1
 
-        return services.packets[self.packet.value]
+            self.offset = 0
+            self.plen = len(self.data)
 
-    def read_headers(self) -> tuple[BanchoPackets, int]:
-        if len(self.data) < 7:
-            raise StopIteration
+            if self.packet < len(handlers) and (handler := handlers[self.packet]):
+                return handler
 
-        ret = struct.unpack("<HxI", self.data[:7])
-        self.offset += 7
-        return ret[0], ret[1]
+            if services.debug and self.packet not in IGNORED_PACKETS:
+                log.warn(
+                    f"Packet <{self.packet}> has been requested although it's an unregistered packet."
+                )
 
-    @property
-    def data(self):
-        return self.packet_data[self.offset :]
+        raise StopIteration
 
     def read_byte(self) -> int:
-        ret = struct.unpack("<b", self.data[:1])
+        ret = _int8.unpack_from(self.data, self.offset)[0]
         self.offset += 1
-        return ret[0]
+        return ret
 
     def read_ubyte(self) -> int:
-        ret = struct.unpack("<B", self.data[:1])
+        ret = _uint8.unpack_from(self.data, self.offset)[0]
         self.offset += 1
-        return ret[0]
+        return ret
 
     def read_int8(self) -> int:
-        ret = int.from_bytes(self.data[:1], "little", signed=True)
+        ret = _int8.unpack_from(self.data, self.offset)[0]
         self.offset += 1
-        return ret - 256 if ret > 127 else ret
+        return ret
 
     def read_uint8(self) -> int:
-        ret = int.from_bytes(self.data[:1], "little", signed=False)
+        ret = _uint8.unpack_from(self.data, self.offset)[0]
         self.offset += 1
         return ret
 
     def read_int16(self) -> int:
-        ret = int.from_bytes(self.data[:2], "little", signed=True)
+        ret = _int16.unpack_from(self.data, self.offset)[0]
         self.offset += 2
         return ret
 
     def read_uint16(self) -> int:
-        ret = int.from_bytes(self.data[:2], "little", signed=False)
+        ret = _uint16.unpack_from(self.data, self.offset)[0]
         self.offset += 2
         return ret
 
     def read_int32(self) -> int:
-        ret = int.from_bytes(self.data[:4], "little", signed=True)
+        ret = _int32.unpack_from(self.data, self.offset)[0]
         self.offset += 4
         return ret
 
     def read_uint32(self) -> int:
-        ret = int.from_bytes(self.data[:4], "little", signed=False)
+        ret = _uint32.unpack_from(self.data, self.offset)[0]
         self.offset += 4
         return ret
 
     def read_int64(self) -> int:
-        ret = int.from_bytes(self.data[:8], "little", signed=True)
+        ret = _int64.unpack_from(self.data, self.offset)[0]
         self.offset += 8
         return ret
 
     def read_uint64(self) -> int:
-        ret = int.from_bytes(self.data[:8], "little", signed=False)
+        ret = _uint64.unpack_from(self.data, self.offset)[0]
         self.offset += 8
         return ret
 
     def read_i32_list(self) -> tuple[int]:
         length = self.read_int16()
 
-        ret = struct.unpack(f"<{'I' * length}", self.data[: length * 4])
+        ret = struct.unpack_from(f"<{length}I", self.data, self.offset)
 
         self.offset += length * 4
         return ret
 
     def read_float32(self) -> float:
-        ret = struct.unpack("<f", self.data[:4])
+        ret = _float32.unpack_from(self.data, self.offset)[0]
         self.offset += 4
         return ret
 
     def read_float64(self) -> float:
-        ret = struct.unpack("<d", self.data[:8])
+        ret = _float64.unpack_from(self.data, self.offset)[0]
         self.offset += 8
         return ret
 
     def read_str(self) -> str:
-        self.offset += 1
+        data = self.data
+
+        # 0x00 means there's no string at all
+        if data[self.offset] != 0x0B:
+            self.offset += 1
+            return ""
+
+        offset = self.offset + 1
 
         shift = 0
         result = 0
 
         while True:
-            b = self.data[0]
-            self.offset += 1
+            b = data[offset]
+            offset += 1
 
             result |= (b & 0x7F) << shift
 
@@ -148,26 +182,25 @@ class Reader:
 
             shift += 7
 
-        ret = self.data[:result].tobytes().decode()
+        ret = str(data[offset : offset + result], "utf-8")
 
-        self.offset += result
+        self.offset = offset + result
         return ret
 
     def _read_raw(self, length: int) -> memoryview:
-        ret = self.data[:length]
+        ret = self.data[self.offset : self.offset + length]
         self.offset += length
         return ret
 
     def read_raw(self) -> memoryview:
-        ret = self.data[: self.plen]
+        ret = self.data[self.offset : self.offset + self.plen]
         self.offset += self.plen
         return ret
 
     def read_match(self) -> Match:
         m = Match()
 
-        m.match_id = len(services.matches.matches)
-
+        # the match id is given by `Matches.add`
         self.offset += 2
 
         m.in_progress = self.read_int8() == 1
@@ -1,7 +1,7 @@
 from constants.player import Ranks, Privileges
 from constants.packets import BanchoPackets
 from constants.match import SlotStatus
-from typing import Any, TYPE_CHECKING
+from typing import Any, Callable, TYPE_CHECKING
 from enum import unique, IntEnum
 from objects import services
 import struct
@@ -12,8 +12,6 @@ if TYPE_CHECKING:
     from objects.player import Player
     from objects.score import ScoreFrame
 
-spec = ("<b", "<B", "<h", "<H", "<i", "<I", "<f", "<q", "<Q", "<d")
-
 
 @unique
 class Types(IntEnum):
@@ -43,119 +41,287 @@ class Types(IntEnum):
     message = 23
 
 
-async def write_uleb128(value: int) -> bytearray:
-    if value == 0:
-        return bytearray(b"\x00")
+# struct format characters for every fixed size type
+formats: dict[Types, str] = {
+    Types.int8: "b",
+    Types.uint8: "B",
+    Types.int16: "h",
+    Types.uint16: "H",
+    Types.int32: "i",
+    Types.uint32: "I",
+    Types.float32: "f",
+    Types.int64: "q",
+    Types.uint64: "Q",
+    Types.float64: "d",
+    Types.byte: "b",
+    Types.ubyte: "B",
+}
+
+HEADER = struct.Struct("<HxI")
+
+
+def write_uleb128(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
 
     data: bytearray = bytearray()
-    length: int = 0
 
     while value > 0:
         data.append(value & 0x7F)
         value >>= 7
         if value != 0:
-            data[length] |= 0x80
+            data[-1] |= 0x80
 
-        length += 1
+    return bytes(data)
 
-    return data
 
+def write_byte(value: int) -> bytes:
+    return struct.pack("<b", value)
 
-async def write_byte(value: int) -> bytearray:
-    return bytearray(struct.pack("<b", value))
 
+def write_ubyte(value: int) -> bytes:
+    return struct.pack("<B", value)
 
-async def write_ubyte(value: int) -> bytearray:
-    return bytearray(struct.pack("<B", value))
 
+def write_int32(value: int) -> bytes:
+    return struct.pack("<i", value)
 
-async def write_int32(value: int) -> bytearray:
-    return bytearray(value.to_bytes(Types.int32, "little", signed=True))
 
+def write_int32_list(values: tuple[int]) -> bytes:
+    return struct.pack(f"<H{len(values)}I", len(values), *values)
 
-async def write_int32_list(values: tuple[int]) -> bytearray:
-    data = bytearray(len(values).to_bytes(2, "little"))
 
-    for value in values:
-        data += value.to_bytes(4, "little")
+def write_multislots(slots) -> bytes:
+    ret = bytearray(s.status for s in slots)
+    ret.extend(s.team for s in slots)
 
-    return data
+    for slot in slots:
+        if slot.status & SlotStatus.OCCUPIED:
+            ret += slot.p.id.to_bytes(4, "little")
 
+    return bytes(ret)
 
-async def write_multislots(slots) -> bytearray:
-    ret = bytearray()
 
-    ret.extend([s.status for s in slots])
-    ret.extend([s.team for s in slots])
+def write_multislotsmods(slots) -> bytes:
+    return struct.pack(f"<{len(slots)}I", *(slot.mods for slot in slots))
 
-    for slot in slots:
-        if slot.status & SlotStatus.OCCUPIED:
-            ret += slot.p.id.to_bytes(4, "little")
 
-    return ret
+def write_str(string: str) -> bytes:
+    if not string:
+        return b"\x00"
 
+    encoded = string.encode()
 
-async def write_multislotsmods(slots) -> bytearray:
-    ret = bytearray()
+    if (length := len(encoded)) < 0x80:
+        return b"\x0B" + bytes((length,)) + encoded
 
-    for slot in slots:
-        ret += slot.mods.to_bytes(4, "little")
+    return b"\x0B" + write_uleb128(length) + encoded
 
-    return ret
 
+def write_msg(sender: str, msg: str, chan: str, id: int) -> bytes:
+    return (
+        write_str(sender)
+        + write_str(msg)
+        + write_str(chan)
+        + id.to_bytes(4, "little", signed=True)
+    )
 
-async def write_str(string: str) -> bytearray:
-    if not string:
-        return bytearray(b"\x00")
-
-    data = bytearray(b"\x0B")
-
-    data += await write_uleb128(len(string.encode()))
-    data += string.encode()
-    return data
-
-
-async def write_msg(sender: str, msg: str, chan: str, id: int) -> bytearray:
-    ret = bytearray()
-
-    ret += await write_str(sender)
-    ret += await write_str(msg)
-    ret += await write_str(chan)
-    ret += id.to_bytes(4, "little", signed=True)
-
-    return ret
-
-
-async def write(pID: int, *args: tuple[Any, ...]) -> bytes:
-    data = bytearray(struct.pack("<Hx", pID))
-
-    for args, d_type in args:
-        if d_type == Types.string:
-            data += await write_str(args)
-        elif d_type == Types.raw:
-            data += args
-        elif d_type == Types.int32:
-            data += await write_int32(args)
-        elif d_type == Types.int32_list:
-            data += await write_int32_list(args)
-        elif d_type == Types.multislots:
-            data += await write_multislots(args)
-        elif d_type == Types.multislotsmods:
-            data += await write_multislotsmods(args)
-        elif d_type == Types.byte:
-            data += await write_byte(args)
-        elif d_type == Types.ubyte:
-            data += await write_ubyte(args)
-        elif d_type == Types.message:
-            data += await write_msg(*args)
+
+encoders: dict[Types, Callable[[Any], bytes]] = {
+    Types.string: write_str,
+    Types.raw: bytes,
+    Types.int32_list: write_int32_list,
+    Types.multislots: write_multislots,
+    Types.multislotsmods: write_multislotsmods,
+    Types.message: lambda args: write_msg(*args),
+}
+
+
+class Packet:
+    """
+    A packet layout that gets compiled once, when the module is imported.
+
+    Runs of fixed size fields are merged into a single `struct.Struct`,
+    while strings and the other variable sized fields get their own slot.
+    Packets with only fixed size fields are packed together with their
+    header in one go.
+    """
+
+    __slots__ = ("id", "segments", "fixed", "size")
+
+    def __init__(self, packet: BanchoPackets, *fields: Types) -> None:
+        self.id: int = packet.value
+
+        # (encoder, start, stop); stop is None for variable sized fields
+        self.segments: list[tuple[Callable[..., bytes], int, int | None]] = []
+
+        self.fixed: struct.Struct | None = None
+        self.size: int = 0
+
+        fmt, start = "", 0
+
+        for idx, field in enumerate(fields):
+            if field in formats:
+                fmt += formats[field]
+                continue
+
+            if fmt:
+                self.segments.append((struct.Struct(f"<{fmt}").pack, start, idx))
+
+            self.segments.append((encoders[field], idx, None))
+            fmt, start = "", idx + 1
+
+        if fmt:
+            self.segments.append((struct.Struct(f"<{fmt}").pack, start, len(fields)))
+
+        if all(stop is not None for _, _, stop in self.segments):
+            self.fixed = struct.Struct(f"<HxI{''.join(formats[f] for f in fields)}")
+            self.size = self.fixed.size - HEADER.size
+
+    def __repr__(self) -> str:
+        return f"<Packet {BanchoPackets(self.id).name}>"
+
+    def encode(self, *values: Any) -> bytes:
+        if self.fixed:
+            return self.fixed.pack(self.id, self.size, *values)
+
+        data: list[bytes] = [b""]
+
+        for pack, start, stop in self.segments:
+            if stop is None:
+                data.append(pack(values[start]))
+            else:
+                data.append(pack(*values[start:stop]))
+
+        data[0] = HEADER.pack(self.id, sum(map(len, data)))
+        return b"".join(data)
+
+
+def write(pID: int, *args: tuple[Any, ...]) -> bytes:
+    """
+    Encodes a packet, without having a compiled layout for it.
+    Should only be used for packets which are rarely sent.
+    """
+    data = [b""]
+
+    for value, d_type in args:
+        if d_type in encoders:
+            data.append(encoders[d_type](value))
         else:
-            data += struct.pack(spec[d_type], args)
+            data.append(struct.pack(f"<{formats[d_type]}", value))
+
+    data[0] = HEADER.pack(pID, sum(map(len, data)))
+    return b"".join(data)
+
+
+#
+# Compiled packet layouts
+#
+
+_user_id = Packet(BanchoPackets.CHO_USER_ID, Types.int32)
+_spec_joined = Packet(BanchoPackets.CHO_SPECTATOR_JOINED, Types.int32)
+_spec_left = Packet(BanchoPackets.CHO_SPECTATOR_LEFT, Types.int32)
+_fellow_joined = Packet(BanchoPackets.CHO_FELLOW_SPECTATOR_JOINED, Types.int32)
+_fellow_left = Packet(BanchoPackets.CHO_FELLOW_SPECTATOR_LEFT, Types.int32)
+_cant_spec = Packet(BanchoPackets.CHO_SPECTATOR_CANT_SPECTATE, Types.int32)
+_notification = Packet(BanchoPackets.CHO_NOTIFICATION, Types.string)
+_privileges = Packet(BanchoPackets.CHO_PRIVILEGES, Types.int32)
+_protocol = Packet(BanchoPackets.CHO_PROTOCOL_VERSION, Types.int32)
+_friends = Packet(BanchoPackets.CHO_FRIENDS_LIST, Types.int32_list)
+
+_stats = Packet(
+    BanchoPackets.CHO_USER_STATS,
+    Types.int32,
+    Types.uint8,
+    Types.string,
+    Types.string,
+    Types.int32,
+    Types.uint8,
+    Types.int32,
+    Types.int64,
+    Types.float32,
+    Types.int32,
+    Types.int64,
+    Types.int32,
+    Types.int16,
+)
+
+_presence = Packet(
+    BanchoPackets.CHO_USER_PRESENCE,
+    Types.int32,
+    Types.string,
+    Types.byte,
+    Types.ubyte,
+    Types.byte,
+    Types.float32,
+    Types.float32,
+    Types.int32,
+)
+
+_menu_icon = Packet(BanchoPackets.CHO_MAIN_MENU_ICON, Types.string)
+_chan_join = Packet(BanchoPackets.CHO_CHANNEL_JOIN_SUCCESS, Types.string)
+_chan_kick = Packet(BanchoPackets.CHO_CHANNEL_KICK, Types.string)
+_chan_auto_join = Packet(BanchoPackets.CHO_CHANNEL_AUTO_JOIN, Types.string)
+_chan_info = Packet(
+    BanchoPackets.CHO_CHANNEL_INFO, Types.string, Types.string, Types.int32
+)
+_chan_info_end = Packet(BanchoPackets.CHO_CHANNEL_INFO_END)
+_restart = Packet(BanchoPackets.CHO_RESTART, Types.int32)
+
+_message = (Types.string, Types.string, Types.string, Types.int32)
+_send_message = Packet(BanchoPackets.CHO_SEND_MESSAGE, *_message)
+_match_invite = Packet(BanchoPackets.CHO_MATCH_INVITE, *_message)
+
+_logout = Packet(BanchoPackets.CHO_USER_LOGOUT, Types.int32, Types.uint8)
+
+_match = (
+    Types.int16,
+    Types.int8,
+    Types.byte,
+    Types.uint32,
+    Types.string,
+    Types.string,
+    Types.string,
+    Types.int32,
+    Types.string,
+    Types.multislots,
+    Types.int32,
+    Types.byte,
+    Types.byte,
+    Types.byte,
+    Types.byte,
+)
+
+
+def _match_layouts(packet: BanchoPackets) -> tuple[Packet, Packet]:
+    # (without freemods, with freemods)
+    return (
+        Packet(packet, *_match, Types.int32),
+        Packet(packet, *_match, Types.multislotsmods, Types.int32),
+    )
 
-    data[3:3] += struct.pack("<I", len(data) - 3)
-    return bytes(data)
 
+_new_match = _match_layouts(BanchoPackets.CHO_NEW_MATCH)
+_match_join = _match_layouts(BanchoPackets.CHO_MATCH_JOIN_SUCCESS)
+_match_start = _match_layouts(BanchoPackets.CHO_MATCH_START)
+_match_update = _match_layouts(BanchoPackets.CHO_UPDATE_MATCH)
+
+_all_ready = Packet(BanchoPackets.CHO_MATCH_ALL_PLAYERS_LOADED)
+_match_complete = Packet(BanchoPackets.CHO_MATCH_COMPLETE)
+_match_dispose = Packet(BanchoPackets.CHO_DISPOSE_MATCH, Types.int32)
+_match_fail = Packet(BanchoPackets.CHO_MATCH_JOIN_FAIL)
+_match_pass = Packet(BanchoPackets.CHO_MATCH_CHANGE_PASSWORD, Types.string)
+_player_failed = Packet(BanchoPackets.CHO_MATCH_PLAYER_FAILED, Types.int32)
+_player_skipped = Packet(BanchoPackets.CHO_MATCH_PLAYER_SKIPPED, Types.int32)
+_match_skip = Packet(BanchoPackets.CHO_MATCH_SKIP)
+_transfer_host = Packet(BanchoPackets.CHO_MATCH_TRANSFER_HOST)
+_pong = Packet(BanchoPackets.CHO_PONG)
+
+# header + score frame; the length is taken from the raw frame
+_score_update = struct.Struct("<HxIibHHHHHHiHHbbbb")
 
-async def UserID(id: int) -> bytes:
+
+def UserID(id: int) -> bytes:
     """
     ID Responses:
     -1: Authentication Failure
@@ -168,34 +334,34 @@ async def UserID(id: int) -> bytes:
     -8: Requires Verification
     > -1: Valid ID
     """
-    return await write(BanchoPackets.CHO_USER_ID, (id, Types.int32))
+    return _user_id.encode(id)
 
 
-async def UsrJoinSpec(id: int) -> bytes:
-    return await write(BanchoPackets.CHO_SPECTATOR_JOINED, (id, Types.int32))
+def UsrJoinSpec(id: int) -> bytes:
+    return _spec_joined.encode(id)
 
 
-async def UsrLeftSpec(id: int) -> bytes:
-    return await write(BanchoPackets.CHO_SPECTATOR_LEFT, (id, Types.int32))
+def UsrLeftSpec(id: int) -> bytes:
+    return _spec_left.encode(id)
 
 
-async def FellasJoinSpec(id: int) -> bytes:
-    return await write(BanchoPackets.CHO_FELLOW_SPECTATOR_JOINED, (id, Types.int32))
+def FellasJoinSpec(id: int) -> bytes:
+    return _fellow_joined.encode(id)
 
 
-async def FellasLeftSpec(id: int) -> bytes:
-    return await write(BanchoPackets.CHO_FELLOW_SPECTATOR_LEFT, (id, Types.int32))
+def FellasLeftSpec(id: int) -> bytes:
+    return _fellow_left.encode(id)
 
 
-async def UsrCantSpec(id: int) -> bytes:
-    return await write(BanchoPackets.CHO_SPECTATOR_CANT_SPECTATE, (id, Types.int32))
+def UsrCantSpec(id: int) -> bytes:
+    return _cant_spec.encode(id)
 
 
-async def Notification(msg: str) -> bytes:
-    return await write(BanchoPackets.CHO_NOTIFICATION, (msg, Types.string))
+def Notification(msg: str) -> bytes:
+    return _notification.encode(msg)
 
 
-async def UserPriv(privileges: int) -> bytes:
+def UserPriv(privileges: int) -> bytes:
     rank = Ranks.NONE
     rank |= Ranks.SUPPORTER
 
@@ -214,43 +380,36 @@ async def UserPriv(privileges: int) -> bytes:
     if privileges & Privileges.DEV:
         rank |= Ranks.PEPPY
 
-    return await write(BanchoPackets.CHO_PRIVILEGES, (rank, Types.int32))
+    return _privileges.encode(rank)
 
 
-async def ProtocolVersion(version: int) -> bytes:
-    return await write(BanchoPackets.CHO_PROTOCOL_VERSION, (version, Types.int32))
+def ProtocolVersion(version: int) -> bytes:
+    return _protocol.encode(version)
 
 
-async def UpdateFriends(friends_id: tuple[int]):
-    return await write(BanchoPackets.CHO_FRIENDS_LIST, (friends_id, Types.int32_list))
+def UpdateFriends(friends_id: tuple[int]):
+    return _friends.encode(friends_id)
 
 
-async def UpdateStats(p: "Player") -> bytes:
-    if p not in services.players.players:
-        return b""
-
-    return await write(
-        BanchoPackets.CHO_USER_STATS,
-        (p.id, Types.int32),
-        (p.status.value, Types.uint8),
-        (p.status_text, Types.string),
-        (p.beatmap_md5, Types.string),
-        (p.current_mods, Types.int32),
-        (p.play_mode, Types.uint8),
-        (p.beatmap_id, Types.int32),
-        (p.ranked_score, Types.int64),
-        (p.accuracy / 100.0, Types.float32),
-        (p.playcount, Types.int32),
-        (p.total_score, Types.int64),
-        (p.rank, Types.int32),
-        (math.ceil(p.pp), Types.int16),
+def encode_stats(p: "Player") -> bytes:
+    return _stats.encode(
+        p.id,
+        p.status.value,
+        p.status_text,
+        p.beatmap_md5,
+        p.current_mods,
+        p.play_mode,
+        p.beatmap_id,
+        p.ranked_score,
+        p.accuracy / 100.0,
+        p.playcount,
+        p.total_score,
+        p.rank,
+        math.ceil(p.pp),
     )
 
 
-async def UserPresence(p: "Player", spoof: bool = False) -> bytes:
-    if p not in services.players.players:
-        return b""
-
+def encode_presence(p: "Player", spoof: bool = False) -> bytes:
     rank = Ranks.NONE
 
     if spoof:
@@ -274,205 +433,191 @@ async def UserPresence(p: "Player", spoof: bool = False) -> bytes:
     if p.privileges & Privileges.DEV:
         rank |= Ranks.PEPPY
 
-    return await write(
-        BanchoPackets.CHO_USER_PRESENCE,
-        (p.id, Types.int32),
-        (p.username, Types.string),
-        (p.timezone, Types.byte),
-        (p.country, Types.ubyte),
-        (rank, Types.byte),
-        (p.longitude, Types.float32),
-        (p.latitude, Types.float32),
-        (p.rank, Types.int32),
+    return _presence.encode(
+        p.id,
+        p.username,
+        p.timezone,
+        p.country,
+        rank,
+        p.longitude,
+        p.latitude,
+        p.rank,
     )
 
 
-async def MainMenuIcon() -> bytes:
-    return await write(
-        BanchoPackets.CHO_MAIN_MENU_ICON,
-        ("https://imgur.com/Uihzw6N.png|https://c.mitsuha.pw", Types.string),
-    )
+def UpdateStats(p: "Player") -> bytes:
+    if p not in services.players:
+        return b""
 
+    return p.stats_packet
 
-async def ChanJoin(name: str) -> bytes:
-    return await write(BanchoPackets.CHO_CHANNEL_JOIN_SUCCESS, (name, Types.string))
 
+def UserPresence(p: "Player", spoof: bool = False) -> bytes:
+    if p not in services.players:
+        return b""
+
+    # spoofed presences are only sent to the player themself, on login.
+    if spoof:
+        return encode_presence(p, spoof=True)
+
+    return p.presence_packet
 
-async def ChanKick(name: str) -> bytes:
-    return await write(BanchoPackets.CHO_CHANNEL_KICK, (name, Types.string))
 
+def MainMenuIcon() -> bytes:
+    return _menu_icon.encode("https://imgur.com/Uihzw6N.png|https://c.mitsuha.pw")
 
-async def ChanAutoJoin(chan: str) -> bytes:
-    return await write(BanchoPackets.CHO_CHANNEL_AUTO_JOIN, (chan, Types.string))
 
+def ChanJoin(name: str) -> bytes:
+    return _chan_join.encode(name)
 
-async def ChanInfo(name: str) -> bytes:
+
+def ChanKick(name: str) -> bytes:
+    return _chan_kick.encode(name)
+
+
+def ChanAutoJoin(chan: str) -> bytes:
+    return _chan_auto_join.encode(chan)
+
+
+def ChanInfo(name: str) -> bytes:
     if not (c := services.channels.get(name)):
         return bytes()
 
-    return await write(
-        BanchoPackets.CHO_CHANNEL_INFO,
-        (c.name, Types.string),
-        (c.description, Types.string),
-        (len(c.connected), Types.int32),
-    )
-
+    return _chan_info.encode(c.name, c.description, len(c.connected))
 
-async def ChanInfoEnd() -> bytes:
-    return await write(BanchoPackets.CHO_CHANNEL_INFO_END)
 
+def ChanInfoEnd() -> bytes:
+    return _chan_info_end.encode()
 
-async def ServerRestart() -> bytes:
-    return await write(BanchoPackets.CHO_RESTART, (0, Types.int32))
 
+def ServerRestart() -> bytes:
+    return _restart.encode(0)
 
-async def SendMessage(sender: str, message: str, channel: str, id: int) -> bytes:
-    return await write(
-        BanchoPackets.CHO_SEND_MESSAGE,
-        ((sender, message, channel, id), Types.message),
-    )
 
+def SendMessage(sender: str, message: str, channel: str, id: int) -> bytes:
+    return _send_message.encode(sender, message, channel, id)
 
-async def Logout(id: int) -> bytes:
-    return await write(
-        BanchoPackets.CHO_USER_LOGOUT,
-        (id, Types.int32),
-        (0, Types.uint8),
-    )
 
+def Logout(id: int) -> bytes:
+    return _logout.encode(id, 0)
 
-async def FriendsList(*ids: set[int]) -> bytes:
-    return await write(BanchoPackets.CHO_FRIENDS_LIST, (ids, Types.int32_list))
 
+def FriendsList(*ids: set[int]) -> bytes:
+    return _friends.encode(ids)
 
-def get_match_struct(m: "Match", send_pass: bool = False) -> bytes:
-    struct = [
-        (m.match_id, Types.int16),
-        (m.in_progress, Types.int8),
-        (0, Types.byte),
-        (m.mods, Types.uint32),
-        (m.match_name, Types.string),
-    ]
 
+def get_match_struct(
+    layouts: tuple[Packet, Packet], m: "Match", send_pass: bool = False
+) -> bytes:
     if m.match_pass:
         if send_pass:
-            struct.append((m.match_pass, Types.string))
+            pwd = m.match_pass
         else:
-            struct.append(("trollface", Types.string))
+            pwd = "trollface"
     else:
-        struct.append(("", Types.string))
-
-    struct.extend(
-        (
-            (m.map_title, Types.string),
-            (m.map_id, Types.int32),
-            (m.map_md5, Types.string),
-            (m.slots, Types.multislots),
-            (m.host, Types.int32),
-            (m.mode.value, Types.byte),
-            (m.scoring_type.value, Types.byte),
-            (m.team_type.value, Types.byte),
-            (m.freemods, Types.byte),
-        )
+        pwd = ""
+
+    values = (
+        m.match_id,
+        m.in_progress,
+        0,
+        m.mods,
+        m.match_name,
+        pwd,
+        m.map_title,
+        m.map_id,
+        m.map_md5,
+        m.slots,
+        m.host,
+        m.mode.value,
+        m.scoring_type.value,
+        m.team_type.value,
+        m.freemods,
     )
 
     if m.freemods:
-        struct.append((m.slots, Types.multislotsmods))
+        return layouts[1].encode(*values, m.slots, m.seed)
 
-    struct.append((m.seed, Types.int32))
+    return layouts[0].encode(*values, m.seed)
 
-    return struct
 
+def Match(m: "Match") -> bytes:
+    return get_match_struct(_new_match, m)
 
-async def Match(m: "Match") -> bytes:
-    struct = get_match_struct(m)
-    return await write(BanchoPackets.CHO_NEW_MATCH, *struct)
 
+def MatchAllReady() -> bytes:
+    return _all_ready.encode()
 
-async def MatchAllReady() -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_ALL_PLAYERS_LOADED)
 
+def MatchComplete():
+    return _match_complete.encode()
 
-async def MatchComplete():
-    return await write(BanchoPackets.CHO_MATCH_COMPLETE)
 
+def MatchDispose(mid: int) -> bytes:
+    return _match_dispose.encode(mid)
 
-async def MatchDispose(mid: int) -> bytes:
-    return await write(BanchoPackets.CHO_DISPOSE_MATCH, (mid, Types.int32))
 
+def MatchFail() -> bytes:
+    return _match_fail.encode()
 
-async def MatchFail() -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_JOIN_FAIL)
 
+def MatchInvite(m: "Match", p: "Player", reciever) -> bytes:
+    return _match_invite.encode(p.username, f"#multi_{m.match_id}", reciever, p.id)
 
-async def MatchInvite(m: "Match", p: "Player", reciever) -> bytes:
-    return await write(
-        BanchoPackets.CHO_MATCH_INVITE,
-        ((p.username, f"#multi_{m.match_id}", reciever, p.id), Types.message),
-    )
-
-
-async def MatchJoin(m: "Match") -> bytes:
-    struct = get_match_struct(m, send_pass=True)
-    return await write(BanchoPackets.CHO_MATCH_JOIN_SUCCESS, *struct)
-
-
-async def MatchPassChange(pwd: str) -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_CHANGE_PASSWORD, (pwd, Types.string))
 
+def MatchJoin(m: "Match") -> bytes:
+    return get_match_struct(_match_join, m, send_pass=True)
 
-async def MatchPlayerFailed(pid: int) -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_PLAYER_FAILED, (pid, Types.int32))
 
+def MatchPassChange(pwd: str) -> bytes:
+    return _match_pass.encode(pwd)
 
-async def MatchScoreUpdate(s: "ScoreFrame", slot_id: int, raw_data: bytes) -> bytes:
-    ret = bytearray(b"0\x00\x00")
 
-    ret += len(raw_data).to_bytes(4, "little")
+def MatchPlayerFailed(pid: int) -> bytes:
+    return _player_failed.encode(pid)
 
-    ret += s.time.to_bytes(4, "little", signed="True")
-    ret += struct.pack("<b", slot_id)
 
-    ret += struct.pack(
-        "<HHHHHH",
+def MatchScoreUpdate(s: "ScoreFrame", slot_id: int, raw_data: bytes) -> bytes:
+    return _score_update.pack(
+        BanchoPackets.CHO_MATCH_SCORE_UPDATE,
+        len(raw_data),
+        s.time,
+        slot_id,
         s.count_300,
         s.count_100,
         s.count_50,
         s.count_geki,
         s.count_katu,
         s.count_miss,
+        s.score,
+        s.max_combo,
+        s.combo,
+        s.perfect,
+        s.current_hp,
+        s.tag_byte,
+        s.score_v2,
     )
 
-    ret += s.score.to_bytes(4, "little", signed=True)
-
-    ret += struct.pack("<HH", s.max_combo, s.combo)
-
-    ret += struct.pack("<bbbb", s.perfect, s.current_hp, s.tag_byte, s.score_v2)
-
-    return ret
-
 
-async def MatchPlayerReqSkip(pid: id) -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_PLAYER_SKIPPED, (pid, Types.int32))
+def MatchPlayerReqSkip(pid: id) -> bytes:
+    return _player_skipped.encode(pid)
 
 
-async def MatchSkip() -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_SKIP)
+def MatchSkip() -> bytes:
+    return _match_skip.encode()
 
 
-async def MatchStart(m: "Match") -> bytes:
-    struct = get_match_struct(m, send_pass=True)
-    return await write(BanchoPackets.CHO_MATCH_START, *struct)
+def MatchStart(m: "Match") -> bytes:
+    return get_match_struct(_match_start, m, send_pass=True)
 
 
-async def MatchTransferHost() -> bytes:
-    return await write(BanchoPackets.CHO_MATCH_TRANSFER_HOST)
+def MatchTransferHost() -> bytes:
+    return _transfer_host.encode()
 
 
-async def MatchUpdate(m: "Match") -> bytes:
-    struct = get_match_struct(m, send_pass=True)
-    return await write(BanchoPackets.CHO_UPDATE_MATCH, *struct)
+def MatchUpdate(m: "Match") -> bytes:
+    return get_match_struct(_match_update, m, send_pass=True)
 
 
-async def Pong() -> bytes:
-    return await write(BanchoPackets.CHO_PONG)
+def Pong() -> bytes:
+    return _pong.encode()
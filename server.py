@@ -1,12 +1,20 @@
-from objects.collections import Tokens, Channels, Matches
-from events import bancho, osu, avatar
+from objects.collections import Tokens, Channels, Matches, Beatmaps
+from events import bancho, osu, avatar, internal
 from lenhttp import LenHTTP, Request
+from objects.leaderboard import Leaderboards
+from objects.beatmapfiles import BeatmapFiles
 from lib.database import Database
+from lib.http import HTTPClient
+from lib.geoip import GeoIP
+from lib.querystats import QueryStats, TimedRedis
+from lib.writebehind import WriteBehind
+from lib.replaystore import ReplayStore
 from objects.bot import Louise
+from anticheat import run
 from constants import commands  # dont remove
 from objects import services
 from utils import log
-import aioredis
+import asyncio
 import os
 import sys
 
@@ -24,6 +32,8 @@ async def startup():
     services.players = Tokens()
     services.channels = Channels()
     services.matches = Matches()
+    services.beatmaps = Beatmaps()
+    services.leaderboards = Leaderboards()
 
     for _path in (".data/avatars", ".data/replays", ".data/beatmaps"):
         if not os.path.exists(_path):
@@ -33,19 +43,44 @@ async def startup():
 
             os.makedirs(_path)
 
+    services.beatmap_files = BeatmapFiles()
+    services.beatmap_files.load()
+
+    services.replays = ReplayStore()
+    await asyncio.get_running_loop().run_in_executor(
+        None, services.replays.load, services.config["server"].get("replays", {})
+    )
+
     log.info(f"Running Ragnarok on `{services.domain}` (port: {services.port})")
 
     log.info(".. Connecting to the database")
 
+    services.query_stats = QueryStats(services.config["server"].get("queries", {}))
+
     services.sql = Database()
+    services.sql.hooks.append(services.query_stats.hook("sql"))
     await services.sql.connect(services.config["mysql"])
 
+    services.write_behind = WriteBehind(services.sql)
+    await services.write_behind.start(
+        services.config["server"].get("write_behind", {})
+    )
+
     log.info("✓ Connected to the database!")
 
+    services.http = HTTPClient()
+    await services.http.connect(services.config.get("http", {}))
+
+    services.geoip = GeoIP()
+    await asyncio.get_running_loop().run_in_executor(
+        None, services.geoip.load, services.config.get("geoip", {})
+    )
+
     log.info(".. Initalizing redis")
 
     redisconf = services.config["redis"]
-    services.redis = aioredis.from_url(f"redis://{redisconf['username']}:{redisconf['password']}@{redisconf['host']}:{redisconf['port']}")
+    services.redis = TimedRedis.from_url(f"redis://{redisconf['username']}:{redisconf['password']}@{redisconf['host']}:{redisconf['port']}")
+    services.redis.hooks.append(services.query_stats.hook("redis"))
     await services.redis.initialize()
 
     log.info("✓ Successfully initalized redis")
@@ -67,9 +102,33 @@ async def startup():
 
     log.info("✓ Successfully added all avaliable channels")
 
+    # last, since jobs left over from before might need any of the above
+    await services.jobs.start(services.config["server"].get("jobs", {}))
+
+    await internal.start(services.config["server"].get("internal", {}))
+
     log.info("Finished up connecting to everything!")
 
 
+@services.server.after_serving()
+async def shutdown():
+    internal.stop()
+
+    # first, running jobs can still be writing replays or counters
+    await services.jobs.stop()
+
+    # the counters that are only in memory so far
+    await services.write_behind.stop()
+
+    services.replays.close()
+
+    # unfinished checks are still in the job journal
+    run.executor.shutdown(wait=False, cancel_futures=True)
+
+    # last, jobs download beatmaps through it
+    await services.http.disconnect()
+
+
 @avatar.avatar.after_request()
 @osu.osu.after_request()
 async def after_request(req: Request):
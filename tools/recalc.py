@@ -0,0 +1,341 @@
+"""
+Recalculate the pp of every score on a pp giving map, and rebuild the
+totals of every player afterwards.
+
+Scores are streamed from the database ordered by beatmap, and every
+beatmap is handed to a worker process as a whole, so its .osu file is
+parsed once per mods combination instead of once per score. The new pp
+values are written back in batches.
+
+The last beatmap that was fully written is kept in `.data/recalc.progress`,
+so an interrupted run continues from there; pass --restart to start over.
+
+Relax bests are picked by pp, so once the pp changed they're picked again
+before the totals are rebuilt.
+
+    python -m tools.recalc [--workers 4] [--batch 1000] [--restart] [--totals-only]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from objects.topscores import TopScores
+from objects.beatmapfiles import BeatmapFiles
+from constants.beatmap import Approved
+from constants.playmode import Mode
+from lib.database import Database
+from collections import deque
+from objects import services
+from utils import log
+import numpy as np
+import argparse
+import asyncio
+import aioredis
+import oppai
+import math
+import time
+import os
+
+PROGRESS = ".data/recalc.progress"
+
+# the same maps `Score.set_data_from_submission` calculates pp on
+PP_MAPS = (Approved.UPDATE, Approved.RANKED, Approved.APPROVED, Approved.QUALIFIED)
+
+
+def calculate(path: str, scores: list[tuple[int, int, int, int, float]]) -> list:
+    """
+    Runs in a worker. Takes (id, mods, combo, misses, accuracy) of every
+    score on a map, returns (pp, id) of them.
+    """
+    ret = []
+    ez = None
+    current = None
+
+    # grouped by mods, so the difficulty is only calculated once for each
+    for id, mods, combo, nmiss, acc in sorted(scores, key=lambda s: s[1]):
+        if mods != current:
+            if ez:
+                oppai.ezpp_free(ez)
+
+            ez = oppai.ezpp_new()
+            oppai.ezpp_set_autocalc(ez, 1)
+
+            if mods:
+                oppai.ezpp_set_mods(ez, mods)
+
+            oppai.ezpp(ez, path)
+            current = mods
+
+        oppai.ezpp_set_combo(ez, combo)
+        oppai.ezpp_set_nmiss(ez, nmiss)
+        oppai.ezpp_set_accuracy_percent(ez, acc)
+
+        ret.append((oppai.ezpp_pp(ez), id))
+
+    if ez:
+        oppai.ezpp_free(ez)
+
+    return ret
+
+
+class Progress:
+    def __init__(self) -> None:
+        self.start: float = time.time()
+        self.last: float = self.start
+
+        self.maps: int = 0
+        self.scores: int = 0
+        self.missing: int = 0
+
+    def report(self, map_id: int, force: bool = False) -> None:
+        now = time.time()
+
+        if not force and now - self.last < 5:
+            return
+
+        self.last = now
+        elapsed = now - self.start
+
+        log.info(
+            f"{self.scores} scores on {self.maps} maps in {elapsed:.0f}s "
+            f"({self.scores / elapsed:.0f} scores/s), at map {map_id}, "
+            f"{self.missing} maps without a .osu file"
+        )
+
+
+def load_progress() -> int:
+    if not os.path.isfile(PROGRESS):
+        return 0
+
+    with open(PROGRESS) as f:
+        return int(f.read().strip() or 0)
+
+
+def save_progress(map_id: int) -> None:
+    # written to a temporary file first, so a crash can't leave half a number
+    with open(PROGRESS + ".tmp", "w") as f:
+        f.write(str(map_id))
+
+    os.replace(PROGRESS + ".tmp", PROGRESS)
+
+
+async def write(rows: list[tuple[float, int]], batch: int) -> None:
+    for i in range(0, len(rows), batch):
+        await services.sql.executemany(
+            "UPDATE scores SET pp = %s WHERE id = %s", rows[i : i + batch]
+        )
+
+
+async def recalculate_scores(workers: int, batch: int, after: int) -> None:
+    loop = asyncio.get_running_loop()
+    progress = Progress()
+
+    files = BeatmapFiles()
+    files.load()
+
+    # results are written in the order the maps were read, so the
+    # progress file never points past a map that isn't written yet.
+    pending: deque[tuple[int, int, asyncio.Future]] = deque()
+    pending_rows: list[tuple[float, int]] = []
+
+    async def finish_oldest() -> None:
+        map_id, count, future = pending.popleft()
+        pending_rows.extend(await future)
+
+        if len(pending_rows) >= batch or not pending:
+            await write(pending_rows, batch)
+            pending_rows.clear()
+
+            # a map can have more versions (hashes) that aren't done yet,
+            # so an interrupted run starts over at this map.
+            save_progress(map_id - 1)
+
+        progress.maps += 1
+        progress.scores += count
+        progress.report(map_id)
+
+    def submit(map_id: int, hash: str, scores: list) -> None:
+        if hash not in files:
+            progress.missing += 1
+            return
+
+        path = files.file(hash)
+
+        future = loop.run_in_executor(pool, calculate, path, scores)
+        pending.append((map_id, len(scores), future))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        map_id = None
+        hash = None
+        scores = []
+
+        async for row in services.sql.stream(
+            "SELECT s.id, b.map_id, b.hash, s.mods, s.max_combo, "
+            "s.count_miss, s.accuracy "
+            "FROM scores s INNER JOIN beatmaps b ON b.hash = s.hash_md5 "
+            f"WHERE b.approved IN ({', '.join(str(a.value) for a in PP_MAPS)}) "
+            "AND s.status >= 2 AND b.map_id > %s ORDER BY b.map_id, b.hash",
+            (after),
+        ):
+            # every version of a map is calculated on its own .osu
+            if row["map_id"] != map_id or row["hash"] != hash:
+                if scores:
+                    submit(map_id, hash, scores)
+
+                map_id = row["map_id"]
+                hash = row["hash"]
+                scores = []
+
+                # keep the workers busy, but don't read ahead forever
+                while len(pending) >= workers * 4:
+                    await finish_oldest()
+
+            scores.append(
+                (
+                    row["id"],
+                    row["mods"],
+                    row["max_combo"],
+                    row["count_miss"],
+                    row["accuracy"],
+                )
+            )
+
+        if scores:
+            submit(map_id, hash, scores)
+
+        while pending:
+            await finish_oldest()
+
+    if pending_rows:
+        await write(pending_rows, batch)
+
+    progress.report(map_id, force=True)
+
+
+async def reselect_relax_bests(batch: int) -> None:
+    start = time.time()
+    updates = []
+    group = None
+
+    # the same as on submission: the most pp, and the earlier score on a tie
+    async for row in services.sql.stream(
+        "SELECT s.id, s.user_id, s.hash_md5, s.mode, s.status FROM scores s "
+        "INNER JOIN beatmaps b ON b.hash = s.hash_md5 "
+        f"WHERE b.approved IN ({', '.join(str(a.value) for a in PP_MAPS)}) "
+        "AND s.relax = 1 AND s.status >= 2 "
+        "ORDER BY s.user_id, s.hash_md5, s.mode, s.pp DESC, s.submitted"
+    ):
+        best = (row["user_id"], row["hash_md5"], row["mode"]) != group
+        group = (row["user_id"], row["hash_md5"], row["mode"])
+
+        if (row["status"] == 3) != best:
+            updates.append((3 if best else 2, row["id"]))
+
+    for i in range(0, len(updates), batch):
+        await services.sql.executemany(
+            "UPDATE scores SET status = %s WHERE id = %s", updates[i : i + batch]
+        )
+
+    log.info(
+        f"Picked the relax bests again in {time.time() - start:.2f}s, "
+        f"{len(updates)} scores changed status"
+    )
+
+
+def totals(rows: list[tuple[float, float]]) -> tuple[int, float]:
+    # (pp, accuracy) of a players bests, sorted by pp
+    data = np.array(rows, dtype=np.float64)
+    pp, acc = TopScores.calculate(data[:, 0], data[:, 1])
+
+    return math.ceil(pp), round(acc, 2)
+
+
+async def rebuild_totals(batch: int) -> None:
+    start = time.time()
+    users = 0
+
+    for relax in (False, True):
+        table = ("stats", "stats_rx")[relax]
+
+        for mode in (Mode.OSU, Mode.TAIKO, Mode.CATCH, Mode.MANIA):
+            se = ("std", "taiko", "catch", "mania")[mode]
+            updates = []
+            user_id = None
+            rows = []
+
+            async for row in services.sql.stream(
+                "SELECT user_id, pp, accuracy FROM scores "
+                "WHERE status = 3 AND mode = %s AND relax = %s "
+                "ORDER BY user_id, pp DESC",
+                (mode.value, relax),
+            ):
+                if row["user_id"] != user_id:
+                    if rows:
+                        updates.append((*totals(rows), user_id))
+
+                    user_id = row["user_id"]
+                    rows = []
+
+                rows.append((row["pp"], row["accuracy"]))
+
+            if rows:
+                updates.append((*totals(rows), user_id))
+
+            for i in range(0, len(updates), batch):
+                await services.sql.executemany(
+                    f"UPDATE {table} SET pp_{se} = %s, accuracy_{se} = %s WHERE id = %s",
+                    updates[i : i + batch],
+                )
+
+            # the global rankings in redis
+            key = f"ragnarok:{'leaderboard' if not relax else 'leaderboard_rx'}:{mode.value}"
+
+            async with services.redis.pipeline(transaction=False) as pipe:
+                async for row in services.sql.stream(
+                    f"SELECT s.id, s.pp_{se} AS pp FROM {table} s "
+                    "INNER JOIN users u ON u.id = s.id WHERE u.privileges & 4"
+                ):
+                    pipe.zadd(key, {str(row["id"]): row["pp"]})
+
+                await pipe.execute()
+
+            users += len(updates)
+
+    log.info(f"Rebuilt {users} player totals in {time.time() - start:.2f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Recalculate pp of all scores.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--totals-only", action="store_true")
+    args = parser.parse_args()
+
+    services.sql = Database()
+    await services.sql.connect(services.config["mysql"])
+
+    redisconf = services.config["redis"]
+    services.redis = aioredis.from_url(
+        f"redis://{redisconf['username']}:{redisconf['password']}@{redisconf['host']}:{redisconf['port']}"
+    )
+
+    if not args.totals_only:
+        after = 0 if args.restart else load_progress()
+
+        if after:
+            log.info(f"Continuing after map {after}, pass --restart to start over.")
+
+        await recalculate_scores(args.workers, args.batch, after)
+
+        # done, so the next run starts from the beginning
+        if os.path.isfile(PROGRESS):
+            os.remove(PROGRESS)
+
+    await reselect_relax_bests(args.batch)
+    await rebuild_totals(args.batch)
+
+    log.info("Done! Run `!rankings rebuild` to update the beatmap rankings.")
+
+    await services.sql.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,194 @@
+"""
+Maintenance of the packed replay store. Except for export, only run this
+while the server is stopped, since the server keeps the index in memory.
+
+    migrate   moves the old one file per replay layout (.data/replays/{id}.osr)
+              into the segments; --delete removes the files afterwards
+    compact   rewrites segments where at most --threshold of the bytes are used
+    verify    checks the crc of every replay in every segment
+    export    writes full .osr files of every score (or only those of --user
+              or --map) to --out, --concurrency at a time
+
+    python -m tools.replays <migrate/compact/verify> [--delete] [--threshold 0.5]
+    python -m tools.replays export [--out .data/export] [--user 3] [--map md5] [--concurrency 8]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from lib.replaystore import ReplayStore
+from lib.database import Database
+from objects import services
+from utils import replay
+from utils import log
+import argparse
+import asyncio
+import time
+import os
+
+
+def migrate(store: ReplayStore, delete: bool) -> None:
+    files = []
+
+    for entry in os.scandir(store.path):
+        name, ext = os.path.splitext(entry.name)
+
+        if ext != ".osr":
+            continue
+
+        # replays used to be saved before their score had an id, as 0.osr
+        if not name.isdigit() or not int(name):
+            log.warn(f"Skipping {entry.name}, it doesn't belong to a score.")
+            continue
+
+        files.append((int(name), entry.path))
+
+    start = time.time()
+    moved = skipped = 0
+
+    for score_id, path in sorted(files):
+        if score_id in store:
+            skipped += 1
+            continue
+
+        with open(path, "rb") as f:
+            if data := f.read():
+                store.write(score_id, data)
+                moved += 1
+
+        if moved and not moved % 10000:
+            log.info(f"{moved}/{len(files)} replays moved")
+
+    # everything has to be on disk before any of the originals are gone
+    store.sync()
+
+    log.info(
+        f"Moved {moved} replays in {time.time() - start:.2f}s, "
+        f"{skipped} were already there."
+    )
+
+    if delete:
+        for _, path in files:
+            os.remove(path)
+
+        log.info(f"Removed {len(files)} old replay files.")
+
+
+def verify(store: ReplayStore) -> None:
+    count = 0
+
+    for n in sorted(store.sizes):
+        for score_id, offset, length in store.scan(n, verify=True):
+            count += 1
+
+    log.info(f"Checked {count} replays in {len(store.sizes)} segments.")
+
+
+def write_osr(path: str, parts: tuple) -> None:
+    # the replay itself is a view of the segment, so it's never copied
+    tmp = path + ".tmp"
+
+    with open(tmp, "wb") as f:
+        f.writelines(parts)
+
+    os.replace(tmp, path)
+
+
+async def export(
+    store: ReplayStore,
+    out: str,
+    user_id: int,
+    map_md5: str,
+    concurrency: int,
+) -> None:
+    os.makedirs(out, exist_ok=True)
+
+    services.sql = Database()
+    await services.sql.connect(services.config["mysql"])
+
+    where, params = [], []
+
+    if user_id:
+        where.append("s.user_id = %s")
+        params.append(user_id)
+
+    if map_md5:
+        where.append("s.hash_md5 = %s")
+        params.append(map_md5)
+
+    query = replay.HEADER_QUERY
+
+    if where:
+        query += " WHERE " + " AND ".join(where)
+
+    # small, so reading the scores waits on the writers instead of piling up
+    queue: asyncio.Queue = asyncio.Queue(concurrency * 4)
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(concurrency, thread_name_prefix="export")
+
+    start = time.time()
+    exported = 0
+
+    async def worker() -> None:
+        nonlocal exported
+
+        while (row := await queue.get()) is not None:
+            header = replay.build_header(row)
+            parts = replay.osr(header, store.view(row["id"]), row["id"])
+            path = os.path.join(out, f"{row['id']}.osr")
+
+            await loop.run_in_executor(pool, write_osr, path, parts)
+            exported += 1
+
+            if not exported % 10000:
+                log.info(f"{exported} replays exported")
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+    try:
+        async for row in services.sql.stream(query, params):
+            if row["id"] in store:
+                await queue.put(row)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+
+        await asyncio.gather(*workers)
+        pool.shutdown()
+        await services.sql.disconnect()
+
+    log.info(f"Exported {exported} replays to {out} in {time.time() - start:.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the packed replay store.")
+    parser.add_argument("action", choices=("migrate", "compact", "verify", "export"))
+    parser.add_argument("--delete", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--out", default=".data/export")
+    parser.add_argument("--user", type=int, default=0)
+    parser.add_argument("--map", default="")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    store = ReplayStore()
+    store.load(
+        services.config["server"].get("replays", {}),
+        readonly=args.action in ("verify", "export"),
+    )
+
+    try:
+        if args.action == "export":
+            asyncio.run(
+                export(store, args.out, args.user, args.map, args.concurrency)
+            )
+        elif args.action == "migrate":
+            migrate(store, args.delete)
+        elif args.action == "compact":
+            removed, reclaimed = store.rewrite(args.threshold)
+            log.info(f"Compacted {removed} segments, freeing {reclaimed / 2**20:.1f}MB")
+        else:
+            verify(store)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,105 @@
-from objects.player import Player
-from objects.score import Score
+from typing import Any, Optional, Union
+from collections import OrderedDict
 from packets import writer
 from objects import services
 from hashlib import md5
-import aiofiles
 import struct
 
+# everything the .osr header needs, in one go
+HEADER_QUERY = (
+    "SELECT s.id, s.mode, s.hash_md5, u.username, s.count_300, s.count_100, "
+    "s.count_50, s.count_geki, s.count_katu, s.count_miss, s.score, "
+    "s.max_combo, s.perfect, s.mods, s.rank, s.submitted "
+    "FROM scores s JOIN users u ON u.id = s.user_id"
+)
 
-# where is this used?
-async def _write_replay(s: Score, replay=None, score_id: int = 0, file_name="") -> None:
-    if replay:
-        raw = await replay.read()
-    elif file_name:
-        async with aiofiles.open(file_name, "rb") as file:
-            raw = await file.read()
-
-    if score_id and not s:
-        play = await services.sql.fetch(
-            "SELECT s.id, s.user_id, s.hash_md5, s.score, s.pp, s.count_300, "
-            "s.count_50, s.count_geki, s.count_katu, s.count_miss, s.count_100, "
-            "s.max_combo, s.accuracy, s.perfect, s.rank, s.mods, s.passed, "
-            "s.exited, s.play_time, s.mode, s.submitted, s.relax FROM scores s "
-            "WHERE s.id = %s LIMIT 1",
-            (score_id),
-        )
+# we just gonna use the latest version of osu
+VERSION = 20210520
 
-        user_info = await services.sql.fetch(
-            "SELECT username, id, privileges, passhash " "FROM users WHERE id = %s",
-            (play["user_id"]),
-        )
+# .net ticks (100ns since year 1) of the unix epoch
+EPOCH_TICKS = 621355968000000000
+
+_counts = struct.Struct("<hhhhhhih?i")
+
+# score id -> header, scores don't change after they're submitted
+_headers: OrderedDict[int, bytes] = OrderedDict()
 
-        s = Score(**play)
-        s.player = Player(**user_info)
 
+def build_header(row: dict[str, Any]) -> bytes:
+    """Everything in front of the replay data, except its length."""
     r_hash = md5(
-        f"{s.count_100 + s.count_300}o{s.count_50}o{s.count_geki}o"
-        f"{s.count_katu}t{s.count_miss}a{s.map.hash_md5}r{s.max_combo}e"
-        f"{bool(s.perfect)}y{s.player.username}o{s.score}u{s.rank}{s.mods}True".encode()
+        f"{row['count_100'] + row['count_300']}p{row['count_50']}o"
+        f"{row['count_geki']}o{row['count_katu']}t{row['count_miss']}a"
+        f"{row['hash_md5']}r{row['max_combo']}e{bool(row['perfect'])}y"
+        f"{row['username']}o{row['score']}u{row['rank']}{row['mods']}True".encode()
     ).hexdigest()
 
-    ret = bytearray()
+    return b"".join(
+        (
+            struct.pack("<bi", row["mode"], VERSION),
+            writer.write_str(row["hash_md5"]),
+            writer.write_str(row["username"]),
+            writer.write_str(r_hash),
+            _counts.pack(
+                row["count_300"],
+                row["count_100"],
+                row["count_50"],
+                row["count_geki"],
+                row["count_katu"],
+                row["count_miss"],
+                row["score"],
+                row["max_combo"],
+                row["perfect"],
+                row["mods"],
+            ),
+            writer.write_str(""),  # life bar
+            struct.pack("<q", EPOCH_TICKS + row["submitted"] * 10_000_000),
+        )
+    )
 
-    ret += struct.pack("<b", s.mode)
-    ret += await writer.write_int32(
-        20210520
-    )  # we just gonna use the latest version of osu
 
-    ret += (
-        await writer.write_str(s.map.hash_md5)
-        + await writer.write_str(s.player.username)
-        + await writer.write_str(r_hash)
+def osr(
+    header: bytes, raw: Union[bytes, memoryview], score_id: int
+) -> tuple[bytes, Union[bytes, memoryview], bytes]:
+    """
+    The parts of a whole .osr file, in order. The replay data is passed
+    along as is, so it can be written out without being copied first.
+    """
+    return (
+        header + struct.pack("<i", len(raw)),
+        raw,
+        struct.pack("<q", score_id),
     )
 
-    ret += struct.pack(
-        "<hhhhhhih?i",
-        s.count_300,
-        s.count_100,
-        s.count_50,
-        s.count_geki,
-        s.count_katu,
-        s.count_miss,
-        s.score,
-        s.max_combo,
-        s.perfect,
-        s.mods,
-    )
 
-    ret += await writer.write_str("")
+async def get_header(score_id: int) -> Optional[bytes]:
+    if header := _headers.get(score_id):
+        _headers.move_to_end(score_id)
+        return header
+
+    if not (
+        row := await services.sql.fetch(
+            HEADER_QUERY + " WHERE s.id = %s LIMIT 1", (score_id)
+        )
+    ):
+        return
+
+    header = _headers[score_id] = build_header(row)
+
+    if len(_headers) > services.config["server"].get("replays", {}).get(
+        "headers", 4096
+    ):
+        _headers.popitem(last=False)
+
+    return header
+
 
-    ret += struct.pack("<qi", s.submitted, len(raw))
-    ret += raw
+async def export(score_id: int) -> Optional[tuple]:
+    """The parts of the full .osr of a score, or None if it has no replay."""
+    if not (raw := await services.replays.get(score_id)):
+        return
 
-    ret += struct.pack("<q", s.id)
+    if not (header := await get_header(score_id)):
+        return
 
-    return ret
+    return osr(header, raw, score_id)